@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.acero as acero
+import pyarrow.compute as pc
+
+from fred_pop_gen.config import RNG
+from fred_pop_gen.constants import EmploymentAgeBucket, Enrollment, Grade
+from fred_pop_gen.utils import GRADES, get_grade_codes
+
+# lookup from `Enrollment` values to their members, used with `GRADES` when
+# materializing the Arrow tables as DataFrames
+ENROLLMENTS = np.array(list(Enrollment), dtype=object)
+
+# employment age bucket of every age, see `EmploymentAgeBucket.get_bucket`
+EMPLOYMENT_AGE_BUCKETS = np.array(
+    [EmploymentAgeBucket.get_bucket(age) for age in range(100)], dtype=object
+)
+
+
+def get_persons_source(p_df: pd.DataFrame) -> acero.Declaration:
+    """
+    Wraps the persons df in an Acero source. A `p_idx` column holding the
+    position of each person is added, which is used to restore the row order
+    after the (unordered) hash join and to rebuild the index when
+    materializing.
+    """
+    table = pa.Table.from_pandas(p_df, preserve_index=False)
+    table = table.append_column("p_idx", pa.array(np.arange(len(p_df))))
+
+    return get_table_source(table)
+
+
+def get_table_source(table: pa.Table) -> acero.Declaration:
+    """
+    Wraps an in-memory table in an Acero source.
+    """
+    return acero.Declaration("table_source", acero.TableSourceNodeOptions(table))
+
+
+def join_households(
+    persons: acero.Declaration, columns: list[str], hh_df: pd.DataFrame
+) -> acero.Declaration:
+    """
+    Joins the position of each person's household in the households df
+    (`hh_idx`) and their county onto the persons plan, the Arrow counterpart of
+    `task_merge_p_hh_df`. `columns` are the columns of the persons plan.
+    """
+    hh_table = pa.table(
+        {
+            "hh_id": pa.array(hh_df.index.to_numpy(), pa.string()),
+            "hh_idx": pa.array(np.arange(len(hh_df), dtype=np.int32)),
+            "county_fips": pa.array(hh_df["county_fips"], pa.string()),
+        }
+    )
+
+    return acero.Declaration(
+        "hashjoin",
+        acero.HashJoinNodeOptions(
+            "left outer",
+            left_keys="hh_id",
+            right_keys="hh_id",
+            left_output=columns,
+            right_output=["hh_idx", "county_fips"],
+        ),
+        inputs=[persons, get_table_source(hh_table)],
+    )
+
+
+def assign_grades(table: pa.Table) -> pa.Table:
+    """
+    Adds the `Grade` value of each person to a persons table (see
+    `get_grade_codes`), dropping non-school-aged persons.
+    """
+    grade = get_grade_codes(table.column("agep").to_numpy())
+    school_aged = grade >= 0
+
+    return table.filter(pa.array(school_aged)).append_column(
+        "grade", pa.array(grade[school_aged])
+    )
+
+
+def run_plan(plan: acero.Declaration) -> pa.Table:
+    """
+    Executes a persons plan on Arrow's thread pool and restores the original
+    row order of the persons.
+    """
+    return plan.to_table(use_threads=True).sort_by("p_idx")
+
+
+def draw_enrollment(
+    grades: np.ndarray, counties: np.ndarray, enrollment_df: pd.DataFrame
+) -> np.ndarray:
+    """
+    Draws the `Enrollment` value of each person from the enrollment proportions
+    of their county, the vectorized counterpart of
+    `task_assign_enrollment_to_persons`.
+
+    Every person consumes one uniform draw in row order and inverts the same
+    normalized cumulative distribution as `Generator.choice`, so the draws are
+    identical to the per-person `RNG.choice` calls of the pandas engine.
+    """
+    cdf = get_enrollment_cdf(grades, counties, enrollment_df)
+
+    samples = RNG.random(len(grades))
+
+    return (cdf <= samples[:, np.newaxis]).sum(axis=1)
+
+
+def get_enrollment_cdf(
+    grades: np.ndarray, counties: np.ndarray, enrollment_df: pd.DataFrame
+) -> np.ndarray:
+    """
+    Builds the normalized cumulative distribution of the `Enrollment` values of
+    each person from the enrollment proportions of their county, as an
+    (n_persons, n_enrollments) array.
+    """
+    rows = enrollment_df.index.get_indexer(counties)
+    assert (rows >= 0).all(), "persons are in counties without enrollment data"
+
+    p_non_prek = enrollment_df[["public", "private", "not_enrolled"]].to_numpy()
+    p_prek = enrollment_df[
+        ["public_prek", "private_prek", "not_enrolled_prek"]
+    ].to_numpy()
+
+    is_prek = (grades == Grade.PREK.value)[:, np.newaxis]
+    cdf = np.where(is_prek, p_prek[rows], p_non_prek[rows]).cumsum(axis=1)
+    cdf /= cdf[:, -1:]
+
+    return cdf
+
+
+def get_employment_probabilities(
+    age: np.ndarray,
+    is_male: np.ndarray,
+    counties: np.ndarray,
+    employment: dict[str, pd.DataFrame],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Looks up the employment proportion of the county, sex and age bucket of
+    each person, the vectorized counterpart of `assign_employment_to_persons`.
+    Returns a mask of the persons 16 or older, who are the only ones drawn,
+    and the proportion of each person (0 for persons under 16).
+    """
+    buckets = EMPLOYMENT_AGE_BUCKETS[np.minimum(age, 99)]
+    drawn = buckets != EmploymentAgeBucket.B_UNDER_16
+
+    p = np.zeros(len(age))
+    for sex, mask in [("male", drawn & is_male), ("female", drawn & ~is_male)]:
+        df = employment[sex]
+        rows = df.index.get_indexer(counties[mask])
+        cols = df.columns.get_indexer(buckets[mask])
+        p[mask] = df.to_numpy()[rows, cols]
+
+    return drawn, p
+
+
+def to_persons_df(
+    table: pa.Table, index: pd.Index, counties: list[str]
+) -> pd.DataFrame:
+    """
+    Materializes a persons table as the DataFrame produced by the pandas
+    engine: the index is rebuilt from `p_idx` (which is kept as an int32
+    column), the county becomes a categorical over the sorted `counties`, and
+    `grade` and `enrollment` values become `Grade` and `Enrollment` members.
+    """
+    df = table.drop_columns(["county_fips"]).to_pandas()
+    df.index = index[df["p_idx"].to_numpy()]
+    df["p_idx"] = df["p_idx"].astype("int32")
+
+    county_codes = pc.index_in(table.column("county_fips"), pa.array(counties))
+    df.insert(
+        df.columns.get_loc("hh_idx") + 1,
+        "county_fips",
+        pd.Categorical.from_codes(county_codes.to_numpy(), counties),
+    )
+
+    if "grade" in df:
+        df["grade"] = GRADES[df["grade"].to_numpy()]
+    if "enrollment" in df:
+        df["enrollment"] = ENROLLMENTS[df["enrollment"].to_numpy()]
+
+    return df
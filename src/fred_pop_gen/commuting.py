@@ -0,0 +1,317 @@
+import numpy as np
+import pandas as pd
+
+from fred_pop_gen.config import GRAVITY_DECAY_MILES, GRAVITY_RADIUS_MILES
+from fred_pop_gen.distance import (
+    EARTH_RADIUS,
+    get_distance_matrix,
+    get_paired_distances,
+    get_unit_vectors,
+)
+
+# length of a block group FIPS code (the prefix of a LODES block geocode)
+BLKGRP_FIPS_LENGTH = 12
+
+# number of origins whose candidate destinations are gathered at once when
+# building the gravity model
+ORIGIN_BATCH_SIZE = 1024
+
+
+def get_od_model(od_df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Builds a sparse commuting model from the observed LODES OD flows, with the
+    total number of jobs (`S000`) between every pair of home and work block
+    groups as weights, see `to_csr_model`.
+    """
+    flows = pd.DataFrame(
+        {
+            "origin": to_blkgrp_fips(od_df["h_geocode"]),
+            "destination": to_blkgrp_fips(od_df["w_geocode"]),
+            "jobs": od_df["S000"].to_numpy(),
+        }
+    )
+    flows = flows.groupby(["origin", "destination"], sort=False)["jobs"].sum()
+    flows = flows[flows > 0].reset_index()
+
+    origins, origin_codes = np.unique(flows["origin"], return_inverse=True)
+    destinations, destination_codes = np.unique(
+        flows["destination"], return_inverse=True
+    )
+
+    return to_csr_model(
+        origins,
+        destinations,
+        origin_codes,
+        destination_codes,
+        flows["jobs"].to_numpy(dtype=np.float64),
+    )
+
+
+def get_gravity_model(
+    wac_df: pd.DataFrame,
+    hh_df: pd.DataFrame,
+    radius: float = GRAVITY_RADIUS_MILES,
+    decay: float = GRAVITY_DECAY_MILES,
+) -> dict[str, np.ndarray]:
+    """
+    Builds a sparse distance-decay gravity model between the block groups of
+    the households, located at the centroid of their households, and the
+    block groups of the WAC job counts (`C000`). The weight of a destination
+    is its number of jobs times `exp(-distance / decay)`, and only destinations
+    within `radius` miles of an origin are kept, so the model grows with the
+    number of nearby block groups rather than the square of the number of
+    block groups. Origins with no destination within `radius` keep their
+    nearest destination.
+
+    Work block groups without households have no centroid and are dropped.
+    """
+    centroids = hh_df.groupby(hh_df["blkgrp_fips"].astype(str))[["lat", "lon"]].mean()
+
+    jobs = (
+        pd.Series(wac_df["C000"].to_numpy(), index=to_blkgrp_fips(wac_df["w_geocode"]))
+        .groupby(level=0)
+        .sum()
+    )
+    jobs = jobs[jobs.index.isin(centroids.index) & (jobs > 0)]
+
+    origins = centroids.index.to_numpy()
+    destinations = jobs.index.to_numpy()
+    dest_jobs = jobs.to_numpy(dtype=np.float64)
+
+    lat = centroids["lat"].to_numpy()
+    lon = centroids["lon"].to_numpy()
+    origin_vectors = get_unit_vectors(lat, lon, dtype="float64")
+    origin_cells = get_grid_cells(lat, lon, radius, np.abs(lat).max(initial=0))
+
+    dest_positions = centroids.index.get_indexer(destinations)
+    dest_vectors = origin_vectors[dest_positions]
+    dest_cells = origin_cells[dest_positions]
+
+    origin_codes, destination_codes, distances = get_pairs_within_radius(
+        origin_cells, dest_cells, origin_vectors, dest_vectors, radius
+    )
+
+    # origins without a destination within the radius keep their nearest
+    isolated = np.flatnonzero(np.bincount(origin_codes, minlength=len(origins)) == 0)
+    if len(isolated) and len(destinations):
+        nearest = get_distance_matrix(
+            origin_vectors[isolated], dest_vectors, n_threads=1
+        )
+        nearest_codes = nearest.argmin(axis=1)
+
+        origin_codes = np.concatenate([origin_codes, isolated])
+        destination_codes = np.concatenate([destination_codes, nearest_codes])
+        distances = np.concatenate(
+            [distances, nearest[np.arange(len(isolated)), nearest_codes]]
+        )
+
+    # the distances of each origin are taken relative to its nearest
+    # destination, which leaves the shares of its destinations unchanged but
+    # keeps exp from underflowing to all zeros (and the shares to NaN) when
+    # every destination is many `decay` miles away
+    nearest_distances = np.full(len(origins), np.inf)
+    np.minimum.at(nearest_distances, origin_codes, distances)
+    weights = dest_jobs[destination_codes] * np.exp(
+        -(distances - nearest_distances[origin_codes]) / decay
+    )
+
+    return to_csr_model(origins, destinations, origin_codes, destination_codes, weights)
+
+
+def get_grid_cells(
+    lat: np.ndarray, lon: np.ndarray, size: float, max_lat: float
+) -> np.ndarray:
+    """
+    Gets the (n, 2) integer cells of a grid with cells of `size` miles that
+    contain each point. Longitudes are scaled at `max_lat`, the latitude
+    farthest from the equator, where a degree of longitude is the shortest, so
+    two points within `size` miles are always in the same or adjacent cells.
+    """
+    scale = np.radians(1) * EARTH_RADIUS / size
+    lon_scale = scale * np.cos(np.radians(min(abs(max_lat), 89.0)))
+
+    return np.stack([np.floor(lat * scale), np.floor(lon * lon_scale)], axis=1).astype(
+        np.int64
+    )
+
+
+def get_pairs_within_radius(
+    origin_cells: np.ndarray,
+    dest_cells: np.ndarray,
+    origin_vectors: np.ndarray,
+    dest_vectors: np.ndarray,
+    radius: float,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds every origin-destination pair within `radius` miles, using a grid of
+    `radius`-sized cells (see `get_grid_cells`) as a spatial index: the
+    destinations are sorted by cell, and each origin only measures the
+    destinations of its own and the 8 adjacent cells. Origins are processed in
+    batches of `ORIGIN_BATCH_SIZE`. Returns the origin and destination
+    positions of the pairs and their distances.
+    """
+    empty = np.empty(0, dtype=np.int64)
+    if len(origin_cells) == 0 or len(dest_cells) == 0:
+        return empty, empty, np.empty(0)
+
+    # cells are shifted so that every neighbor of a cell has a positive key
+    low = np.minimum(origin_cells.min(axis=0), dest_cells.min(axis=0)) - 1
+    width = max(origin_cells[:, 1].max(), dest_cells[:, 1].max()) - low[1] + 2
+
+    def get_keys(cells: np.ndarray) -> np.ndarray:
+        return (cells[:, 0] - low[0]) * width + (cells[:, 1] - low[1])
+
+    dest_order = np.argsort(get_keys(dest_cells), kind="stable")
+    dest_keys = get_keys(dest_cells)[dest_order]
+    origin_keys = get_keys(origin_cells)
+
+    offsets = [dy * width + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+    origin_codes, destination_codes, distances = [], [], []
+    for start in range(0, len(origin_keys), ORIGIN_BATCH_SIZE):
+        batch = np.arange(start, min(start + ORIGIN_BATCH_SIZE, len(origin_keys)))
+
+        for offset in offsets:
+            keys = origin_keys[batch] + offset
+            first = np.searchsorted(dest_keys, keys, side="left")
+            counts = np.searchsorted(dest_keys, keys, side="right") - first
+
+            origins = np.repeat(batch, counts)
+            if len(origins) == 0:
+                continue
+
+            # position of each pair within the run of its origin's cell
+            runs = np.cumsum(counts) - counts
+            ranks = np.arange(len(origins)) - np.repeat(runs, counts)
+            dests = dest_order[np.repeat(first, counts) + ranks]
+
+            d = get_paired_distances(origin_vectors[origins], dest_vectors[dests])
+            within = d <= radius
+
+            origin_codes.append(origins[within])
+            destination_codes.append(dests[within])
+            distances.append(d[within])
+
+    if not origin_codes:
+        return empty, empty, np.empty(0)
+
+    return (
+        np.concatenate(origin_codes),
+        np.concatenate(destination_codes),
+        np.concatenate(distances),
+    )
+
+
+def to_csr_model(
+    origins: np.ndarray,
+    destinations: np.ndarray,
+    origin_codes: np.ndarray,
+    destination_codes: np.ndarray,
+    weights: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    Stores weighted origin-destination pairs as a CSR matrix, with the
+    destinations of origin `i` at `indices[indptr[i]:indptr[i + 1]]`.
+
+    Instead of the weights, `cdf` holds `i` plus the cumulative normalized
+    weights of each row, so the rows form one increasing array and the
+    destinations of any number of persons are drawn with a single
+    `np.searchsorted` (see `sample_destinations`).
+    """
+    order = np.lexsort((destination_codes, origin_codes))
+    origin_codes = origin_codes[order]
+    weights = weights[order]
+
+    counts = np.bincount(origin_codes, minlength=len(origins))
+    indptr = np.zeros(len(origins) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    shares = weights / np.bincount(origin_codes, weights, len(origins))[origin_codes]
+    cumulative = np.cumsum(shares)
+    rows = np.flatnonzero(counts)
+    row_start = np.repeat((cumulative - shares)[indptr[rows]], counts[rows])
+
+    cdf = origin_codes + (cumulative - row_start)
+    # the last entry of each row is exactly the start of the next
+    cdf[indptr[rows + 1] - 1] = rows + 1
+
+    return {
+        "origins": origins,
+        "destinations": destinations,
+        "indptr": indptr,
+        "indices": destination_codes[order].astype(np.int32),
+        "cdf": cdf,
+    }
+
+
+def sample_destinations(
+    model: dict[str, np.ndarray], origins: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Draws a destination for each origin from a model built by `to_csr_model`,
+    with one random number per origin. Returns the position of each
+    destination in `model["destinations"]`, or -1 for origins that are not in
+    the model or have no destination.
+    """
+    rows = pd.Index(model["origins"]).get_indexer(np.asarray(origins))
+    indptr = model["indptr"]
+
+    valid = rows >= 0
+    valid[valid] = indptr[rows[valid] + 1] > indptr[rows[valid]]
+
+    positions = np.searchsorted(
+        model["cdf"], rows[valid] + rng.random(valid.sum()), side="right"
+    )
+    # guard against rounding at the end of a row
+    positions = np.minimum(positions, indptr[rows[valid] + 1] - 1)
+
+    sampled = np.full(len(rows), -1, dtype=np.int64)
+    sampled[valid] = model["indices"][positions]
+
+    return sampled
+
+
+def sample_work_blkgrps(
+    od_model: dict[str, np.ndarray],
+    gravity_model: dict[str, np.ndarray],
+    home_blkgrps: np.ndarray,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    Draws the work block group of each person from the block group of their
+    home: from the observed OD flows if their home block group has any, and
+    from the gravity model otherwise. Persons whose home block group is in
+    neither model get None.
+
+    NOTE: workplaces are not assigned yet (see
+    `task_write_fred_population_files`), so nothing draws work block groups
+    yet. Only the models (`od_model_{STATE_FIPS}` and
+    `gravity_model_{STATE_FIPS}`) are built, if `COMMUTING_MODELS` is set, and
+    this is the sampler that workplace assignment is meant to use.
+    """
+    home_blkgrps = np.asarray(home_blkgrps, dtype=object)
+    work = np.full(len(home_blkgrps), None, dtype=object)
+
+    od_codes = sample_destinations(od_model, home_blkgrps, rng)
+    observed = od_codes >= 0
+    work[observed] = od_model["destinations"][od_codes[observed]]
+
+    fallback = np.flatnonzero(~observed)
+    gravity_codes = sample_destinations(gravity_model, home_blkgrps[fallback], rng)
+    found = gravity_codes >= 0
+    work[fallback[found]] = gravity_model["destinations"][gravity_codes[found]]
+
+    return work
+
+
+def to_blkgrp_fips(geocodes: pd.Series) -> np.ndarray:
+    """
+    Converts LODES block geocodes, which `pd.read_csv` reads as integers, to
+    the FIPS code of their block group.
+    """
+    return (
+        geocodes.astype(str)
+        .str.zfill(15)
+        .str[:BLKGRP_FIPS_LENGTH]
+        .to_numpy(dtype=object)
+    )
@@ -1,7 +1,9 @@
+import os
 from pathlib import Path
 
 from pytask import DataCatalog
 import numpy as np
+import pandas as pd
 
 # TODO: paramaterize and support multiple of each file
 STATE_FIPS = "56"
@@ -10,13 +12,125 @@ CENSUS_YEAR = 2019
 
 SEED = 123
 
+# number of workers used by stages that fan out over counties
+N_WORKERS = os.cpu_count() or 1
+
+# memory (in bytes) that the county jobs of a process pool may be predicted to
+# use at once (see `run_in_pool` and `get_pair_memory`), 80% of the physical
+# memory by default
+MEMORY_LIMIT = int(0.8 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+
+# whether to write the dry-run plan of public school assignment (see
+# `task_plan_public_school_assignment`), which needs the enrollment draws and
+# so is not part of the default build
+PLAN_COUNTIES = False
+
+# how stages that fan out over counties are executed, either "pool", which runs
+# all counties of a stage inside one task using a process pool, "tasks", which
+# generates a separate task per county (useful for debugging a county), or
+# "queue", which pushes the counties of public school assignment to a work
+# queue served by workers on any number of nodes (see `work_queue`)
+COUNTY_EXECUTION = "pool"
+
+# with COUNTY_EXECUTION = "tasks" or "queue", each task or queue item covers a
+# shard of consecutive counties rather than a single county to keep national
+# task graphs small: `SHARD_SIZE` counties, or if `SHARD_HOUSEHOLDS` is set, as
+# many counties as it takes to reach that many households (see
+# `get_county_shards`)
+SHARD_SIZE = 1
+SHARD_HOUSEHOLDS: int | None = None
+
+# with COUNTY_EXECUTION = "queue", a worker leases each item it claims for
+# `QUEUE_LEASE_SECONDS` and renews the lease every `QUEUE_HEARTBEAT_SECONDS`
+# while it runs; items whose lease expires (e.g. their node died) are claimed
+# again by another worker, and items that fail or expire
+# `QUEUE_MAX_ATTEMPTS` times are marked as failed (see `claim_item`)
+QUEUE_LEASE_SECONDS = 300
+QUEUE_HEARTBEAT_SECONDS = 30
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_POLL_SECONDS = 5
+
+# engine used by the tabular stages that prepare the persons (household merge,
+# grade and enrollment), either "pandas", the reference implementation,
+# "arrow", which runs them as multi-threaded Acero plans (see `arrow_engine`),
+# or "stream", which streams the persons file through them (and employment) in
+# batches of `STREAM_BATCH_SIZE` persons for states larger than memory
+DATAFRAME_ENGINE = "pandas"
+STREAM_BATCH_SIZE = 256 * 1024
+
+# unit assigned to schools, either "person" or "household", where siblings of
+# the same school level are assigned together (see `get_assignment_units`)
+SCHOOL_ASSIGNMENT_UNIT = "person"
+
+# floating point type of the person-school distances, either "float64" or
+# "float32", which halves their memory at an error of about 1e-3 miles (see
+# `get_distance_matrix`)
+DISTANCE_DTYPE = "float64"
+
+# maximum size (in bytes) of the distance cache, which keeps the distances
+# between the households and schools of each county across runs (see
+# `get_cached_distance_matrix`), evicting the least recently used matrices
+# beyond it; 0 disables the cache
+DISTANCE_CACHE_SIZE = 16 * 2**30
+
+# number of stochastic replicates of enrollment, employment and school
+# assignment generated from a single build of the deterministic stages (see
+# `task_generate_replicates`), 0 to disable
+N_REPLICATES = 0
+
+# whether to build the indexes of incremental school reassignment, which
+# update the assignment after school closures or capacity edits without
+# rerunning it (see `reassignment`)
+REASSIGNMENT_INDEX = False
+
+# localhost port of the resident service that answers scenario queries from
+# memory (see `daemon`)
+DAEMON_PORT = 8765
+
+# whether to build the commuting models of the LODES files (see
+# `task_build_commuting_models`), which workplace assignment is meant to draw
+# work block groups from but does not use yet
+COMMUTING_MODELS = False
+
+# work block groups of origins without observed LODES OD flows are drawn from
+# a gravity model of the WAC job counts, truncated to destinations within
+# `GRAVITY_RADIUS_MILES` of the origin and weighted by exp(-distance /
+# `GRAVITY_DECAY_MILES`) (see `get_gravity_model`)
+GRAVITY_RADIUS_MILES = 30
+GRAVITY_DECAY_MILES = 10
+
+# compression applied to the FRED population files, either None or "gzip"
+FRED_OUTPUT_COMPRESSION: str | None = None
+
 SRC = Path(__file__).parent.resolve()
 DATA = SRC.joinpath("..", "..", "data").resolve()
 
 DATA_CATALOG = DataCatalog()
 RNG = np.random.default_rng(SEED)
 
+# stages pass narrow projections of the persons between them (see
+# `project_persons`), which with copy-on-write share their columns until one
+# is written to, rather than copying the persons df
+pd.set_option("mode.copy_on_write", True)
+
 PERSONS_FILE = DATA / f"input/{STATE_FIPS}_{CENSUS_YEAR}_persons.parquet"
 HOUSEHOLDS_FILE = DATA / f"input/{STATE_ABBR}_{CENSUS_YEAR}_households.parquet"
 PUBLIC_SCHOOLS_FILE = DATA / "input/public-schools.csv"
 PRIVATE_SCHOOLS_FILE = DATA / "input/private-schools.csv"
+
+DISTANCE_CACHE_DIR = DATA / "cache/distances"
+
+# work queue (a SQLite file) and the inputs and outputs of its items, which
+# must be on storage shared by every node running workers
+QUEUE_FILE = DATA / "interim/work_queue.sqlite"
+QUEUE_DIR = DATA / "interim/queue"
+
+SCHOOL_STORE_DIR = DATA / "interim/school_store"
+SCHOOL_STORE_MANIFEST = DATA / "interim/school_store.json"
+
+# ACS 5-year table-based summary files (acsdt5y{year}-{table}.dat), imported
+# into the census store for every state; tables without a summary file are
+# fetched from the Census API instead
+CENSUS_SUMMARY_DIR = DATA / "input/acs"
+CENSUS_STORE_DIR = DATA / "interim/census_store"
+CENSUS_STORE_MANIFEST = DATA / "interim/census_store.json"
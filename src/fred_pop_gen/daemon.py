@@ -0,0 +1,501 @@
+"""
+A resident service that loads the population of a state once and answers
+scenario queries from memory, so that a query does not pay for starting
+Python, importing pandas and pytask, loading the data catalog and rebuilding
+the county and reassignment indexes.
+
+The service listens on localhost (`DAEMON_PORT`) and answers POST requests
+with a JSON body by an Arrow IPC stream:
+
+    /extract    {"table": "persons" | "households" | "schools", "county": FIPS}
+    /reassign   {"county": FIPS, "private": bool,
+                 "capacities": {school_id: capacity}, "closed": [school_id]}
+    /replicate  {"seed": int, "county": FIPS}
+
+where the county of a replicate is optional and private schools are
+reassigned for the whole state. `GET /status` lists the resident tables.
+
+Usage:
+
+    python -m fred_pop_gen.daemon serve
+    python -m fred_pop_gen.daemon extract TABLE COUNTY [--output PATH]
+    python -m fred_pop_gen.daemon reassign [--county FIPS] [--private]
+        [--close ID ...] [--capacity ID=CAPACITY ...] [--output PATH]
+    python -m fred_pop_gen.daemon replicate SEED [--county FIPS] [--output PATH]
+    python -m fred_pop_gen.daemon status
+
+where the Arrow stream is written to PATH, or to stdout by default. Every
+command takes `--port PORT` to use another port than `DAEMON_PORT`.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import traceback
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from fred_pop_gen.config import DAEMON_PORT, DATA_CATALOG, STATE_FIPS
+from fred_pop_gen.constants import Enrollment
+from fred_pop_gen.reassignment import build_reassignment_index, reassign_schools
+from fred_pop_gen.task_generate_replicates import generate_replicates
+from fred_pop_gen.utils import filter_df_by_counties, project_persons
+
+DAEMON_HOST = "127.0.0.1"
+
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+
+# data catalog entries loaded when the service starts, the others are loaded
+# by the first request that needs them
+RESIDENT_ENTRIES = [
+    "persons_w_school",
+    "households",
+    "public_schools",
+    "private_schools",
+]
+
+
+class Resident:
+    """
+    The data catalog entries and indexes kept in memory by the service. Every
+    entry is loaded at most once, and indexes are built at most once. Each
+    entry and index is held as a future, so that the lock shared by the
+    request threads is only held to look them up: a request loading or
+    building one only blocks the requests waiting for the same one.
+    """
+
+    def __init__(self):
+        self.entries: dict[str, Future] = {}
+        self.indexes: dict[tuple, Future] = {}
+        self.lock = threading.Lock()
+
+    def get_entry(self, name: str) -> Any:
+        """
+        Gets the data catalog entry `{name}_{STATE_FIPS}`, loading it on
+        first use. Raises a ValueError if the pipeline has not built it.
+        """
+
+        def load() -> Any:
+            try:
+                return DATA_CATALOG[f"{name}_{STATE_FIPS}"].load()
+            except FileNotFoundError:
+                raise ValueError(
+                    f"{name}_{STATE_FIPS} is not built, run pytask first"
+                ) from None
+
+        return self.get_or_build(self.entries, name, load)
+
+    def get_index(self, key: tuple, build: Callable[[], Any]) -> Any:
+        return self.get_or_build(self.indexes, key, build)
+
+    def get_or_build(self, futures: dict, key: Any, build: Callable[[], Any]) -> Any:
+        """
+        Gets the result of the future of `key` in `futures`, or builds it
+        outside the lock if there is none, so that concurrent requests for the
+        same key wait for a single build. A failed build is forgotten, so the
+        next request builds it again.
+        """
+        with self.lock:
+            future = futures.get(key)
+            owner = future is None
+            if owner:
+                future = futures[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(build())
+            except BaseException as e:
+                with self.lock:
+                    del futures[key]
+                future.set_exception(e)
+
+        return future.result()
+
+    def get_loaded_entries(self) -> dict[str, Any]:
+        """
+        Gets the entries that are loaded, leaving out the ones being loaded.
+        """
+        with self.lock:
+            futures = dict(self.entries)
+
+        return {
+            name: future.result()
+            for name, future in futures.items()
+            if future.done() and future.exception() is None
+        }
+
+    def get_county_rows(self, table: str) -> dict[str, np.ndarray]:
+        """
+        Gets the positions of the rows of each county in a resident table.
+        The persons are located by the county of their household.
+        """
+
+        def build() -> dict[str, np.ndarray]:
+            counties = get_table(self, table)["county_fips"].to_numpy(dtype=object)
+            return pd.Series(counties).groupby(counties).indices
+
+        return self.get_index(("county_rows", table), build)
+
+
+def get_table(resident: Resident, table: str) -> pd.DataFrame:
+    """
+    Gets a resident table of an extract: the persons (with their school and
+    the county of their household), the households, or the public and private
+    schools (with their `type`).
+    """
+    if table == "persons":
+
+        def build() -> pd.DataFrame:
+            p_df = resident.get_entry("persons_w_school")
+            hh_df = resident.get_entry("households")
+            counties = pd.Series(
+                hh_df["county_fips"].to_numpy(), index=hh_df.index.astype(str)
+            )
+            return p_df.assign(
+                county_fips=counties.reindex(p_df["hh_id"].astype(str)).to_numpy()
+            )
+
+        return resident.get_index(("table", table), build)
+
+    if table == "households":
+        return resident.get_entry("households")
+
+    if table == "schools":
+
+        def build() -> pd.DataFrame:
+            return pd.concat(
+                [
+                    resident.get_entry("public_schools").assign(type="public"),
+                    resident.get_entry("private_schools").assign(type="private"),
+                ]
+            )
+
+        return resident.get_index(("table", table), build)
+
+    raise ValueError(f"unknown table {table!r}")
+
+
+def extract(resident: Resident, request: dict) -> pd.DataFrame:
+    """
+    Extracts the rows of a county from a resident table (see `get_table`).
+    """
+    df = get_table(resident, request["table"])
+    rows = resident.get_county_rows(request["table"]).get(
+        request["county"], np.empty(0, dtype=np.int64)
+    )
+
+    return df.iloc[rows]
+
+
+def reassign(resident: Resident, request: dict) -> pd.DataFrame:
+    """
+    Reassigns the public schools of a county, or the private schools of the
+    state, after closing schools and changing their capacities (see
+    `reassign_schools`). The reassignment index is built on first use, unless
+    the pipeline built them (see `REASSIGNMENT_INDEX`). Raises a ValueError if
+    no county is given for public schools.
+    """
+    private = request.get("private", False)
+    county = None if private else request.get("county")
+    if not private and county is None:
+        raise ValueError("a county is required to reassign public schools")
+    enrollment = Enrollment.PRIVATE if private else Enrollment.PUBLIC
+    sch_df = resident.get_entry("private_schools" if private else "public_schools")
+    if county is not None:
+        sch_df = sch_df.loc[sch_df["county_fips"] == county]
+
+    def build() -> dict[str, np.ndarray]:
+        try:
+            indexes = resident.get_entry("reassignment_index")
+            return indexes["private"] if private else indexes["public"][county]
+        except (ValueError, KeyError):
+            pass
+
+        return build_reassignment_index(
+            project_persons(resident.get_entry("persons_w_enrollment"), "school"),
+            sch_df,
+            resident.get_entry("households"),
+            resident.get_entry("school_households"),
+            enrollment,
+            county,
+        )
+
+    index = resident.get_index(("reassignment", private, county), build)
+
+    # schools are given by their id as a string, as in JSON
+    ids = sch_df.index.astype(str)
+    capacities = {
+        str(id): capacity for id, capacity in request.get("capacities", {}).items()
+    }
+    closed = [str(id) for id in request.get("closed", [])]
+    unknown = set(capacities).union(closed) - set(ids)
+    if unknown:
+        raise ValueError(f"unknown schools {sorted(unknown)}")
+
+    sch_df = sch_df.assign(
+        enrollment_total=pd.Series(capacities, dtype=np.float64)
+        .reindex(ids)
+        .fillna(pd.Series(sch_df["enrollment_total"].to_numpy(), index=ids))
+        .to_numpy()
+    )
+
+    return reassign_schools(index, sch_df.loc[~ids.isin(closed)]).reset_index()
+
+
+def replicate(resident: Resident, request: dict) -> pd.DataFrame:
+    """
+    Draws a replicate of enrollment, employment and school assignment from
+    the given seed (see `generate_replicates`), for every person in the order
+    of the persons file or for the persons of a county. Raises a ValueError
+    if the county has no persons.
+
+    NOTE: the replicate of a county is drawn for its persons and public
+    schools alone, so it differs from the persons of the county in the state
+    replicate of the same seed, and its private school students compete for
+    the private schools of the state among themselves.
+    """
+    p_df = resident.get_entry("persons_w_geo")
+    pubsch_df = resident.get_entry("public_schools")
+    privsch_df = resident.get_entry("private_schools")
+
+    county = request.get("county")
+    if county is not None:
+        p_df = filter_df_by_counties(p_df, [county])
+        pubsch_df = filter_df_by_counties(pubsch_df, [county])
+        if p_df.empty:
+            raise ValueError(f"no persons in county {county}")
+
+    enrollment, employed, school = generate_replicates(
+        p_df,
+        resident.get_entry("households"),
+        pubsch_df,
+        privsch_df,
+        resident.get_entry("enrollment_proportions"),
+        resident.get_entry("employment_proportions"),
+        n_replicates=1,
+        rng=np.random.default_rng(request["seed"]),
+    )
+
+    school_ids = np.concatenate(
+        [
+            pubsch_df.index.to_numpy(dtype=object),
+            privsch_df.index.to_numpy(dtype=object),
+            [None],
+        ]
+    )
+    df = pd.DataFrame(
+        {
+            "p_idx": p_df["p_idx"].to_numpy(),
+            "county_fips": p_df["county_fips"].to_numpy(dtype=object),
+            "enrollment": enrollment[0],
+            "employed": employed[0],
+            "school_id": school_ids[school[0]],
+        }
+    )
+
+    return df
+
+
+HANDLERS = {
+    "extract": extract,
+    "reassign": reassign,
+    "replicate": replicate,
+}
+
+
+def to_arrow_stream(df: pd.DataFrame) -> bytes:
+    """
+    Writes a DataFrame as an Arrow IPC stream. Object columns mixing types
+    (e.g. public school ids, which are integers, and private school ids) are
+    written as strings.
+    """
+    columns = {}
+    for column in df.columns:
+        try:
+            columns[str(column)] = pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[str(column)] = pa.array(
+                df[column].map(lambda value: None if value is None else str(value)),
+                pa.string(),
+            )
+    table = pa.table(columns)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server: "ResidentServer"
+
+    def do_GET(self) -> None:
+        if self.path != "/status":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        entries = {
+            name: list(getattr(entry, "shape", [len(entry)]))
+            for name, entry in self.server.resident.get_loaded_entries().items()
+        }
+        self.send_json(200, {"state": STATE_FIPS, "entries": entries})
+
+    def do_POST(self) -> None:
+        handler = HANDLERS.get(self.path.strip("/"))
+        if handler is None:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            request = json.loads(self.rfile.read(length) or b"{}")
+            body = to_arrow_stream(handler(self.server.resident, request))
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        # any other error of a handler is returned, keeping the service running
+        except Exception:  # noqa: BLE001
+            self.send_json(500, {"error": traceback.format_exc()})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", ARROW_STREAM_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ResidentServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, resident: Resident):
+        super().__init__((DAEMON_HOST, port), RequestHandler)
+        self.resident = resident
+
+
+def serve(port: int = DAEMON_PORT) -> None:
+    """
+    Loads the resident entries (see `RESIDENT_ENTRIES`) and the county
+    indexes of the extracts, and serves requests until interrupted.
+    """
+    resident = Resident()
+    for name in RESIDENT_ENTRIES:
+        resident.get_entry(name)
+    for table in ["persons", "households", "schools"]:
+        resident.get_county_rows(table)
+
+    with ResidentServer(port, resident) as server:
+        print(f"serving {STATE_FIPS} on http://{DAEMON_HOST}:{port}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def query(path: str, request: dict | None = None, port: int = DAEMON_PORT) -> bytes:
+    """
+    Sends a request to the service, returning the body of its response: an
+    Arrow IPC stream for POST requests (see `read_arrow_stream`), or JSON for
+    `status`. Raises a RuntimeError with the error of failed requests.
+    """
+    url = f"http://{DAEMON_HOST}:{port}/{path}"
+    data = None if request is None else json.dumps(request).encode()
+
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read())["error"]) from None
+
+
+def read_arrow_stream(data: bytes) -> pa.Table:
+    return pa.ipc.open_stream(data).read_all()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m fred_pop_gen.daemon",
+        description="Serves scenario queries of a resident population.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("serve", help="load the population and serve queries")
+    commands.add_parser("status", help="list the resident tables")
+
+    extract = commands.add_parser("extract", help="extract the rows of a county")
+    extract.add_argument("table", choices=["persons", "households", "schools"])
+    extract.add_argument("county")
+
+    reassign = commands.add_parser("reassign", help="reassign after school edits")
+    reassign.add_argument("--county")
+    reassign.add_argument("--private", action="store_true")
+    reassign.add_argument("--close", nargs="*", default=[], metavar="ID")
+    reassign.add_argument("--capacity", nargs="*", default=[], metavar="ID=CAPACITY")
+
+    replicate = commands.add_parser("replicate", help="draw a replicate")
+    replicate.add_argument("seed", type=int)
+    replicate.add_argument("--county")
+
+    for command in (extract, reassign, replicate):
+        command.add_argument("--output", default="-", help="Arrow stream file")
+    for command in commands.choices.values():
+        command.add_argument("--port", type=int, default=DAEMON_PORT)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.port)
+        return 0
+
+    if args.command == "status":
+        print(query("status", port=args.port).decode())
+        return 0
+
+    if args.command == "extract":
+        request = {"table": args.table, "county": args.county}
+    elif args.command == "reassign":
+        capacities = dict(edit.split("=", 1) for edit in args.capacity)
+        request = {
+            "county": args.county,
+            "private": args.private,
+            "closed": args.close,
+            "capacities": {id: float(capacity) for id, capacity in capacities.items()},
+        }
+    else:
+        request = {"seed": args.seed, "county": args.county}
+
+    try:
+        data = query(args.command, request, args.port)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    if args.output == "-":
+        sys.stdout.buffer.write(data)
+    else:
+        with open(args.output, "wb") as file:
+            file.write(data)
+    print(f"{read_arrow_stream(data).num_rows} rows", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+from fred_pop_gen.config import DISTANCE_CACHE_DIR, DISTANCE_CACHE_SIZE, N_WORKERS
+from fred_pop_gen.distance import get_distance_matrix
+
+# version of the cached matrices, to be bumped whenever `get_distance_matrix`
+# changes the distances it computes
+CACHE_VERSION = 1
+
+
+def get_cached_distance_matrix(
+    vectors1: np.ndarray,
+    vectors2: np.ndarray,
+    n_threads: int = N_WORKERS,
+    dir: Path = DISTANCE_CACHE_DIR,
+    max_size: int = DISTANCE_CACHE_SIZE,
+) -> np.ndarray | None:
+    """
+    Gets the distance matrix of two sets of unit vectors (see
+    `get_distance_matrix`) from the distance cache in `dir`, computing and
+    storing it on a miss. Matrices are content-addressed by the hash of the
+    vectors (see `get_cache_key`), so they are reused by any run with the same
+    locations, regardless of its seed or proportions, and stay valid when the
+    locations change. Hits are memory-mapped, so the processes of a pool share
+    them through the page cache.
+
+    Returns None if the matrix would be larger than `max_size`, in which case
+    it is neither computed nor cached.
+    """
+    dtype = np.result_type(vectors1, vectors2)
+    if len(vectors1) * len(vectors2) * dtype.itemsize > max_size:
+        return None
+
+    path = dir / f"{get_cache_key(vectors1, vectors2)}.npy"
+    try:
+        matrix = np.load(path, mmap_mode="r")
+        os.utime(path)
+        return matrix
+    except (FileNotFoundError, ValueError):
+        pass
+
+    matrix = get_distance_matrix(vectors1, vectors2, n_threads=n_threads)
+
+    dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as file:
+        np.save(file, matrix)
+    tmp_path.replace(path)
+
+    evict_least_recently_used(dir, max_size)
+
+    return matrix
+
+
+def get_cache_key(vectors1: np.ndarray, vectors2: np.ndarray) -> str:
+    """
+    Hashes the shapes, dtypes and values of two sets of unit vectors, which
+    fully determine their distance matrix.
+    """
+    digest = hashlib.blake2b(f"v{CACHE_VERSION}".encode(), digest_size=20)
+
+    for vectors in (vectors1, vectors2):
+        vectors = np.ascontiguousarray(vectors)
+        digest.update(f"{vectors.shape}{vectors.dtype.str}".encode())
+        digest.update(vectors.data)
+
+    return digest.hexdigest()
+
+
+def evict_least_recently_used(dir: Path, max_size: int) -> None:
+    """
+    Removes the least recently used matrices (by modification time, which is
+    updated on every hit) until the cache fits in `max_size` bytes. Matrices
+    removed while memory-mapped by another process stay readable by it.
+    """
+    entries = []
+    for path in dir.glob("*.npy"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_size:
+            break
+
+        path.unlink(missing_ok=True)
+        size -= entry_size
@@ -0,0 +1,413 @@
+"""
+Fingerprints of populations, used to verify that a change to the pipeline
+produces the same population as before.
+
+A fingerprint holds, for every county and column of a DataFrame, catalog node
+or output file, a hash of the column's values in a canonical row order along
+with summary statistics. Fingerprints are stored as JSON manifests and compared
+county by county, either exactly (by hash) or, for the stochastic stages, with a
+statistical tolerance on the summary statistics.
+
+Usage:
+
+    python -m fred_pop_gen.fingerprint write SOURCE MANIFEST [--households SOURCE]
+    python -m fred_pop_gen.fingerprint check SOURCE MANIFEST [--tolerance Z]
+    python -m fred_pop_gen.fingerprint compare MANIFEST MANIFEST [--tolerance Z]
+
+where SOURCE is the name of a data catalog entry (e.g. `persons_w_school_56`),
+a Parquet file or Hive-partitioned dataset, or a FRED population file.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+
+from fred_pop_gen.config import DATA_CATALOG
+
+# columns holding the county of each row, in order of preference, and the
+# number of leading characters of the column that form the county FIPS code
+COUNTY_COLUMNS = {
+    "county_fips": 5,
+    "county": None,
+    "stco": 5,
+    "blkgrp_fips": 5,
+    "stcotrbg": 5,
+}
+
+# columns holding the household of each row, used to look up the county of
+# rows without a county column
+HOUSEHOLD_COLUMNS = ["hh_id", "sp_hh_id"]
+
+# columns that identify a row, used to put the rows of files (which have no
+# index) in a canonical order
+ID_COLUMNS = ["sp_id", "hh_id", "id"]
+
+# county of the rows of sources without a county
+ALL_COUNTIES = "all"
+
+INDEX_COLUMN = "__index__"
+
+
+def fingerprint_source(source: str, households: str | None = None) -> dict:
+    """
+    Fingerprints a data catalog entry or output file, see `fingerprint_df`.
+    The rows of a source without a county column are assigned to counties
+    through their household, using the households of `households`, if given.
+    """
+    hh_counties = None
+    if households is not None:
+        hh_df = pd.concat(read_source(households))
+        hh_counties = pd.Series(
+            get_counties(hh_df).to_numpy(), index=hh_df.index.astype(str)
+        )
+
+    manifest = {"source": source, "counties": {}}
+    for df in read_source(source):
+        manifest["counties"] |= fingerprint_df(df, hh_counties)["counties"]
+
+    manifest["counties"] = dict(sorted(manifest["counties"].items()))
+
+    return manifest
+
+
+def fingerprint_df(df: pd.DataFrame, hh_counties: pd.Series | None = None) -> dict:
+    """
+    Fingerprints each county and column of `df`. The rows of each county are
+    put in the canonical order of their ids (the index), and each column is
+    hashed with BLAKE2b over a canonical encoding of its values (see
+    `hash_column`), so two DataFrames have the same
+    fingerprint if they hold the same rows, regardless of row order, index
+    dtype or numeric width. `hh_counties` maps household ids to counties for
+    DataFrames without a county column.
+    """
+    counties = get_counties(df, hh_counties)
+    ids = df.index.astype(str)
+
+    fingerprints = {}
+    for county, positions in counties.groupby(counties.to_numpy()).indices.items():
+        county_ids = ids.take(positions)
+        order = positions[np.argsort(county_ids, kind="stable")]
+
+        county_df = df.iloc[order]
+        columns = {INDEX_COLUMN: pd.Series(ids[order])}
+        columns |= {str(column): county_df[column] for column in county_df.columns}
+
+        fingerprints[str(county)] = {
+            column: fingerprint_column(values) for column, values in columns.items()
+        }
+
+    return {"counties": dict(sorted(fingerprints.items()))}
+
+
+def fingerprint_column(values: pd.Series) -> dict:
+    """
+    Gets the hash (see `hash_column`) and the summary statistics of a column
+    compared with a tolerance: the number of values and nulls, and the mean
+    and standard deviation of numeric columns.
+    """
+    nulls = values.isna().to_numpy()
+    fingerprint = {
+        "hash": hash_column(values),
+        "n": int(len(values)),
+        "nulls": int(nulls.sum()),
+    }
+
+    if is_numeric(values):
+        numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)[~nulls]
+        fingerprint["mean"] = float(numbers.mean()) if len(numbers) else 0.0
+        fingerprint["std"] = float(numbers.std()) if len(numbers) else 0.0
+
+    return fingerprint
+
+
+def hash_column(values: pd.Series) -> str:
+    """
+    Hashes the values of a column. Nulls are hashed as a mask, integers and
+    booleans as int64, floats as float64 and anything else as the UTF-8
+    strings of the values, with their lengths, so that the encoding is
+    unambiguous.
+    """
+    nulls = values.isna().to_numpy()
+    digest = hashlib.blake2b(nulls.astype(np.uint8).tobytes(), digest_size=16)
+
+    if is_numeric(values):
+        if values.dtype.kind == "f":
+            numbers = values.to_numpy(dtype=np.float64, na_value=0.0)
+        else:
+            numbers = values.to_numpy(dtype=np.int64, na_value=0)
+        numbers = np.where(nulls, 0, numbers)
+
+        digest.update(b"numeric")
+        digest.update(np.ascontiguousarray(numbers).tobytes())
+    else:
+        strings = pa.array(
+            values.astype("string").fillna("").to_numpy(dtype=object),
+            pa.large_string(),
+        )
+        _, offsets, data = strings.buffers()
+        offsets = np.frombuffer(offsets, dtype=np.int64)[: len(strings) + 1]
+
+        digest.update(b"string")
+        digest.update(np.diff(offsets).tobytes())
+        if data is not None:
+            digest.update(memoryview(data)[offsets[0] : offsets[-1]])
+
+    return digest.hexdigest()
+
+
+def is_numeric(values: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(values.dtype) and not isinstance(
+        values.dtype, pd.CategoricalDtype
+    )
+
+
+def get_counties(df: pd.DataFrame, hh_counties: pd.Series | None = None) -> pd.Series:
+    """
+    Gets the county of each row of `df` from its county column (see
+    `COUNTY_COLUMNS`), or through its household and `hh_counties`. Rows
+    without a county are assigned to `ALL_COUNTIES`.
+    """
+    for column, length in COUNTY_COLUMNS.items():
+        if column in df.columns:
+            counties = df[column].astype("string")
+            if length is not None:
+                counties = counties.str[:length]
+            return counties.fillna(ALL_COUNTIES).reset_index(drop=True)
+
+    if hh_counties is not None:
+        for column in HOUSEHOLD_COLUMNS:
+            if column in df.columns:
+                counties = df[column].astype(str).map(hh_counties)
+                return counties.fillna(ALL_COUNTIES).reset_index(drop=True)
+
+    return pd.Series([ALL_COUNTIES] * len(df))
+
+
+def read_source(source: str) -> Iterator[pd.DataFrame]:
+    """
+    Reads a fingerprint source as DataFrames: a data catalog entry in one
+    piece, a Hive-partitioned Parquet dataset one county at a time, so that a
+    national dataset is never held in memory, or a Parquet or FRED population
+    (CSV) file in one piece. The rows of files are indexed by their first id
+    column (see `ID_COLUMNS`).
+    """
+    path = Path(source)
+
+    if not path.exists():
+        node = DATA_CATALOG[source]
+        assert node.path.exists(), f"data catalog entry has not been built: {source}"
+        yield node.load()
+        return
+
+    if path.is_dir():
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        fragments: dict[str, list[ds.Fragment]] = {}
+        for fragment in dataset.get_fragments():
+            keys = ds.get_partition_keys(fragment.partition_expression)
+            fragments.setdefault(str(keys.get("county")), []).append(fragment)
+
+        for county, county_fragments in sorted(fragments.items()):
+            table = pa.concat_tables(
+                fragment.to_table(schema=dataset.schema)
+                for fragment in county_fragments
+            )
+            yield set_row_ids(table.to_pandas())
+    elif path.suffix == ".parquet":
+        yield set_row_ids(pd.read_parquet(path).reset_index(drop=True))
+    else:
+        table = pacsv.read_csv(
+            path,
+            convert_options=pacsv.ConvertOptions(
+                column_types={column: pa.string() for column in COUNTY_COLUMNS}
+                | {column: pa.string() for column in ID_COLUMNS + HOUSEHOLD_COLUMNS},
+                # FRED writes nulls (e.g. a person without a school) as empty
+                strings_can_be_null=True,
+            ),
+        )
+        yield set_row_ids(table.to_pandas())
+
+
+def set_row_ids(df: pd.DataFrame) -> pd.DataFrame:
+    for column in ID_COLUMNS:
+        if column in df.columns:
+            return df.set_index(column)
+
+    return df
+
+
+def compare_manifests(
+    expected: dict, actual: dict, tolerance: float | None = None
+) -> list[tuple[str, str, str]]:
+    """
+    Compares two fingerprints county by county and column by column, returning
+    the (county, column, reason) of every difference in that order, so the
+    first is the first differing county and column.
+
+    Without a `tolerance`, columns must have the same hash. With one, they
+    must have the same number of values, and their null fractions and means
+    may differ by at most `tolerance` standard errors (a z-score), which
+    accepts a rerun of the stochastic stages with a different seed.
+    """
+    differences = []
+
+    expected_counties = expected["counties"]
+    actual_counties = actual["counties"]
+    for county in sorted(expected_counties.keys() | actual_counties.keys()):
+        if county not in actual_counties:
+            differences.append((county, "", "county is missing"))
+            continue
+        if county not in expected_counties:
+            differences.append((county, "", "county is unexpected"))
+            continue
+
+        expected_columns = expected_counties[county]
+        actual_columns = actual_counties[county]
+        for column in list(expected_columns) + [
+            column for column in actual_columns if column not in expected_columns
+        ]:
+            if column not in actual_columns:
+                differences.append((county, column, "column is missing"))
+            elif column not in expected_columns:
+                differences.append((county, column, "column is unexpected"))
+            else:
+                reason = compare_columns(
+                    expected_columns[column], actual_columns[column], tolerance
+                )
+                if reason is not None:
+                    differences.append((county, column, reason))
+
+    return differences
+
+
+def compare_columns(
+    expected: dict, actual: dict, tolerance: float | None = None
+) -> str | None:
+    """
+    Compares the fingerprints of a column, see `compare_manifests`. Returns
+    the reason they differ, or None.
+    """
+    if tolerance is None:
+        if expected["hash"] != actual["hash"]:
+            return "values differ"
+        return None
+
+    if expected["n"] != actual["n"]:
+        return f"number of values differs: {expected['n']} != {actual['n']}"
+
+    n = expected["n"]
+    if n == 0:
+        return None
+
+    p1, p2 = expected["nulls"] / n, actual["nulls"] / n
+    z = get_z_score(p1 - p2, p1 * (1 - p1) / n + p2 * (1 - p2) / n)
+    if z > tolerance:
+        return f"null fraction differs: {p1:.4f} != {p2:.4f} (z = {z:.1f})"
+
+    if "mean" in expected and "mean" in actual:
+        m1, m2 = expected["mean"], actual["mean"]
+        n1, n2 = max(n - expected["nulls"], 1), max(n - actual["nulls"], 1)
+        z = get_z_score(m1 - m2, expected["std"] ** 2 / n1 + actual["std"] ** 2 / n2)
+        if z > tolerance:
+            return f"mean differs: {m1:.4f} != {m2:.4f} (z = {z:.1f})"
+
+    return None
+
+
+def get_z_score(difference: float, variance: float) -> float:
+    """
+    Gets the z-score of a difference, which is infinite for any difference
+    between constant columns.
+    """
+    if variance == 0:
+        return 0.0 if difference == 0 else np.inf
+
+    return abs(difference) / np.sqrt(variance)
+
+
+def write_manifest(manifest: dict, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(manifest, indent=1))
+
+
+def read_manifest(path: Path) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+def report_differences(differences: list[tuple[str, str, str]]) -> int:
+    """
+    Prints the differences of `compare_manifests`, starting with the first
+    differing county and column, and returns the exit status of the CLI.
+    """
+    if not differences:
+        print("fingerprints match")
+        return 0
+
+    county, column, reason = differences[0]
+    print(f"first difference: county {county}, column {column or '-'}: {reason}")
+
+    counties = {county for county, _, _ in differences}
+    print(f"{len(differences)} differences in {len(counties)} counties")
+    for county, column, reason in differences[1:]:
+        print(f"  county {county}, column {column or '-'}: {reason}")
+
+    return 1
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m fred_pop_gen.fingerprint",
+        description="Fingerprints populations and compares their fingerprints.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    write = commands.add_parser("write", help="write the fingerprint of a source")
+    write.add_argument("source")
+    write.add_argument("manifest", type=Path)
+
+    check = commands.add_parser("check", help="check a source against a manifest")
+    check.add_argument("source")
+    check.add_argument("manifest", type=Path)
+
+    compare = commands.add_parser("compare", help="compare two manifests")
+    compare.add_argument("expected", type=Path)
+    compare.add_argument("actual", type=Path)
+
+    for command in (write, check):
+        command.add_argument(
+            "--households",
+            help="source of the households, for sources without a county column",
+        )
+    for command in (check, compare):
+        command.add_argument(
+            "--tolerance",
+            type=float,
+            help="maximum z-score of the statistics, rather than equal hashes",
+        )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        write_manifest(fingerprint_source(args.source, args.households), args.manifest)
+        return 0
+
+    if args.command == "check":
+        expected = read_manifest(args.manifest)
+        actual = fingerprint_source(args.source, args.households)
+    else:
+        expected = read_manifest(args.expected)
+        actual = read_manifest(args.actual)
+
+    return report_differences(compare_manifests(expected, actual, args.tolerance))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Any, Callable
+
+import numpy as np
+
+from fred_pop_gen.config import MEMORY_LIMIT, N_WORKERS
+
+# arrays attached to shared memory in each worker process, see
+# `_attach_shared_arrays`
+_SHARED_ARRAYS: dict[str, np.ndarray] = {}
+_SHARED_MEMORY: list[shared_memory.SharedMemory] = []
+
+
+def run_in_pool(
+    fn: Callable[..., Any],
+    jobs: list[tuple[float, tuple]],
+    arrays: dict[str, np.ndarray],
+    memory: list[int] | None = None,
+) -> list[Any]:
+    """
+    Runs `fn(arrays, *args)` for every `(cost, args)` job in a process pool and
+    returns the results in job order.
+
+    `arrays` are copied once into shared memory blocks which every worker
+    attaches to, so only the (small) job arguments and results are pickled.
+    Jobs are started in order of decreasing cost so that the largest jobs
+    (e.g. metro counties) do not start last and stretch the total run time.
+    Workers are started by a fork server rather than forked from the calling
+    process, whose threads (e.g. of pyarrow) may hold locks at the time of the
+    fork, so `fn` must be importable by the worker processes.
+
+    If the predicted `memory` of each job is given, jobs are only started
+    while the memory of the running jobs stays within `MEMORY_LIMIT`, so that
+    two giant jobs never run at once. When the next largest job does not fit,
+    its memory is reserved and only smaller jobs that fit alongside it are
+    started until it can run. A job that exceeds the limit on its own runs
+    alone.
+    """
+    blocks = []
+    specs = {}
+
+    try:
+        for name, array in arrays.items():
+            assert array.dtype != object, f"array {name} cannot be shared"
+
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            specs[name] = (block.name, array.shape, array.dtype.str)
+
+        pending = sorted(range(len(jobs)), key=lambda i: jobs[i][0], reverse=True)
+        if memory is None:
+            memory = [0] * len(jobs)
+
+        with ProcessPoolExecutor(
+            max_workers=N_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_attach_shared_arrays,
+            initargs=(specs,),
+        ) as executor:
+            futures = {}
+            running = {}
+
+            while pending or running:
+                used = sum(memory[i] for i in running.values())
+                reserved = None
+
+                for i in list(pending):
+                    if len(running) >= N_WORKERS:
+                        break
+
+                    fits = used + (reserved or 0) + memory[i] <= MEMORY_LIMIT
+                    if running and not fits:
+                        if reserved is None:
+                            reserved = memory[i]
+                        continue
+
+                    futures[i] = executor.submit(_run_job, fn, jobs[i][1])
+                    running[futures[i]] = i
+                    pending.remove(i)
+                    used += memory[i]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    future.result()
+
+            return [futures[i].result() for i in range(len(jobs))]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def _attach_shared_arrays(specs: dict[str, tuple[str, tuple, str]]) -> None:
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _SHARED_MEMORY.append(block)
+        _SHARED_ARRAYS[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _run_job(fn: Callable[..., Any], args: tuple) -> Any:
+    return fn(_SHARED_ARRAYS, *args)
@@ -0,0 +1,93 @@
+from typing import Callable, TypeVar
+
+import numpy as np
+import pytask
+
+from fred_pop_gen.config import DISTANCE_CACHE_SIZE, DISTANCE_DTYPE, N_WORKERS
+from fred_pop_gen.constants import Grade
+from fred_pop_gen.utils import get_county_household_counts, get_county_shards
+
+T = TypeVar("T")
+
+# bytes held per eligible person-school pair while a county is assigned: the
+# edge columns and positions built by `get_distance_edges` (~40 B) and the
+# positions, eligible copies and band order built by `assign_schools_to_persons`
+# (~50 B). The household-school distance matrix is counted separately, see
+# `get_matrix_memory`
+BYTES_PER_PAIR = 96
+
+
+def count_eligible_pairs(
+    p_grades: np.ndarray,
+    p_codes: np.ndarray,
+    sch_grades: np.ndarray,
+    sch_codes: np.ndarray,
+    n_groups: int,
+) -> np.ndarray:
+    """
+    Counts the eligible person-school pairs (see `get_distance_edges`) of each
+    group of persons and schools (e.g. county), from the `Grade` value and
+    group code of every person and the grade mask and group code of every
+    school. Persons and schools with a code of -1 are not counted. This is the
+    number of pairs with person units, and an upper bound with household units.
+    """
+    n_grades = len(Grade)
+
+    p_valid = p_codes >= 0
+    persons = np.bincount(
+        p_codes[p_valid] * n_grades + p_grades[p_valid],
+        minlength=n_groups * n_grades,
+    ).reshape(n_groups, n_grades)
+
+    schools = np.zeros((n_groups, n_grades), dtype=np.int64)
+    for grade in range(n_grades):
+        offers = (sch_codes >= 0) & ((sch_grades >> grade) & 1).astype(bool)
+        schools[:, grade] = np.bincount(sch_codes[offers], minlength=n_groups)
+
+    return (persons * schools).sum(axis=1)
+
+
+def get_pair_memory(pairs: np.ndarray) -> np.ndarray:
+    """
+    Predicts the peak memory (in bytes) of assigning schools to a group with
+    the given number of eligible pairs.
+    """
+    return np.asarray(pairs, dtype=np.int64) * BYTES_PER_PAIR
+
+
+def get_matrix_memory(n_households: np.ndarray, n_schools: np.ndarray) -> np.ndarray:
+    """
+    Predicts the memory (in bytes) of the household-school distance matrices
+    (see `get_household_distances`) of groups with the given numbers of
+    candidate households and schools. The matrices are dense, so they also
+    hold the ineligible pairs. Matrices larger than `DISTANCE_CACHE_SIZE` are
+    never built (see `get_cached_distance_matrix`) and take no memory.
+    """
+    size = (
+        np.asarray(n_households, dtype=np.int64)
+        * np.asarray(n_schools, dtype=np.int64)
+        * np.dtype(DISTANCE_DTYPE).itemsize
+    )
+
+    return np.where(size <= DISTANCE_CACHE_SIZE, size, 0)
+
+
+def prioritize_shard(shard: str) -> Callable[[T], T]:
+    """
+    Marks the task of a county shard (see `get_county_shards`) with
+    `pytask.mark.try_first` if it is one of the `N_WORKERS` largest shards by
+    households, so that the scheduler starts them before the small ones.
+    pytask only supports these two priority levels, so the remaining shards
+    are left unmarked.
+    """
+    counts = get_county_household_counts()
+    sizes = {
+        key: counts.reindex(counties).fillna(0).sum()
+        for key, counties in get_county_shards().items()
+    }
+    largest = sorted(sizes, key=sizes.get, reverse=True)[:N_WORKERS]
+
+    if shard in largest:
+        return pytask.mark.try_first
+
+    return lambda task: task
@@ -0,0 +1,302 @@
+"""
+Incremental reassignment of schools after edits to the schools, such as a
+school closing or its capacity changing, without rerunning
+`assign_schools_to_persons`.
+
+The assignment visits the unit-school pairs in order of increasing distance
+(their rank), assigning a unit to a school unless it is already assigned or
+the school is full. After an edit, every decision is unchanged up to the first
+pair where a closed or resized school decides differently. From there, only
+the pairs of the units and schools whose state has diverged from the original
+assignment (a unit assigned elsewhere, a school with a different enrollment)
+can decide differently, so `reassign_schools` only replays those pairs, in
+rank order, as the edit cascades through the displaced units and the capacity
+they free or consume. The result is the same as a full reassignment with the
+edited schools.
+"""
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from fred_pop_gen.constants import Enrollment
+from fred_pop_gen.task_assign_schools import (
+    assign_edges_by_distance,
+    assign_leftover_units,
+    get_assignment_edges,
+    get_school_distances,
+)
+from fred_pop_gen.utils import filter_df_by_counties
+
+
+def get_reassignment_index(
+    p_df: pd.DataFrame, sch_df: pd.DataFrame, dist_df: pd.DataFrame
+) -> dict[str, np.ndarray]:
+    """
+    Assigns schools to the provided persons as `assign_schools_to_persons`
+    does, and keeps what `reassign_schools` needs to update the assignment:
+    the unit-school pairs by rank, the ranks of the pairs of each unit and
+    each school, and the rank of the pair that assigned each unit in the main
+    loop with the cumulative enrollment of each school along them.
+    """
+    units, first, weights, p_pos, sch_pos, distances = get_assignment_edges(
+        p_df, sch_df, dist_df
+    )
+    capacities = sch_df["enrollment_total"].to_numpy()
+    assignments = assign_edges_by_distance(
+        p_pos, sch_pos, distances, weights, capacities.tolist(), len(first)
+    )
+    schools = assign_leftover_units(assignments, p_pos, sch_pos, distances)
+
+    # the pairs in the order `iter_edges_by_distance` visits them
+    order = np.argsort(distances, kind="stable")
+    p_pos = p_pos[order]
+    sch_pos = sch_pos[order]
+
+    # a unit is paired with a school at most once, so the pair that assigned
+    # it is the one with its school
+    assigned_ranks = np.flatnonzero(assignments[p_pos] == sch_pos)
+    assigned_rank = np.full(len(first), -1)
+    assigned_rank[p_pos[assigned_ranks]] = assigned_ranks
+
+    unit_indptr, unit_ranks = group_ranks(p_pos, len(first))
+    sch_indptr, sch_ranks = group_ranks(sch_pos, len(sch_df))
+    enrollment_indptr, enrollment_ranks = group_ranks(
+        sch_pos[assigned_ranks], len(sch_df)
+    )
+    enrollment_ranks = assigned_ranks[enrollment_ranks]
+
+    # enrollment of each school after each of its assigning pairs
+    assigned_weights = weights[p_pos[enrollment_ranks]]
+    enrollment = np.cumsum(assigned_weights)
+    counts = np.diff(enrollment_indptr)
+    nonempty = counts > 0
+    enrollment -= np.repeat(
+        (enrollment - assigned_weights)[enrollment_indptr[:-1][nonempty]],
+        counts[nonempty],
+    )
+
+    return {
+        "p_ids": p_df.index.to_numpy(),
+        "units": units,
+        "weights": weights,
+        "sch_ids": sch_df.index.to_numpy(),
+        "capacities": capacities,
+        "p_pos": p_pos,
+        "sch_pos": sch_pos,
+        "assigned_rank": assigned_rank,
+        "schools": schools,
+        "unit_indptr": unit_indptr,
+        "unit_ranks": unit_ranks,
+        "sch_indptr": sch_indptr,
+        "sch_ranks": sch_ranks,
+        "enrollment_indptr": enrollment_indptr,
+        "enrollment_ranks": enrollment_ranks,
+        "enrollment": enrollment,
+    }
+
+
+def build_reassignment_index(
+    p_df: pd.DataFrame,
+    sch_df: pd.DataFrame,
+    hh_df: pd.DataFrame,
+    hh_candidates: np.ndarray,
+    enrollment: Enrollment,
+    county: str | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    Builds the reassignment index (see `get_reassignment_index`) of the
+    persons with the given `enrollment` and the schools of `sch_df`, within a
+    county if given, as public schools are assigned by county and private
+    schools by state. The distances of public schools are read from the
+    distance cache (see `get_household_distances`), while those of private
+    schools are only computed for the eligible pairs of their students.
+    """
+    p_df = p_df.loc[p_df["enrollment"] == enrollment]
+    if county is not None:
+        p_df = filter_df_by_counties(p_df, [county])
+        sch_df = filter_df_by_counties(sch_df, [county])
+        hh_counties = hh_df["county_fips"].to_numpy()[hh_candidates]
+        hh_candidates = hh_candidates[hh_counties == county]
+    else:
+        hh_candidates = None
+
+    dist_df = get_school_distances(p_df, sch_df, hh_df, hh_candidates)
+
+    return get_reassignment_index(p_df, sch_df, dist_df)
+
+
+def group_ranks(positions: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Groups the ranks of the pairs by unit or school `positions`, as a CSR
+    array holding the (increasing) ranks of group `i` at
+    `ranks[indptr[i]:indptr[i + 1]]`.
+    """
+    ranks = np.argsort(positions, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(positions, minlength=n), out=indptr[1:])
+
+    return indptr, ranks
+
+
+def reassign_schools(
+    index: dict[str, np.ndarray], sch_df: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Updates the assignment of an index built by `get_reassignment_index`
+    after edits to its schools, given as the edited schools df: schools that
+    are missing from it are closed, and changes to `enrollment_total` change
+    their capacity. Schools that are not in the index are not considered, as
+    their distances were never computed.
+
+    Returns the persons whose school changed, with their previous and new
+    school ids (`previous_school_id` and `school_id`, None if unassigned),
+    which are the differences with a full `assign_schools_to_persons` with the
+    edited schools.
+    """
+    capacities = (
+        sch_df["enrollment_total"]
+        .reindex(index["sch_ids"])
+        .to_numpy(dtype=np.float64, copy=True)
+    )
+    closed = np.isnan(capacities)
+    # no enrollment exceeds a capacity of -1, so closed schools are skipped
+    capacities[closed] = -1
+
+    overrides = replay_pairs(index, capacities)
+
+    # units left unassigned by the main loop go to their nearest open school
+    leftover = [unit for unit, sch in overrides.items() if sch < 0]
+    leftover += [
+        unit
+        for unit in np.flatnonzero(closed[index["schools"]] & (index["schools"] >= 0))
+        if unit not in overrides
+    ]
+    schools = dict(overrides)
+    for unit in leftover:
+        schools[unit] = get_nearest_open_school(index, unit, closed)
+
+    changed = np.array(
+        [unit for unit, sch in schools.items() if sch != index["schools"][unit]],
+        dtype=np.int64,
+    )
+    new_schools = index["schools"].copy()
+    new_schools[changed] = [schools[unit] for unit in changed.tolist()]
+
+    persons = np.flatnonzero(np.isin(index["units"], changed))
+    units = index["units"][persons]
+
+    return pd.DataFrame(
+        {
+            "previous_school_id": get_school_ids(index, index["schools"][units]),
+            "school_id": get_school_ids(index, new_schools[units]),
+        },
+        index=pd.Index(index["p_ids"][persons], name="p_id"),
+    )
+
+
+def replay_pairs(index: dict[str, np.ndarray], capacities: np.ndarray) -> dict:
+    """
+    Replays the main loop of the assignment with new school `capacities`
+    (see `reassign_schools`), only visiting the pairs of the units and
+    schools whose state may differ from the original assignment, starting with
+    every pair of the edited schools. Returns the position of the school
+    assigned to each unit whose state diverged, -1 if unassigned.
+    """
+    p_pos = index["p_pos"]
+    sch_pos = index["sch_pos"]
+    weights = index["weights"]
+    assigned_rank = index["assigned_rank"]
+    unit_indptr, unit_ranks = index["unit_indptr"], index["unit_ranks"]
+    sch_indptr, sch_ranks = index["sch_indptr"], index["sch_ranks"]
+
+    # units and schools whose state diverged, with the new school of the units
+    # and the difference in enrollment of the schools
+    overrides = {}
+    deltas = {}
+
+    edited = np.flatnonzero(capacities != index["capacities"]).tolist()
+    dirty_units = set()
+    dirty_schools = set(edited)
+    heap = [
+        int(rank)
+        for sch in edited
+        for rank in sch_ranks[sch_indptr[sch] : sch_indptr[sch + 1]]
+    ]
+    heapq.heapify(heap)
+
+    last = -1
+    while heap:
+        rank = heapq.heappop(heap)
+        if rank == last:
+            continue
+        last = rank
+
+        p, sch = int(p_pos[rank]), int(sch_pos[rank])
+
+        assigned = overrides[p] >= 0 if p in overrides else 0 <= assigned_rank[p] < rank
+        enrollment = get_enrollment(index, sch, rank) + deltas.get(sch, 0)
+        assigns = not assigned and not enrollment > capacities[sch]
+        assigned_before = assigned_rank[p] == rank
+
+        if assigns == assigned_before:
+            if assigns and p in overrides:
+                overrides[p] = sch
+            continue
+
+        if assigns:
+            overrides[p] = sch
+            deltas[sch] = deltas.get(sch, 0) + weights[p]
+        else:
+            overrides.setdefault(p, -1)
+            deltas[sch] = deltas.get(sch, 0) - weights[p]
+
+        # the later pairs of a diverged unit or school may decide differently
+        if p not in dirty_units:
+            dirty_units.add(p)
+            push_ranks(heap, unit_ranks[unit_indptr[p] : unit_indptr[p + 1]], rank)
+        if sch not in dirty_schools:
+            dirty_schools.add(sch)
+            push_ranks(heap, sch_ranks[sch_indptr[sch] : sch_indptr[sch + 1]], rank)
+
+    return overrides
+
+
+def get_enrollment(index: dict[str, np.ndarray], sch: int, rank: int) -> int:
+    """
+    Gets the enrollment of a school in the original assignment before the
+    pair of the given rank.
+    """
+    start, stop = index["enrollment_indptr"][sch : sch + 2]
+    n = np.searchsorted(index["enrollment_ranks"][start:stop], rank)
+
+    return int(index["enrollment"][start + n - 1]) if n else 0
+
+
+def push_ranks(heap: list[int], ranks: np.ndarray, rank: int) -> None:
+    for later in ranks[ranks > rank].tolist():
+        heapq.heappush(heap, later)
+
+
+def get_nearest_open_school(
+    index: dict[str, np.ndarray], unit: int, closed: np.ndarray
+) -> int:
+    """
+    Gets the position of the nearest school of a unit that is not closed, -1
+    if none, as `assign_leftover_units` does.
+    """
+    ranks = index["unit_ranks"][
+        index["unit_indptr"][unit] : index["unit_indptr"][unit + 1]
+    ]
+    schools = index["sch_pos"][ranks]
+    schools = schools[~closed[schools]]
+
+    return int(schools[0]) if len(schools) else -1
+
+
+def get_school_ids(index: dict[str, np.ndarray], positions: np.ndarray) -> np.ndarray:
+    """
+    Gets the ids of the schools at `positions`, None for -1 (unassigned).
+    """
+    return np.append(index["sch_ids"].astype(object), None)[positions]
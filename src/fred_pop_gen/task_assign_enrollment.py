@@ -4,42 +4,60 @@ import pandas as pd
 
 from fred_pop_gen.config import (
     DATA_CATALOG,
+    DATAFRAME_ENGINE,
     RNG,
     STATE_FIPS,
 )
 from fred_pop_gen.constants import Enrollment, Grade
+from fred_pop_gen.utils import join_columns, project_persons
 
 
-def task_assign_grade_to_persons(
-    p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]],
-) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_grade_{STATE_FIPS}"]]:
+if DATAFRAME_ENGINE == "pandas":
+
+    def task_assign_grade_to_persons(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]],
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_grade_{STATE_FIPS}"]]:
+        """
+        Maps persons' age to grade level, see `assign_grade_to_persons`.
+        """
+        return assign_grade_to_persons(p_df)
+
+    def task_assign_enrollment_to_persons(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_grade_{STATE_FIPS}"]],
+        enrollment_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"enrollment_proportions_{STATE_FIPS}"]
+        ],
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]]:
+        """
+        Assigns a random enrollment to all persons in the state, see
+        `assign_enrollment_to_persons`.
+        """
+        return assign_enrollment_to_persons(p_df, enrollment_df)
+
+
+def assign_grade_to_persons(p_df: pd.DataFrame) -> pd.DataFrame:
     """
     Maps persons' age to grade level, filtering out non-school-aged persons.
     """
-    p_df["grade"] = p_df["agep"].apply(map_age_to_grade)
+    p_df = project_persons(p_df, "grade")
+    grade = p_df["agep"].apply(map_age_to_grade)
+    p_df = join_columns(p_df, "grade", {"grade": grade})
 
     # drop non-school-aged people
-    p_df = p_df.loc[p_df["grade"].notna()]
+    p_df = p_df.loc[grade.notna().to_numpy()]
 
     return p_df
 
 
-def task_assign_enrollment_to_persons(
-    p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_grade_{STATE_FIPS}"]],
-    hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
-    enrollment_df: Annotated[
-        pd.DataFrame, DATA_CATALOG[f"enrollment_proportions_{STATE_FIPS}"]
-    ],
-) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]]:
+def assign_enrollment_to_persons(
+    p_df: pd.DataFrame, enrollment_df: pd.DataFrame
+) -> pd.DataFrame:
     """
     Assigns a random enrollment to all persons in the state using the generated
     enrollment proportions for each county.
     """
 
     def generate_random_enrollment(person: pd.Series) -> Enrollment:
-        hh_id = str(person["hh_id"])
-        assert hh_id in hh_df.index
-
         county = str(person["county_fips"])
         enrollment_probabilities = enrollment_df.loc[county]
 
@@ -62,8 +80,10 @@ def task_assign_enrollment_to_persons(
         i = RNG.choice(len(choices), 1, p=p)[0]
         return choices[i]
 
-    p_df["enrollment"] = p_df.apply(generate_random_enrollment, axis=1)
-    return p_df
+    p_df = project_persons(p_df, "enrollment")
+    enrollment = p_df.apply(generate_random_enrollment, axis=1)
+
+    return join_columns(p_df, "enrollment", {"enrollment": enrollment})
 
 
 def map_age_to_grade(age: int) -> Grade | None:
@@ -1,61 +1,261 @@
-from typing import Annotated, Any, cast
+from typing import Annotated, Dict, Iterator
 
 import pandas as pd
 import numpy as np
 from pytask import task
 
 from fred_pop_gen.config import (
+    COUNTY_EXECUTION,
     DATA_CATALOG,
+    N_WORKERS,
+    QUEUE_DIR,
+    SCHOOL_ASSIGNMENT_UNIT,
     STATE_FIPS,
 )
 from fred_pop_gen.constants import Enrollment, Grade
+from fred_pop_gen.distance import get_distance_matrix, get_unit_vectors
+from fred_pop_gen.distance_cache import get_cached_distance_matrix
+from fred_pop_gen.parallel import run_in_pool
+from fred_pop_gen.planning import (
+    count_eligible_pairs,
+    get_matrix_memory,
+    get_pair_memory,
+    prioritize_shard,
+)
 from fred_pop_gen.utils import (
-    get_county_fips,
-    haversine,
+    GRADES,
+    filter_df_by_counties,
+    gather_household_columns,
+    get_county_shards,
+    join_columns,
+    project_persons,
+)
+from fred_pop_gen.work_queue import (
+    connect,
+    read_input,
+    remove_stale_items,
+    remove_unused_inputs,
+    run_items,
+    write_input,
 )
 
+# lookup from `Grade` members to `Grade` values, see `GRADES` for the reverse
+GRADE_VALUES = {grade: grade.value for grade in Grade}
+
+# school levels of the `Grade` values (PREK, elementary, middle and high
+# school), which group siblings into household units, see
+# `get_assignment_units`
+SCHOOL_LEVELS = np.array([0, 1, 1, 1, 1, 1, 1, 2, 2, 2, 3, 3, 3, 3])
+
+# number of distance bands the person-school pairs are bucketed into, see
+# `iter_edges_by_distance`
+N_DISTANCE_BANDS = 256
+
+
+if COUNTY_EXECUTION == "tasks":
+    for _shard, _counties in get_county_shards().items():
+
+        @task(id=_shard)
+        def task_get_persons_for_public_school_assignment_in_shard(
+            counties: Annotated[list[str], _counties],
+            p_df: Annotated[
+                pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]
+            ],
+        ) -> Annotated[
+            pd.DataFrame, DATA_CATALOG[f"persons_w_pub_enrollment_{_shard}"]
+        ]:
+            """
+            Filters persons by county shard and public enrollment.
+            """
+            p_df = project_persons(p_df, "school")
 
-for _county in get_county_fips():
+            return p_df.loc[
+                p_df["county_fips"].isin(counties)
+                & (p_df["enrollment"] == Enrollment.PUBLIC)
+            ]
 
-    @task(id=_county)
-    def task_get_persons_for_public_school_assignment_in_county(
-        county: Annotated[str, _county],
+        @prioritize_shard(_shard)
+        @task(id=_shard)
+        def task_get_public_school_distances_in_shard(
+            counties: Annotated[list[str], _counties],
+            p_df: Annotated[
+                pd.DataFrame, DATA_CATALOG[f"persons_w_pub_enrollment_{_shard}"]
+            ],
+            sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{_shard}"]],
+            hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+            hh_candidates: Annotated[
+                np.ndarray, DATA_CATALOG[f"school_households_{STATE_FIPS}"]
+            ],
+        ) -> Annotated[
+            Dict[str, pd.DataFrame], DATA_CATALOG[f"public_hh_distance_{_shard}"]
+        ]:
+            """
+            Gets the school distances for public schools of each county in the
+            shard.
+            """
+            hh_counties = hh_df["county_fips"].to_numpy()[hh_candidates]
+
+            return {
+                county: get_school_distances(
+                    filter_df_by_counties(p_df, [county]),
+                    filter_df_by_counties(sch_df, [county]),
+                    hh_df,
+                    hh_candidates[hh_counties == county],
+                )
+                for county in counties
+            }
+
+        @prioritize_shard(_shard)
+        @task(id=_shard)
+        def task_assign_public_schools_in_shard(
+            counties: Annotated[list[str], _counties],
+            p_df: Annotated[
+                pd.DataFrame, DATA_CATALOG[f"persons_w_pub_enrollment_{_shard}"]
+            ],
+            sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{_shard}"]],
+            dist_dfs: Annotated[
+                Dict[str, pd.DataFrame], DATA_CATALOG[f"public_hh_distance_{_shard}"]
+            ],
+        ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_public_school_{_shard}"]]:
+            """
+            Assigns public schools by county within the shard.
+            """
+            return pd.concat(
+                [
+                    assign_schools_to_persons(
+                        filter_df_by_counties(p_df, [county]),
+                        filter_df_by_counties(sch_df, [county]),
+                        dist_dfs[county],
+                    )
+                    for county in counties
+                ]
+            )
+
+elif COUNTY_EXECUTION == "queue":
+
+    def task_assign_public_schools_in_queue(
         p_df: Annotated[
             pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]
         ],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_pub_enrollment_{_county}"]]:
+        sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        hh_candidates: Annotated[
+            np.ndarray, DATA_CATALOG[f"school_households_{STATE_FIPS}"]
+        ],
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"public_school_codes_{STATE_FIPS}"]]:
         """
-        Filters persons by county and public enrollment.
+        Assigns public schools by county shard through the work queue (see
+        `work_queue`), with an item per shard running
+        `assign_public_schools_in_shard`. This task serves the queue until
+        every shard is done, alongside the workers started on other nodes.
+        Returns the same codes as `task_assign_public_schools`.
         """
-        p_df = p_df.loc[p_df["county_fips"] == county]
+        p_df = project_persons(p_df, "school")
         p_df = p_df.loc[p_df["enrollment"] == Enrollment.PUBLIC]
 
-        return p_df
+        dir = QUEUE_DIR / STATE_FIPS
+        households = write_input(hh_df, dir / "inputs", "households")
+        hh_counties = hh_df["county_fips"].to_numpy()[hh_candidates]
 
-    @task(id=_county)
-    def task_get_public_school_distances_in_county(
-        p_df: Annotated[
-            pd.DataFrame, DATA_CATALOG[f"persons_w_pub_enrollment_{_county}"]
-        ],
-        sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{_county}"]],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"public_hh_distance_{_county}"]]:
-        """
-        Gets the school distances for public schools by county.
-        """
-        return get_school_distances(p_df, sch_df)
+        items = []
+        for shard, counties in get_county_shards().items():
+            shard_p_df = filter_df_by_counties(p_df, counties)
+            sch_positions = np.flatnonzero(sch_df["county_fips"].isin(counties))
+            shard_sch_df = sch_df.iloc[sch_positions]
+            _, _, jobs, _ = get_county_jobs(shard_p_df, shard_sch_df)
+
+            inputs = {
+                "p_df": shard_p_df,
+                "sch_df": shard_sch_df,
+                "sch_positions": sch_positions,
+                "hh_candidates": hh_candidates[np.isin(hh_counties, counties)],
+            }
+            items.append(
+                {
+                    "key": f"{STATE_FIPS}/public_schools/{shard}",
+                    "fn": f"{__name__}:assign_public_schools_in_shard",
+                    "args": {
+                        "inputs": str(write_input(inputs, dir / "inputs", shard)),
+                        "households": str(households),
+                    },
+                    "output": str(
+                        dir / "public_school_codes" / f"shard={shard}.parquet"
+                    ),
+                    "cost": sum(cost for cost, _ in jobs),
+                }
+            )
+
+        outputs = run_items(items)
+
+        # the inputs are content-addressed, so those of earlier runs (and of
+        # earlier shards) would otherwise pile up
+        conn = connect()
+        remove_stale_items(
+            conn,
+            f"{STATE_FIPS}/public_schools/",
+            [item["key"] for item in items],
+        )
+        remove_unused_inputs(conn, dir / "inputs")
+
+        return pd.concat([pd.read_parquet(output) for output in outputs])
+
+else:
 
-    @task(id=_county)
-    def task_assign_public_schools_in_county(
+    def task_assign_public_schools(
         p_df: Annotated[
-            pd.DataFrame, DATA_CATALOG[f"persons_w_pub_enrollment_{_county}"]
+            pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]
+        ],
+        sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        hh_candidates: Annotated[
+            np.ndarray, DATA_CATALOG[f"school_households_{STATE_FIPS}"]
         ],
-        sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{_county}"]],
-        dist_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_hh_distance_{_county}"]],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_public_school_{_county}"]]:
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"public_school_codes_{STATE_FIPS}"]]:
         """
-        Assigns public schools by county.
+        Assigns public schools by county, running all counties inside this task
+        using a process pool. Only the position of each person (`p_idx`) and of
+        their school in the public schools df (`school`) are returned, see
+        `collect_school_codes`.
         """
-        return assign_schools_to_persons(p_df, sch_df, dist_df)
+        p_df = project_persons(p_df, "school")
+        p_df = p_df.loc[p_df["enrollment"] == Enrollment.PUBLIC]
+
+        return assign_public_schools_in_pool(p_df, sch_df, hh_df, hh_candidates)
+
+
+def assign_public_schools_in_shard(inputs: str, households: str) -> pd.DataFrame:
+    """
+    Assigns public schools to the persons of a county shard on a worker of
+    the work queue (see `task_assign_public_schools_in_queue`), from the
+    inputs written by `write_input`. The schools are returned by their
+    position in the public schools df of the state.
+    """
+    inputs = read_input(inputs)
+
+    codes = assign_public_schools_in_pool(
+        inputs["p_df"],
+        inputs["sch_df"],
+        read_input(households),
+        inputs["hh_candidates"],
+    )
+    codes["school"] = np.append(inputs["sch_positions"], -1).astype(np.int32)[
+        codes["school"]
+    ]
+
+    return codes
+
+
+def task_get_school_households(
+    p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]],
+) -> Annotated[np.ndarray, DATA_CATALOG[f"school_households_{STATE_FIPS}"]]:
+    """
+    Gets the (sorted) positions of the households with school-aged persons,
+    whose distances to the public schools of their county are cached (see
+    `get_cached_distance_matrix`). They only depend on the ages of the
+    persons, so runs that only change the seed, proportions or capacities
+    reuse the cached distances.
+    """
+    return np.unique(p_df["hh_idx"].to_numpy())
 
 
 def task_get_persons_for_private_school_assignment(
@@ -64,6 +264,7 @@ def task_get_persons_for_private_school_assignment(
     """
     Filters persons by private enrollment.
     """
+    p_df = project_persons(p_df, "school")
     p_df = p_df.loc[p_df["enrollment"] == Enrollment.PRIVATE]
 
     return p_df
@@ -74,11 +275,14 @@ def task_get_private_school_distances(
         pd.DataFrame, DATA_CATALOG[f"persons_w_priv_enrollment_{STATE_FIPS}"]
     ],
     sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]],
+    hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
 ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"private_school_distances_{STATE_FIPS}"]]:
     """
-    Gets the school distances for private schools by state.
+    Gets the school distances for private schools by state. They are only
+    computed for the eligible pairs of the private school students, as the
+    distance cache only holds the matrices of the public schools of a county.
     """
-    return get_school_distances(p_df, sch_df)
+    return get_school_distances(p_df, sch_df, hh_df)
 
 
 def task_assign_private_schools(
@@ -96,33 +300,537 @@ def task_assign_private_schools(
     return assign_schools_to_persons(p_df, sch_df, dist_df)
 
 
-def get_school_distances(p_df: pd.DataFrame, sch_df: pd.DataFrame) -> pd.DataFrame:
+def get_school_distances(
+    p_df: pd.DataFrame,
+    sch_df: pd.DataFrame,
+    hh_df: pd.DataFrame,
+    hh_candidates: np.ndarray | None = None,
+) -> pd.DataFrame:
     """
-    Finds the distance between every possible pair of person and school in
-    the provided dataframes. The persons and school dataframes will form a
-    complete bipartite graph. The resulting dataframe will have the id of
-    the person and school forming the pair, as well as the distance between
-    the person (which is merged from the household df into the person df in
-    `task_merge_p_hh_df`) and the school.
+    Finds the distance between every eligible pair of person and school in
+    the provided dataframes, where a pair is eligible if the school offers the
+    grade level of the person. The resulting dataframe will have the id of the
+    person and school forming the pair, as well as the distance between the
+    person (located at their household, which is gathered from `hh_df` using
+    the household index set in `task_merge_p_hh_df`) and the school.
+
+    If the (sorted) positions of candidate households, which must include the
+    household of every person, are given, the distances are read from the
+    cached distances between the candidates and the schools (see
+    `get_household_distances`). This is only done for the public schools of a
+    county, as the cached matrices hold every household-school pair.
     """
-    p_idx, sch_idx = np.meshgrid(
-        p_df.index.to_numpy(), sch_df.index.to_numpy(), indexing="ij"
+    _, first, _, grade_masks = get_assignment_units(p_df, sch_df["grades"].to_numpy())
+    p_geo_df = gather_household_columns(p_df.iloc[first], hh_df, ["lat", "lon"])
+    sch_vectors = get_unit_vectors(sch_df["lat"], sch_df["lon"])
+
+    p_rows, matrix = None, None
+    if hh_candidates is not None:
+        hh_geo_df = hh_df[["lat", "lon"]].iloc[hh_candidates]
+        p_rows, matrix = get_household_distances(
+            hh_candidates,
+            get_unit_vectors(hh_geo_df["lat"], hh_geo_df["lon"]),
+            p_df["hh_idx"].to_numpy()[first],
+            sch_vectors,
+        )
+
+    return get_distance_edges(
+        p_df.index.to_numpy()[first],
+        get_unit_vectors(p_geo_df["lat"], p_geo_df["lon"]),
+        grade_masks,
+        sch_df.index.to_numpy(),
+        sch_vectors,
+        sch_df["grades"].to_numpy(),
+        p_rows=p_rows,
+        matrix=matrix,
     )
-    p_idx = p_idx.ravel()
-    sch_idx = sch_idx.ravel()
 
-    p_lat = p_df.loc[p_idx, "lat"].to_numpy()
-    p_lon = p_df.loc[p_idx, "lon"].to_numpy()
-    sch_lat = sch_df.loc[sch_idx, "lat"].to_numpy()
-    sch_lon = sch_df.loc[sch_idx, "lon"].to_numpy()
 
-    distances = haversine(p_lat, p_lon, sch_lat, sch_lon)
+def get_household_distances(
+    hh_idx: np.ndarray,
+    hh_vectors: np.ndarray,
+    p_hh_idx: np.ndarray,
+    sch_vectors: np.ndarray,
+    n_threads: int = N_WORKERS,
+) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """
+    Gets the distance matrix between candidate households, given by their
+    sorted positions in the households df (`hh_idx`) and unit vectors, and
+    schools from the distance cache (see `get_cached_distance_matrix`), along
+    with the row of the household of each person (`p_hh_idx`) in it. Returns
+    (None, None) if the matrix is too large to be cached.
+
+    The matrix is dense, so it also holds the pairs of households and schools
+    that do not offer the grades of their persons, and its memory is counted
+    separately from the eligible pairs (see `get_matrix_memory`).
+    """
+    matrix = get_cached_distance_matrix(hh_vectors, sch_vectors, n_threads=n_threads)
+    if matrix is None:
+        return None, None
+
+    p_rows = np.searchsorted(hh_idx, p_hh_idx)
+    assert (hh_idx[np.minimum(p_rows, len(hh_idx) - 1)] == p_hh_idx).all(), (
+        "persons in households that are not candidates"
+    )
+
+    return p_rows, matrix
+
+
+def get_assignment_units(
+    p_df: pd.DataFrame, sch_grades: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Groups the provided persons into the units that are assigned to schools.
+    Returns the position of the unit of each person, and for each unit the
+    position of its first person, its weight (number of persons) and the grade
+    mask of its persons (see `get_grade_mask`).
+
+    By default, each person is its own unit. With `SCHOOL_ASSIGNMENT_UNIT =
+    "household"`, the persons of the same household and school level (see
+    `SCHOOL_LEVELS`) form one unit, which is only paired with schools offering
+    the grades of all of its persons and consumes capacity for all of them at
+    once, so siblings attend the same school. Units whose grades are not all
+    offered by any school (`sch_grades`) are split back into persons.
+    """
+    grades = p_df["grade"].map(GRADE_VALUES).to_numpy(np.int64)
+    grade_masks = (1 << grades).astype(np.uint16)
+
+    if SCHOOL_ASSIGNMENT_UNIT == "person":
+        positions = np.arange(len(p_df))
+        return positions, positions, np.ones(len(p_df), dtype=np.int64), grade_masks
+
+    keys = p_df["hh_idx"].to_numpy(np.int64) * (SCHOOL_LEVELS.max() + 1)
+    keys += SCHOOL_LEVELS[grades]
 
-    df = pd.DataFrame({"p_id": p_idx, "sch_id": sch_idx, "distance": distances})
+    for split in [False, True]:
+        _, first, units, weights = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+
+        unit_grade_masks = np.zeros(len(first), dtype=np.uint16)
+        np.bitwise_or.at(unit_grade_masks, units, grade_masks)
+
+        if split:
+            break
+
+        offered = (unit_grade_masks[:, None] & ~np.unique(sch_grades)) == 0
+        not_offered = ~offered.any(axis=1)[units]
+        if not not_offered.any():
+            break
+
+        # give each person of a unit that is not offered a unique (negative) key
+        keys[not_offered] = -1 - np.flatnonzero(not_offered)
+
+    return units, first, weights, unit_grade_masks
+
+
+def get_distance_edges(
+    p_ids: np.ndarray,
+    p_vectors: np.ndarray,
+    p_grades: np.ndarray,
+    sch_ids: np.ndarray,
+    sch_vectors: np.ndarray,
+    sch_grades: np.ndarray,
+    n_threads: int = N_WORKERS,
+    p_rows: np.ndarray | None = None,
+    matrix: np.ndarray | None = None,
+) -> pd.DataFrame:
+    """
+    Builds the person-school edges described in `get_school_distances` from
+    plain arrays of ids, unit vectors (see `get_unit_vectors`) and grade masks
+    (see `get_grade_mask`) of the persons and schools. If a distance `matrix`
+    between locations and the schools is given (see
+    `get_household_distances`), the distances of each person are gathered
+    from its row `p_rows` rather than computed.
+
+    Only eligible pairs are materialized: the persons are grouped by grade,
+    and the distances of each group are only computed to the schools offering
+    that grade. The edges of each group are scattered so that they are ordered
+    by person and then by school, as if the ineligible pairs had been dropped
+    from the complete bipartite graph.
+    """
+    p_grades, groups = np.unique(p_grades, return_inverse=True)
+
+    # offers[group, sch] is set if the school offers every grade of the group
+    offers = (p_grades[:, None] & ~sch_grades[None, :]) == 0
+
+    n_edges = offers.sum(axis=1)[groups]
+    offsets = np.cumsum(n_edges) - n_edges
+
+    distances = np.empty(n_edges.sum(), dtype=np.result_type(p_vectors, sch_vectors))
+    sch_pos = np.empty(n_edges.sum(), dtype=np.int64)
+
+    for group in range(len(p_grades)):
+        grade_p_pos = np.flatnonzero(groups == group)
+        grade_sch_pos = np.flatnonzero(offers[group])
+        if len(grade_sch_pos) == 0:
+            continue
+
+        edges = offsets[grade_p_pos, None] + np.arange(len(grade_sch_pos))
+        if matrix is None:
+            distances[edges] = get_distance_matrix(
+                p_vectors[grade_p_pos], sch_vectors[grade_sch_pos], n_threads=n_threads
+            )
+        else:
+            distances[edges] = matrix[np.ix_(p_rows[grade_p_pos], grade_sch_pos)]
+        sch_pos[edges] = grade_sch_pos
+
+    df = pd.DataFrame(
+        {
+            "p_id": np.repeat(p_ids, n_edges),
+            "sch_id": sch_ids[sch_pos],
+            "distance": distances,
+        }
+    )
 
     return df
 
 
+def assign_public_schools_in_pool(
+    p_df: pd.DataFrame,
+    sch_df: pd.DataFrame,
+    hh_df: pd.DataFrame,
+    hh_candidates: np.ndarray,
+) -> pd.DataFrame:
+    """
+    Assigns public schools to the provided persons by county, where each
+    county runs `get_school_distances` and `assign_schools_to_persons` in a
+    process pool (see `run_in_pool`). The persons, schools and candidate
+    households (see `get_household_distances`) are sorted by county so each
+    county is a contiguous slice of the shared arrays.
+
+    Returns the `p_idx` of each person with the position of their school in
+    `sch_df` (`school`, -1 if unassigned).
+    """
+    p_order, sch_order, jobs, memory = get_county_jobs(p_df, sch_df)
+    hh_order, jobs, memory = add_household_slices(
+        jobs, memory, get_job_counties(p_df, sch_df), hh_candidates, hh_df
+    )
+
+    p_geo_df = gather_household_columns(p_df, hh_df, ["lat", "lon"])
+    hh_geo_df = hh_df[["lat", "lon"]].iloc[hh_candidates[hh_order]]
+
+    arrays = {
+        "p_vectors": get_unit_vectors(p_geo_df["lat"], p_geo_df["lon"])[p_order],
+        "p_grade": p_df["grade"].map(GRADE_VALUES).to_numpy(np.int8)[p_order],
+        "p_hh_idx": p_df["hh_idx"].to_numpy()[p_order],
+        "sch_vectors": get_unit_vectors(sch_df["lat"], sch_df["lon"])[sch_order],
+        "sch_grades": sch_df["grades"].to_numpy()[sch_order],
+        "sch_enrollment_total": sch_df["enrollment_total"].to_numpy()[sch_order],
+        "hh_idx": hh_candidates[hh_order],
+        "hh_vectors": get_unit_vectors(hh_geo_df["lat"], hh_geo_df["lon"]),
+    }
+
+    results = run_in_pool(_assign_public_schools_in_county, jobs, arrays, memory)
+
+    # positions of the assigned schools in `sch_order`, -1 if unassigned
+    sch_pos = np.full(len(p_df), -1)
+    for (_, (p_slice, *_)), county_sch_pos in zip(jobs, results):
+        sch_pos[p_slice[0] : p_slice[1]] = county_sch_pos
+
+    # -1 (unassigned) takes the appended -1
+    school = np.empty(len(p_df), dtype=np.int32)
+    school[p_order] = np.append(sch_order, -1)[sch_pos]
+
+    return pd.DataFrame({"p_idx": p_df["p_idx"].to_numpy(), "school": school})
+
+
+def get_county_jobs(
+    p_df: pd.DataFrame, sch_df: pd.DataFrame, by_county: bool = True
+) -> tuple[np.ndarray, np.ndarray, list[tuple[int, tuple]], list[int]]:
+    """
+    Sorts the persons and schools by county so that each county is a
+    contiguous slice, and builds a `run_in_pool` job for each county holding
+    the `(start, stop)` slices of its persons and schools. The cost of a job is
+    its number of eligible person-school pairs, which is also used to predict
+    its memory (see `count_eligible_pairs`). Persons in counties without
+    schools are sorted first and left out of every job. If `by_county` is
+    False, a single job holds every person and school.
+    """
+    counties = get_job_counties(p_df, sch_df, by_county)
+    p_codes = get_county_codes(p_df["county_fips"], counties)
+    sch_codes = get_county_codes(sch_df["county_fips"], counties)
+
+    p_order = np.argsort(p_codes, kind="stable")
+    sch_order = np.argsort(sch_codes, kind="stable")
+    p_bounds = np.searchsorted(p_codes[p_order], np.arange(len(counties) + 1))
+    sch_bounds = np.searchsorted(sch_codes[sch_order], np.arange(len(counties) + 1))
+
+    pairs = count_eligible_pairs(
+        p_df["grade"].map(GRADE_VALUES).to_numpy(np.int64),
+        p_codes.astype(np.int64),
+        sch_df["grades"].to_numpy(),
+        sch_codes.astype(np.int64),
+        len(counties),
+    )
+
+    jobs = []
+    for i in range(len(counties)):
+        p_slice = (p_bounds[i], p_bounds[i + 1])
+        sch_slice = (sch_bounds[i], sch_bounds[i + 1])
+        jobs.append((int(pairs[i]), (p_slice, sch_slice)))
+
+    return p_order, sch_order, jobs, get_pair_memory(pairs).tolist()
+
+
+def get_job_counties(
+    p_df: pd.DataFrame, sch_df: pd.DataFrame, by_county: bool = True
+) -> list[str | None]:
+    """
+    Gets the counties of the jobs of `get_county_jobs`, in job order: the
+    counties with both persons and schools, or a single None for the whole
+    state if `by_county` is False.
+    """
+    if not by_county:
+        return [None]
+
+    return sorted(set(p_df["county_fips"]) & set(sch_df["county_fips"]))
+
+
+def get_county_codes(values: pd.Series | np.ndarray, counties: list) -> np.ndarray:
+    """
+    Gets the position of the county of each value in `counties` (see
+    `get_job_counties`), -1 if none.
+    """
+    if counties == [None]:
+        return np.zeros(len(values), dtype=np.int8)
+
+    return pd.Categorical(values, categories=counties).codes
+
+
+def add_household_slices(
+    jobs: list[tuple[int, tuple]],
+    memory: list[int],
+    counties: list,
+    hh_candidates: np.ndarray,
+    hh_df: pd.DataFrame,
+) -> tuple[np.ndarray, list[tuple[int, tuple]], list[int]]:
+    """
+    Sorts the candidate households (see `get_household_distances`) by the
+    counties of `jobs` (see `get_job_counties`), keeping them sorted within
+    each county, and adds the `(start, stop)` slice of the households of its
+    county to the arguments of each job. The memory of each job is increased
+    by its household-school distance matrix (see `get_matrix_memory`).
+    Returns the order of the households with the updated jobs and memory.
+    """
+    hh_codes = get_county_codes(
+        hh_df["county_fips"].to_numpy()[hh_candidates], counties
+    )
+    hh_order = np.argsort(hh_codes, kind="stable")
+    hh_bounds = np.searchsorted(hh_codes[hh_order], np.arange(len(counties) + 1))
+
+    n_schools = [sch_slice[1] - sch_slice[0] for _, (_, sch_slice) in jobs]
+    memory = np.asarray(memory) + get_matrix_memory(np.diff(hh_bounds), n_schools)
+
+    jobs = [
+        (cost, (*args, (hh_bounds[i], hh_bounds[i + 1])))
+        for i, (cost, args) in enumerate(jobs)
+    ]
+
+    return hh_order, jobs, memory.tolist()
+
+
+def _assign_public_schools_in_county(
+    arrays: dict[str, np.ndarray],
+    p_slice: tuple[int, int],
+    sch_slice: tuple[int, int],
+    hh_slice: tuple[int, int],
+) -> np.ndarray:
+    """
+    Assigns public schools in one county from the shared arrays built in
+    `assign_public_schools_in_pool`. Persons and schools are identified by
+    their position in the shared arrays, and the position of each person's
+    assigned school is returned (-1 if unassigned).
+    """
+    p = slice(*p_slice)
+    sch = slice(*sch_slice)
+
+    p_df = pd.DataFrame(
+        {"grade": GRADES[arrays["p_grade"][p]], "hh_idx": arrays["p_hh_idx"][p]},
+        index=np.arange(*p_slice),
+    )
+    sch_df = pd.DataFrame(
+        {
+            "grades": arrays["sch_grades"][sch],
+            "enrollment_total": arrays["sch_enrollment_total"][sch],
+        },
+        index=np.arange(*sch_slice),
+    )
+    _, first, _, grade_masks = get_assignment_units(p_df, sch_df["grades"].to_numpy())
+
+    # counties already run in parallel, so the distances use a single thread
+    hh = slice(*hh_slice)
+    p_rows, matrix = get_household_distances(
+        arrays["hh_idx"][hh],
+        arrays["hh_vectors"][hh],
+        arrays["p_hh_idx"][p][first],
+        arrays["sch_vectors"][sch],
+        n_threads=1,
+    )
+    dist_df = get_distance_edges(
+        p_df.index.to_numpy()[first],
+        arrays["p_vectors"][p][first],
+        grade_masks,
+        sch_df.index.to_numpy(),
+        arrays["sch_vectors"][sch],
+        arrays["sch_grades"][sch],
+        n_threads=1,
+        p_rows=p_rows,
+        matrix=matrix,
+    )
+
+    p_df = assign_schools_to_persons(p_df, sch_df, dist_df)
+
+    return p_df["school_id"].fillna(-1).to_numpy(np.int64)
+
+
+def assign_replicate_schools(
+    p_df: pd.DataFrame,
+    enrolled: np.ndarray,
+    sch_df: pd.DataFrame,
+    hh_df: pd.DataFrame,
+    by_county: bool,
+) -> np.ndarray:
+    """
+    Assigns schools to the provided persons in every replicate of `enrolled`,
+    an (n_replicates, n_persons) mask of the persons enrolled in the schools
+    of `sch_df`. As in `assign_public_schools_in_pool`, each county (or the
+    whole state if `by_county` is False) runs in a process pool, but the
+    distances of a county are computed once for all of its persons and reused
+    by every replicate, which only keeps the pairs of its enrolled persons.
+    Only the persons enrolled in at least one replicate are candidates, so
+    that e.g. the private schools of the state are not paired with every
+    school-aged person. As in `get_school_distances`, the distances are only
+    read from the distance cache by county, with the households of all the
+    provided persons as candidates.
+
+    Returns the position of the school in `sch_df` assigned to each person in
+    each replicate (-1 if unassigned or not enrolled), as an
+    (n_replicates, n_persons) array.
+    """
+    school = np.full(enrolled.shape, -1, dtype=np.int32)
+    candidates = np.flatnonzero(enrolled.any(axis=0))
+    if len(candidates) == 0:
+        return school
+
+    # every household of the persons is a candidate, see
+    # `task_get_school_households`, but a state-wide matrix is not cached
+    hh_candidates = np.unique(p_df["hh_idx"].to_numpy()) if by_county else []
+    hh_candidates = np.asarray(hh_candidates, dtype=np.int64)
+
+    p_df = p_df.iloc[candidates]
+    enrolled = enrolled[:, candidates]
+    p_order, sch_order, jobs, memory = get_county_jobs(p_df, sch_df, by_county)
+
+    hh_order = np.arange(len(hh_candidates))
+    if by_county:
+        hh_order, jobs, memory = add_household_slices(
+            jobs, memory, get_job_counties(p_df, sch_df), hh_candidates, hh_df
+        )
+
+    p_geo_df = gather_household_columns(p_df, hh_df, ["lat", "lon"])
+    hh_geo_df = hh_df[["lat", "lon"]].iloc[hh_candidates[hh_order]]
+
+    arrays = {
+        "p_vectors": get_unit_vectors(p_geo_df["lat"], p_geo_df["lon"])[p_order],
+        "p_grade": p_df["grade"].map(GRADE_VALUES).to_numpy(np.int8)[p_order],
+        "p_hh_idx": p_df["hh_idx"].to_numpy()[p_order],
+        "p_enrolled": enrolled[:, p_order],
+        "sch_vectors": get_unit_vectors(sch_df["lat"], sch_df["lon"])[sch_order],
+        "sch_grades": sch_df["grades"].to_numpy()[sch_order],
+        "sch_enrollment_total": sch_df["enrollment_total"].to_numpy()[sch_order],
+        "hh_idx": hh_candidates[hh_order],
+        "hh_vectors": get_unit_vectors(hh_geo_df["lat"], hh_geo_df["lon"]),
+    }
+
+    results = run_in_pool(_assign_replicate_schools_in_county, jobs, arrays, memory)
+
+    for (_, (p_slice, *_)), county_sch_pos in zip(jobs, results):
+        # -1 (unassigned) takes the appended -1
+        school[:, candidates[p_order[p_slice[0] : p_slice[1]]]] = np.append(
+            sch_order, -1
+        )[county_sch_pos]
+
+    return school
+
+
+def _assign_replicate_schools_in_county(
+    arrays: dict[str, np.ndarray],
+    p_slice: tuple[int, int],
+    sch_slice: tuple[int, int],
+    hh_slice: tuple[int, int] | None = None,
+) -> np.ndarray:
+    """
+    Assigns schools in one county in every replicate from the shared arrays
+    built in `assign_replicate_schools`, returning the position of each
+    person's assigned school in the shared arrays (-1 if unassigned) as an
+    (n_replicates, n_persons) array. The distances are read from the distance
+    cache if the slice of the county's candidate households is given.
+    """
+    p = slice(*p_slice)
+    sch = slice(*sch_slice)
+
+    p_df = pd.DataFrame(
+        {"grade": GRADES[arrays["p_grade"][p]], "hh_idx": arrays["p_hh_idx"][p]},
+        index=np.arange(p_slice[1] - p_slice[0]),
+    )
+    sch_df = pd.DataFrame(
+        {
+            "grades": arrays["sch_grades"][sch],
+            "enrollment_total": arrays["sch_enrollment_total"][sch],
+        },
+        index=np.arange(*sch_slice),
+    )
+    sch_grades = sch_df["grades"].to_numpy()
+
+    # the pairs of every person (rather than unit), so that they hold the pairs
+    # of the units of any replicate, whose first person is one of its persons
+    grade_masks = (1 << arrays["p_grade"][p].astype(np.int64)).astype(np.uint16)
+    p_rows, matrix = None, None
+    if hh_slice is not None:
+        hh = slice(*hh_slice)
+        p_rows, matrix = get_household_distances(
+            arrays["hh_idx"][hh],
+            arrays["hh_vectors"][hh],
+            arrays["p_hh_idx"][p],
+            arrays["sch_vectors"][sch],
+            n_threads=1,
+        )
+    dist_df = get_distance_edges(
+        p_df.index.to_numpy(),
+        arrays["p_vectors"][p],
+        grade_masks,
+        sch_df.index.to_numpy(),
+        arrays["sch_vectors"][sch],
+        sch_grades,
+        n_threads=1,
+        p_rows=p_rows,
+        matrix=matrix,
+    )
+    dist_p_pos = dist_df["p_id"].to_numpy()
+
+    enrolled = arrays["p_enrolled"][:, p]
+    sch_pos = np.full(enrolled.shape, -1, dtype=np.int32)
+
+    for replicate in range(len(enrolled)):
+        positions = np.flatnonzero(enrolled[replicate])
+        replicate_p_df = p_df.iloc[positions]
+
+        # keep only the pairs of the first person of each unit
+        _, first, _, _ = get_assignment_units(replicate_p_df, sch_grades)
+        is_first = np.zeros(len(p_df), dtype=bool)
+        is_first[positions[first]] = True
+
+        replicate_p_df = assign_schools_to_persons(
+            replicate_p_df, sch_df, dist_df.loc[is_first[dist_p_pos]]
+        )
+        sch_pos[replicate, positions] = (
+            replicate_p_df["school_id"].fillna(-1).to_numpy(np.int64)
+        )
+
+    return sch_pos
+
+
 def assign_schools_to_persons(
     p_df: pd.DataFrame, sch_df: pd.DataFrame, dist_df: pd.DataFrame
 ) -> pd.DataFrame:
@@ -130,7 +838,10 @@ def assign_schools_to_persons(
     Assigns the provided persons to the provided schools using the distances
     computed in `get_school_distances`, which contain person-school pairs. The
     algorithm iterates through these pairs in order of increasing distance such
-    that the persons closest to schools will be assigned first.
+    that the persons closest to schools will be assigned first (see
+    `iter_edges_by_distance`). With household units (see
+    `get_assignment_units`), the pairs are between units, identified by their
+    first person, and schools.
 
     Assignment to a school will occur if:
         - The school still has remaining capacity
@@ -142,48 +853,17 @@ def assign_schools_to_persons(
     generated population, the computed enrollment proportions, and the reported
     school capacities.
     """
-    p_df["school_id"] = None
-
-    dist_df = dist_df.sort_values(by="distance", ascending=True)
-
-    # track current number of assigned students per school
-    enrollment = {sch_id: 0 for sch_id in sch_df.index.to_list()}
-
-    # track assignments to apply at end of loop
-    assignments = {}
-
-    # precompile eligible grades per school
-    eligible_grades = {
-        sch_id: Grade.range(Grade(sch["lowest_grade"]), Grade(sch["highest_grade"]))
-        for sch_id, sch in sch_df.iterrows()
-    }
-
-    for edge in dist_df.itertuples():
-        # cast to Any to avoid static typing issues with accessing
-        # NamedTuple fields
-        edge: Any = cast(Any, edge)
-
-        # skip if school is at capacity
-        capacity = sch_df.loc[edge.sch_id, "enrollment_total"]
-        if enrollment[edge.sch_id] > capacity:
-            continue
-
-        # skip if person was already assigned
-        if edge.p_id in assignments:
-            continue
-
-        # skip if person is not eligible for school
-        if p_df.loc[edge.p_id, "grade"] not in eligible_grades[edge.sch_id]:
-            continue
-
-        # assign
-        assignments.update({edge.p_id: edge.sch_id})
-        enrollment[edge.sch_id] += 1
-
-        # check for early exit
-        n_unassigned = len(p_df) - len(assignments)
-        if n_unassigned == 0:
-            break
+    units, first, weights, p_pos, sch_pos, distances = get_assignment_edges(
+        p_df, sch_df, dist_df
+    )
+    assignments = assign_edges_by_distance(
+        p_pos,
+        sch_pos,
+        distances,
+        weights,
+        sch_df["enrollment_total"].to_list(),
+        len(first),
+    )
 
     # compute a scale factor to ensure all students are assigned a school and
     # enrollment is evenly distributed
@@ -193,25 +873,16 @@ def assign_schools_to_persons(
         capacity_scale_factor = 1
 
     # assign leftover students to nearest school
-    def assign_person_to_nearest_school(p_id):
-        for edge in dist_df.loc[dist_df["p_id"] == p_id].itertuples():
-            # capacity = (
-            #     sch_df.loc[edge.sch_id, "enrollment_total"] * capacity_scale_factor
-            # )
-            # if enrollment[edge.sch_id] > capacity:
-            #     continue
-
-            if p_df.loc[p_id, "grade"] not in eligible_grades[edge.sch_id]:
-                continue
-
-            assignments.update({p_id: edge.sch_id})
-            enrollment[edge.sch_id] += 1
-            break
-
-    unassigned_df = p_df[~p_df.index.isin(assignments)]
-    unassigned_df.index.map(assign_person_to_nearest_school)
+    #
+    # NOTE: school capacities (scaled by `capacity_scale_factor`) are not
+    # enforced for leftover students
+    assignments = assign_leftover_units(assignments, p_pos, sch_pos, distances)
+    assignments = assignments[units]
 
-    p_df["school_id"] = p_df.index.map(assignments.get)
+    school_id = np.full(len(p_df), None, dtype=object)
+    assigned = assignments >= 0
+    school_id[assigned] = sch_df.index.to_numpy()[assignments[assigned]]
+    p_df = join_columns(p_df, "school", {"school_id": school_id})
 
     # TODO: handle case where there are no schools that offer PREK in county,
     # for now, we will leave them unassigned, as the numbers aren't too large
@@ -227,9 +898,141 @@ def assign_schools_to_persons(
     # some helpful debug statements:
     #
     # print(capacity_scale_factor)
-    # sch_df["enrollment"] = sch_df.index.map(lambda x: enrollment[x])
+    # sch_df["enrollment"] = enrollment
     # print(sch_df[["lowest_grade", "highest_grade", "enrollment", "enrollment_total"]])
     # print(unassigned_df[["grade"]])
     # assert unassigned_df.empty
 
     return p_df
+
+
+def get_assignment_edges(
+    p_df: pd.DataFrame, sch_df: pd.DataFrame, dist_df: pd.DataFrame
+) -> tuple[np.ndarray, ...]:
+    """
+    Gets the units of the provided persons (see `get_assignment_units`) and
+    the eligible unit-school pairs of the distances computed in
+    `get_school_distances`. Returns the unit of each person, and for each unit
+    the position of its first person in `p_df` and its weight, along with the
+    unit, school position and distance of each pair.
+    """
+    sch_grades = sch_df["grades"].to_numpy()
+    units, first, weights, grade_masks = get_assignment_units(p_df, sch_grades)
+
+    # units and schools are tracked by their position, with a unit being
+    # identified by the position of its first person in `p_df`
+    unit_pos = np.full(len(p_df), -1)
+    unit_pos[first] = np.arange(len(first))
+    p_pos = unit_pos[p_df.index.get_indexer(dist_df["p_id"])]
+    sch_pos = sch_df.index.get_indexer(dist_df["sch_id"])
+    distances = dist_df["distance"].to_numpy()
+
+    # drop pairs where the school does not offer the grade level of the person,
+    # as they are never assigned
+    eligible = (grade_masks[p_pos] & ~sch_grades[sch_pos]) == 0
+
+    return (
+        units,
+        first,
+        weights,
+        p_pos[eligible],
+        sch_pos[eligible],
+        distances[eligible],
+    )
+
+
+def assign_edges_by_distance(
+    p_pos: np.ndarray,
+    sch_pos: np.ndarray,
+    distances: np.ndarray,
+    weights: np.ndarray,
+    capacities: list,
+    n_units: int,
+) -> np.ndarray:
+    """
+    Runs the main loop of `assign_schools_to_persons` over the unit-school
+    pairs of `get_assignment_edges`. Returns the position of the school
+    assigned to each unit, -1 if unassigned.
+    """
+    # track current number of assigned students per school
+    enrollment = [0] * len(capacities)
+
+    # track the position of the school assigned to each unit, -1 if
+    # unassigned
+    assignments = [-1] * n_units
+    n_unassigned = n_units
+    weights = weights.tolist()
+
+    for edges in iter_edges_by_distance(distances):
+        for p, sch in zip(p_pos[edges].tolist(), sch_pos[edges].tolist()):
+            # skip if school is at capacity
+            if enrollment[sch] > capacities[sch]:
+                continue
+
+            # skip if person was already assigned
+            if assignments[p] >= 0:
+                continue
+
+            # assign
+            assignments[p] = sch
+            enrollment[sch] += weights[p]
+
+            # check for early exit
+            n_unassigned -= 1
+            if n_unassigned == 0:
+                break
+
+        if n_unassigned == 0:
+            break
+
+    return np.array(assignments, dtype=np.int64)
+
+
+def assign_leftover_units(
+    assignments: np.ndarray,
+    p_pos: np.ndarray,
+    sch_pos: np.ndarray,
+    distances: np.ndarray,
+) -> np.ndarray:
+    """
+    Assigns the units left unassigned by `assign_edges_by_distance` to their
+    nearest school regardless of its capacity, to account for inconsistencies
+    in the generated population, the computed enrollment proportions, and the
+    reported school capacities. Only the pairs of the leftover units are
+    ordered.
+    """
+    assignments = assignments.copy()
+    leftover = np.flatnonzero(assignments[p_pos] < 0)
+    leftover = leftover[np.lexsort((distances[leftover], p_pos[leftover]))]
+    _, nearest = np.unique(p_pos[leftover], return_index=True)
+    assignments[p_pos[leftover[nearest]]] = sch_pos[leftover[nearest]]
+
+    return assignments
+
+
+def iter_edges_by_distance(
+    distances: np.ndarray, n_bands: int = N_DISTANCE_BANDS
+) -> Iterator[np.ndarray]:
+    """
+    Yields the positions of the person-school pairs in order of increasing
+    distance, with ties in their original order. Rather than sorting every pair
+    up front, the pairs are bucketed into distance bands bounded by quantiles of
+    a sample of the distances (a linear-time radix sort of the band ids), and a
+    band is only sorted when it is reached. As assignment usually exits long
+    before the last pair, the sorting cost tracks the pairs that are consumed.
+    """
+    sample = distances[:: max(len(distances) // (n_bands * 64), 1)]
+    sample = sample[~np.isnan(sample)]
+    bounds = np.linspace(0, 1, n_bands + 1)[1:-1]
+    bounds = np.unique(np.quantile(sample, bounds)) if len(sample) else bounds[:0]
+
+    # missing distances are placed in the last band, where they sort last
+    bands = np.searchsorted(bounds, distances, side="right").astype(np.uint16)
+    order = np.argsort(bands, kind="stable")
+    ends = np.cumsum(np.bincount(bands, minlength=len(bounds) + 1))
+
+    start = 0
+    for end in ends:
+        edges = order[start:end]
+        yield edges[np.argsort(distances[edges], kind="stable")]
+        start = end
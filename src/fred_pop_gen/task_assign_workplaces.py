@@ -1,36 +1,73 @@
 from typing import Annotated, Dict
 
-from fred_pop_gen.config import DATA_CATALOG, RNG, STATE_FIPS
+from fred_pop_gen.config import (
+    COUNTY_EXECUTION,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    RNG,
+    STATE_FIPS,
+)
 from fred_pop_gen.constants import EmploymentAgeBucket
-from fred_pop_gen.utils import get_county_fips
+from fred_pop_gen.utils import get_county_shards, join_columns, project_persons
 import pandas as pd
 from pytask import task
 
 
-for _county in get_county_fips():
+# with the "stream" engine, employment is assigned while streaming the persons
+# (see `task_stream_persons`)
+if DATAFRAME_ENGINE != "stream" and COUNTY_EXECUTION == "tasks":
+    for _shard in get_county_shards():
 
-    @task(id=_county)
-    def task_assign_employment_to_persons_in_county(
-        county: Annotated[str, _county],
-        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{_county}"]],
+        @task(id=_shard)
+        def task_assign_employment_to_persons_in_shard(
+            p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{_shard}"]],
+            employment: Annotated[
+                Dict[str, pd.DataFrame],
+                DATA_CATALOG[f"employment_proportions_{STATE_FIPS}"],
+            ],
+        ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_employment_{_shard}"]]:
+            """
+            Assigns a random employment to persons by county shard.
+            """
+            return assign_employment_to_persons(p_df, employment)
+
+elif DATAFRAME_ENGINE != "stream":
+
+    def task_assign_employment_to_persons(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]],
         employment: Annotated[
             Dict[str, pd.DataFrame],
             DATA_CATALOG[f"employment_proportions_{STATE_FIPS}"],
         ],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_employment_{_county}"]]:
-        print(p_df)
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_employment_{STATE_FIPS}"]]:
+        """
+        Assigns a random employment to all persons in the state. The draws come
+        from the shared `RNG`, so this runs in a single process.
+        """
+        return assign_employment_to_persons(p_df, employment)
+
+
+def assign_employment_to_persons(
+    p_df: pd.DataFrame, employment: Dict[str, pd.DataFrame]
+) -> pd.DataFrame:
+    """
+    Assigns a random employment to the provided persons using the employment
+    proportions of their county, sex and age bucket.
+    """
+
+    def generate_random_employment(person: pd.Series) -> bool:
+        age = int(person["agep"])
+        sex = "male" if person["sex"] == 1 else "female"
 
-        def generate_random_employment(person: pd.Series) -> bool:
-            age = int(person["agep"])
-            sex = "male" if person["sex"] == 1 else "female"
+        bucket = EmploymentAgeBucket.get_bucket(age)
 
-            bucket = EmploymentAgeBucket.get_bucket(age)
+        if bucket == EmploymentAgeBucket.B_UNDER_16:
+            return False
 
-            if bucket == EmploymentAgeBucket.B_UNDER_16:
-                return False
+        p = employment[sex].loc[str(person["county_fips"])][bucket]
+        return RNG.random() < p
 
-            p = employment[sex].loc[county][bucket]
-            return RNG.random() < p
+    p_df = project_persons(p_df, "employment")
+    employed = p_df.apply(generate_random_employment, axis=1)
 
-        p_df["employed"] = p_df.apply(generate_random_employment, axis=1)
-        return p_df
+    return join_columns(p_df, "employment", {"employed": employed})
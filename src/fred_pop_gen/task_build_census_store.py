@@ -0,0 +1,171 @@
+import json
+import re
+from pathlib import Path
+from typing import Annotated
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from pytask import Product, PythonNode
+
+from fred_pop_gen.config import (
+    CENSUS_STORE_MANIFEST,
+    CENSUS_SUMMARY_DIR,
+    CENSUS_YEAR,
+    STATE_FIPS,
+)
+from fred_pop_gen.utils import census_api_table_call, get_census_store_path, hash_file
+
+# ACS tables read by the proportion tasks
+CENSUS_TABLES = ["B14003", "B23001"]
+
+SUMMARY_FILES = {
+    table: CENSUS_SUMMARY_DIR / f"acsdt5y{CENSUS_YEAR}-{table.lower()}.dat"
+    for table in CENSUS_TABLES
+}
+
+# GEO_ID prefix of counties (summary level 050) in the summary files
+COUNTY_GEO_ID_PREFIX = "0500000US"
+
+
+def get_summary_files_state(paths: dict[str, Path]) -> str:
+    """
+    Gets the state of the summary files when pytask checks the census store
+    task, rather than when the task module is imported, so that a summary file
+    added or replaced later reruns the task. Missing files are part of the
+    state, as their tables are fetched from the Census API instead.
+    """
+    return str(
+        {
+            table: (path.stat().st_size, path.stat().st_mtime_ns)
+            if path.exists()
+            else None
+            for table, path in sorted(paths.items())
+        }
+    )
+
+
+def task_build_census_store(
+    state: Annotated[str, PythonNode(value=STATE_FIPS, hash=True)],
+    summary_paths: Annotated[
+        dict[str, Path], PythonNode(value=SUMMARY_FILES, hash=get_summary_files_state)
+    ],
+    manifest_path: Annotated[Path, Product] = CENSUS_STORE_MANIFEST,
+) -> None:
+    """
+    Imports the ACS 5-year table-based summary files into the census store,
+    which holds every county of every state, partitioned by year and table, so
+    that state runs neither call the Census API nor need network access.
+
+    Tables without a summary file are fetched from the Census API for the
+    current state only, which is also how a state's rows are refreshed. The
+    source of each table (the hash of its summary file, or the states fetched
+    from the API) is recorded in the manifest, and a table is only updated when
+    its source changes or the current state is missing. The state is an input
+    of the task, so that a run for another state updates the store.
+    """
+    summary_paths = {
+        table: path for table, path in summary_paths.items() if path.exists()
+    }
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    tables = dict(manifest.get("tables", {}))
+
+    for table in CENSUS_TABLES:
+        key = f"{CENSUS_YEAR}/{table}"
+        entry = tables.get(key, {})
+        stored = get_census_store_path(table).exists()
+
+        if table in summary_paths:
+            source = hash_file(summary_paths[table])
+            if stored and entry.get("source") == source:
+                continue
+
+            write_census_table(read_summary_file(summary_paths[table], table), table)
+            tables[key] = {"source": source}
+        else:
+            api_states = entry.get("api_states", [])
+            if stored and state in api_states:
+                continue
+
+            refresh_census_table(table)
+            tables[key] = {
+                "source": "api",
+                "api_states": sorted(set(api_states) | {state}),
+            }
+
+    if manifest != {"tables": tables}:
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps({"tables": tables}, indent=2))
+
+
+def read_summary_file(path: Path, table: str) -> pa.Table:
+    """
+    Reads the county estimates of an ACS table from its pipe-delimited
+    table-based summary file. The `GEO_ID` is split into `state` and `county`
+    FIPS codes and the estimate columns (e.g. `B14003_E001`) are renamed to
+    their Census API names (e.g. `B14003_001E`); margins of error are dropped.
+    """
+    with open(path) as file:
+        header = file.readline().rstrip("\r\n").split("|")
+    estimates = {
+        column: f"{table}_{match.group(1)}E"
+        for column in header
+        if (match := re.fullmatch(rf"{table}_E(\d{{3}})", column))
+    }
+    assert estimates, f"summary file did not contain estimates of {table}: {path}"
+
+    data = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        parse_options=pacsv.ParseOptions(delimiter="|"),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=["GEO_ID"] + list(estimates),
+            column_types={"GEO_ID": pa.string()}
+            | {column: pa.int32() for column in estimates},
+            null_values=["", "null"],
+        ),
+    )
+
+    data = data.filter(pc.starts_with(data["GEO_ID"], COUNTY_GEO_ID_PREFIX))
+    geo = pc.utf8_slice_codeunits(data["GEO_ID"], len(COUNTY_GEO_ID_PREFIX))
+
+    columns = {
+        "state": pc.utf8_slice_codeunits(geo, 0, 2),
+        "county": pc.utf8_slice_codeunits(geo, 2, 5),
+    }
+    columns |= {renamed: data[column] for column, renamed in estimates.items()}
+
+    return pa.table(columns)
+
+
+def refresh_census_table(table: str) -> None:
+    """
+    Replaces the current state's rows of an ACS table in the census store with
+    the estimates from the Census API, keeping the rows of other states.
+    """
+    refreshed = pa.Table.from_pandas(census_api_table_call(table), preserve_index=False)
+
+    path = get_census_store_path(table)
+    if path.exists():
+        stored = pq.read_table(path, partitioning=None)
+        stored = stored.filter(pc.not_equal(stored["state"], STATE_FIPS))
+        refreshed = pa.concat_tables([stored, refreshed], promote_options="default")
+
+    write_census_table(refreshed, table)
+
+
+def write_census_table(data: pa.Table, table: str) -> None:
+    """
+    Writes an ACS table to its partition of the census store, replacing any
+    previous version. Rows are sorted by geography so that the row group
+    statistics let state reads skip other states.
+    """
+    data = data.sort_by([("state", "ascending"), ("county", "ascending")])
+
+    path = get_census_store_path(table)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_suffix(".tmp")
+    pq.write_table(data, tmp_path, row_group_size=1024)
+    tmp_path.replace(path)
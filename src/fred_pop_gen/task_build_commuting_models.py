@@ -0,0 +1,30 @@
+from typing import Annotated
+
+import numpy as np
+import pandas as pd
+
+from fred_pop_gen.commuting import get_gravity_model, get_od_model
+from fred_pop_gen.config import COMMUTING_MODELS, DATA_CATALOG, STATE_FIPS
+
+
+if COMMUTING_MODELS:
+
+    def task_build_od_model(
+        od_df: Annotated[pd.DataFrame, DATA_CATALOG[f"lodes_od_{STATE_FIPS}"]],
+    ) -> Annotated[dict[str, np.ndarray], DATA_CATALOG[f"od_model_{STATE_FIPS}"]]:
+        """
+        Builds the sparse commuting model of the observed LODES OD flows between
+        block groups.
+        """
+        return get_od_model(od_df)
+
+    def task_build_gravity_model(
+        wac_df: Annotated[pd.DataFrame, DATA_CATALOG[f"lodes_wac_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+    ) -> Annotated[dict[str, np.ndarray], DATA_CATALOG[f"gravity_model_{STATE_FIPS}"]]:
+        """
+        Builds the sparse gravity model that work block groups are to be drawn
+        from for home block groups without observed LODES OD flows (see
+        `sample_work_blkgrps`, which workplace assignment does not use yet).
+        """
+        return get_gravity_model(wac_df, hh_df)
@@ -0,0 +1,44 @@
+from typing import Annotated
+
+import numpy as np
+import pandas as pd
+
+from fred_pop_gen.config import DATA_CATALOG, REASSIGNMENT_INDEX, STATE_FIPS
+from fred_pop_gen.constants import Enrollment
+from fred_pop_gen.reassignment import build_reassignment_index
+from fred_pop_gen.utils import project_persons
+
+if REASSIGNMENT_INDEX:
+
+    def task_build_reassignment_index(
+        p_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]
+        ],
+        pub_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
+        priv_df: Annotated[pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        hh_candidates: Annotated[
+            np.ndarray, DATA_CATALOG[f"school_households_{STATE_FIPS}"]
+        ],
+    ) -> Annotated[dict, DATA_CATALOG[f"reassignment_index_{STATE_FIPS}"]]:
+        """
+        Builds the reassignment indexes (see `build_reassignment_index`) of the
+        public schools of each county, keyed by county FIPS code under
+        "public", and of the private schools of the state under "private".
+        """
+        p_df = project_persons(p_df, "school")
+
+        pub_p_df = p_df.loc[p_df["enrollment"] == Enrollment.PUBLIC]
+        counties = sorted(set(pub_p_df["county_fips"]) & set(pub_df["county_fips"]))
+
+        return {
+            "public": {
+                county: build_reassignment_index(
+                    p_df, pub_df, hh_df, hh_candidates, Enrollment.PUBLIC, county
+                )
+                for county in counties
+            },
+            "private": build_reassignment_index(
+                p_df, priv_df, hh_df, hh_candidates, Enrollment.PRIVATE
+            ),
+        }
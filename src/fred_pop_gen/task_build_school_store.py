@@ -0,0 +1,302 @@
+import csv
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from pytask import Product
+
+from fred_pop_gen.config import (
+    PRIVATE_SCHOOLS_FILE,
+    PUBLIC_SCHOOLS_FILE,
+    SCHOOL_STORE_DIR,
+    SCHOOL_STORE_MANIFEST,
+)
+from fred_pop_gen.constants import Grade
+from fred_pop_gen.utils import get_grade_mask, hash_file
+
+PUBLIC_SCHOOLS_COLUMNS = {
+    "School ID (12-digit) - NCES Assigned": "id",
+    "County Number": "county_fips",
+    "Latitude": "lat",
+    "Longitude": "lon",
+    "Lowest Grade Offered": "lowest_grade",
+    "Highest Grade Offered": "highest_grade",
+    "Total Students All Grades (Excludes AE)": "enrollment_total",
+}
+
+PRIVATE_SCHOOLS_COLUMNS = {
+    "PPIN": "id",
+    "PSTANSI": "state_fips",
+    "PCNTY": "county_fips",
+    "LATITUDE": "lat",
+    "LONGITUDE": "lon",
+    "LOGR": "lowest_grade",
+    "HIGR": "highest_grade",
+    "P305": "enrollment_total",
+}
+
+# the enrollment may contain NCES placeholders, so it is read as a string and
+# coerced to NaN when formatting
+PUBLIC_SCHOOLS_COLUMN_TYPES = {
+    "id": pa.string(),
+    "state_fips": pa.string(),
+    "county_fips": pa.string(),
+    "lat": pa.float64(),
+    "lon": pa.float64(),
+    "lowest_grade": pa.string(),
+    "highest_grade": pa.string(),
+    "enrollment_total": pa.string(),
+}
+
+# the grade levels are strings in the public school file and ints in the
+# private school file
+PRIVATE_SCHOOLS_COLUMN_TYPES = PUBLIC_SCHOOLS_COLUMN_TYPES | {
+    "lowest_grade": pa.int8(),
+    "highest_grade": pa.int8(),
+}
+
+# values used by NCES for missing or not applicable data
+NCES_NULL_VALUES = ["", "\u2020", "\u2021", "\u2013", "-"]
+
+GRADE_LABELS = {
+    "prekindergarten": Grade.PREK,
+    "kindergarten": Grade.K,
+    "transitional kindergarten": Grade.K,
+    "1st grade": Grade.FIRST,
+    "2nd grade": Grade.SECOND,
+    "3rd grade": Grade.THIRD,
+    "4th grade": Grade.FOURTH,
+    "5th grade": Grade.FIFTH,
+    "6th grade": Grade.SIXTH,
+    "7th grade": Grade.SEVENTH,
+    "8th grade": Grade.EIGHTH,
+    "9th grade": Grade.NINTH,
+    "10th grade": Grade.TENTH,
+    "11th grade": Grade.ELEVENTH,
+    "12th grade": Grade.TWELFTH,
+}
+
+GRADE_CODES = {
+    2: Grade.PREK,
+    3: Grade.K,
+    4: Grade.K,  # transitional kindergarten
+    5: Grade.FIRST,  # transitional first grade
+    6: Grade.FIRST,
+    7: Grade.SECOND,
+    8: Grade.THIRD,
+    9: Grade.FOURTH,
+    10: Grade.FIFTH,
+    11: Grade.SIXTH,
+    12: Grade.SEVENTH,
+    13: Grade.EIGHTH,
+    14: Grade.NINTH,
+    15: Grade.TENTH,
+    16: Grade.ELEVENTH,
+    17: Grade.TWELFTH,
+}
+
+
+def task_build_school_store(
+    public_path: Path = PUBLIC_SCHOOLS_FILE,
+    private_path: Path = PRIVATE_SCHOOLS_FILE,
+    manifest_path: Annotated[Path, Product] = SCHOOL_STORE_MANIFEST,
+) -> None:
+    """
+    Normalizes the national public and private schools files into a single
+    school store, partitioned by state FIPS, so that state runs only need to
+    load their own partition. The hashes of the source files are recorded in
+    the manifest, and the store is only rebuilt when they change.
+    """
+    sources = {
+        "public": hash_file(public_path),
+        "private": hash_file(private_path),
+    }
+    if manifest_path.exists() and SCHOOL_STORE_DIR.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest["sources"] == sources:
+            return
+
+    table = pa.concat_tables(
+        [
+            normalize_schools_table(
+                read_public_schools_file(public_path, states=None), public=True
+            ),
+            normalize_schools_table(
+                read_private_schools_file(private_path, states=None), public=False
+            ),
+        ]
+    )
+
+    shutil.rmtree(SCHOOL_STORE_DIR, ignore_errors=True)
+    pq.write_to_dataset(table, SCHOOL_STORE_DIR, partition_cols=["state_fips"])
+
+    manifest = {"sources": sources, "n_schools": len(table)}
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+
+
+def read_public_schools_file(path: Path, states: list[str] | None) -> pa.Table:
+    """
+    Reads the needed columns of the public schools file with pyarrow's
+    multithreaded CSV reader, keeping only schools in `states` (all states if
+    None).
+    """
+    # remove suffix ([Public School]...) from column names
+    header = read_csv_header(path)
+    columns = {
+        column: PUBLIC_SCHOOLS_COLUMNS[stripped]
+        for column in header
+        if (stripped := re.sub(r" \[.*$", "", column)) in PUBLIC_SCHOOLS_COLUMNS
+    }
+    assert sorted(columns.values()) == sorted(PUBLIC_SCHOOLS_COLUMNS.values()), (
+        f"public schools file did not contain expected columns: expected = {sorted(PUBLIC_SCHOOLS_COLUMNS)}, actual = {sorted(header)}"
+    )
+
+    table = read_schools_csv(path, columns, PUBLIC_SCHOOLS_COLUMN_TYPES)
+
+    county_fips = pc.utf8_lpad(table["county_fips"], 5, "0")
+    table = table.set_column(
+        table.schema.get_field_index("county_fips"), "county_fips", county_fips
+    )
+    table = table.append_column(
+        "state_fips", pc.utf8_slice_codeunits(county_fips, 0, 2)
+    )
+
+    return filter_schools_by_state(table, states)
+
+
+def read_private_schools_file(path: Path, states: list[str] | None) -> pa.Table:
+    """
+    Reads the needed columns of the private schools file with pyarrow's
+    multithreaded CSV reader, keeping only schools in `states` (all states if
+    None).
+    """
+    # remove suffix from column names
+    header = read_csv_header(path)
+    columns = {}
+    for stripped in PRIVATE_SCHOOLS_COLUMNS:
+        original = next(
+            (column for column in header if column.startswith(stripped)), None
+        )
+        assert original is not None, (
+            f"private schools file did not contain expected column: expected = {stripped}"
+        )
+        columns[original] = PRIVATE_SCHOOLS_COLUMNS[stripped]
+
+    table = read_schools_csv(path, columns, PRIVATE_SCHOOLS_COLUMN_TYPES)
+
+    state_fips = pc.utf8_lpad(table["state_fips"], 2, "0")
+    county_fips = pc.binary_join_element_wise(
+        state_fips, pc.utf8_lpad(table["county_fips"], 3, "0"), ""
+    )
+    table = table.set_column(
+        table.schema.get_field_index("state_fips"), "state_fips", state_fips
+    )
+    table = table.set_column(
+        table.schema.get_field_index("county_fips"), "county_fips", county_fips
+    )
+
+    return filter_schools_by_state(table, states)
+
+
+def read_csv_header(path: Path) -> list[str]:
+    """
+    Reads the column names in the first line of a CSV file.
+    """
+    with open(path, newline="") as file:
+        return next(csv.reader(file))
+
+
+def read_schools_csv(
+    path: Path, columns: dict[str, str], column_types: dict[str, pa.DataType]
+) -> pa.Table:
+    """
+    Reads only `columns` of a schools file with the explicit `column_types`,
+    renaming them using `columns`.
+    """
+    convert_options = pacsv.ConvertOptions(
+        include_columns=list(columns),
+        column_types={
+            original: column_types[renamed] for original, renamed in columns.items()
+        },
+        null_values=NCES_NULL_VALUES,
+        strings_can_be_null=True,
+    )
+    read_options = pacsv.ReadOptions(use_threads=True)
+    table = pacsv.read_csv(
+        path, read_options=read_options, convert_options=convert_options
+    )
+
+    return table.rename_columns([columns[column] for column in table.column_names])
+
+
+def filter_schools_by_state(table: pa.Table, states: list[str] | None) -> pa.Table:
+    if states is None:
+        return table
+
+    return table.filter(pc.is_in(table["state_fips"], pa.array(states)))
+
+
+def normalize_schools_table(table: pa.Table, public: bool) -> pa.Table:
+    """
+    Normalizes a schools table read from one of the school files into the
+    school store schema. The offered grades are encoded as a bitmask (see
+    `get_grade_mask`).
+    """
+    df = pa.table(
+        {
+            "id": table["id"],
+            "state_fips": table["state_fips"],
+            "county_fips": table["county_fips"],
+            "lat": table["lat"],
+            "lon": table["lon"],
+            "lowest_grade": map_grade_levels(table["lowest_grade"]),
+            "highest_grade": map_grade_levels(table["highest_grade"]),
+            "capacity": table["enrollment_total"],
+        }
+    ).to_pandas()
+
+    df["capacity"] = pd.to_numeric(df["capacity"], errors="coerce")
+
+    # TODO: should we recover schools with bad valuees instead of just dropping?
+    df = df.dropna()
+
+    grades = get_grade_mask(df["lowest_grade"], df["highest_grade"])
+
+    return pa.table(
+        {
+            "id": pa.array(df["id"], pa.string()),
+            "state_fips": pa.array(df["state_fips"], pa.string()),
+            "county_fips": pa.array(df["county_fips"], pa.string()),
+            "lat": pa.array(df["lat"], pa.float64()),
+            "lon": pa.array(df["lon"], pa.float64()),
+            "grades": pa.array(grades, pa.uint16()),
+            "capacity": pa.array(df["capacity"].astype("int32"), pa.int32()),
+            "public": pa.array(np.full(len(df), public), pa.bool_()),
+        }
+    )
+
+
+def map_grade_levels(grades: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Maps the grade levels in school files to `Grade` values using lookup
+    tables. The public school file uses string labels while the private school
+    file uses int codes. Unknown grade levels are mapped to null.
+    """
+    if pa.types.is_string(grades.type):
+        grades = pc.utf8_lower(pc.utf8_trim_whitespace(grades))
+        lookup = GRADE_LABELS
+    else:
+        lookup = GRADE_CODES
+
+    keys = pa.array(list(lookup), grades.type)
+    values = pa.array([grade.value for grade in lookup.values()], pa.int8())
+
+    return pc.take(values, pc.index_in(grades, value_set=keys))
@@ -1,54 +1,186 @@
 from pathlib import Path
 from typing import Annotated
 
+import numpy as np
 import pandas as pd
-from pytask import DirectoryNode, Product, task
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pytask import Product, task
 
-from fred_pop_gen.config import DATA, DATA_CATALOG, STATE_FIPS
-from fred_pop_gen.utils import get_county_fips
+from fred_pop_gen.config import (
+    COUNTY_EXECUTION,
+    DATA,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    PERSONS_FILE,
+    STATE_FIPS,
+)
+from fred_pop_gen.utils import get_county_shards
 
 
 SCHOOL_ROOT_DIR = DATA / "interim" / f"school_{STATE_FIPS}"
 
-for _county in get_county_fips():
+if COUNTY_EXECUTION == "tasks":
+    for _shard in get_county_shards():
 
-    @task(id=_county)
-    def task_serialize_school_output_in_county(
-        county: Annotated[str, _county],
-        df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_public_school_{_county}"]],
-        dir: Annotated[
-            Path,
-            DirectoryNode(root_dir=SCHOOL_ROOT_DIR, pattern=_county),
-            Product,
+        @task(id=_shard)
+        def task_serialize_school_output_in_shard(
+            df: Annotated[
+                pd.DataFrame, DATA_CATALOG[f"persons_w_public_school_{_shard}"]
+            ],
+            sch_df: Annotated[
+                pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+            ],
+            path: Annotated[Path, Product] = SCHOOL_ROOT_DIR / f"{_shard}.parquet",
+        ) -> None:
+            """
+            Writes the shard public school assignments to disk so that they can
+            be collected. Only the position of each person and of their school
+            are written, as a small columnar fragment (see `get_school_codes`).
+            """
+            codes_df = get_school_codes(df, sch_df)
+            pq.write_table(pa.Table.from_pandas(codes_df, preserve_index=False), path)
+
+    # the fragments are listed from the current shards, as the fragments of
+    # earlier shard sizes (e.g. `56001.parquet` next to `56001-56005.parquet`)
+    # may still be on disk and would overwrite the codes of their persons
+    def task_collect_school_output(
+        privsch_p_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"persons_w_private_school_{STATE_FIPS}"]
+        ],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
         ],
-    ) -> None:
+        pubsch_paths: list[Path] = [
+            SCHOOL_ROOT_DIR / f"{shard}.parquet" for shard in get_county_shards()
+        ],
+        persons_path: Path = PERSONS_FILE,
+    ) -> Annotated[np.ndarray, DATA_CATALOG[f"school_codes_{STATE_FIPS}"]]:
+        """
+        Collects all shard public school fragments and the private school
+        output into the school of every person of the state (see
+        `collect_school_codes`).
         """
-        Writes data from all county public school assignments to disk so that
-        they can be waited for and collected.
+        pub_codes = [pq.read_table(path).to_pandas() for path in pubsch_paths]
+        priv_codes = get_school_codes(privsch_p_df, privsch_df)
+
+        return collect_school_codes(
+            pub_codes, priv_codes, len(pubsch_df), count_persons(persons_path)
+        )
+
+else:
+
+    def task_collect_school_output(
+        pub_codes: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_school_codes_{STATE_FIPS}"]
+        ],
+        privsch_p_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"persons_w_private_school_{STATE_FIPS}"]
+        ],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
+        ],
+        persons_path: Path = PERSONS_FILE,
+    ) -> Annotated[np.ndarray, DATA_CATALOG[f"school_codes_{STATE_FIPS}"]]:
+        """
+        Merges the public school codes of all counties with the private school
+        output into the school of every person of the state (see
+        `collect_school_codes`).
+        """
+        priv_codes = get_school_codes(privsch_p_df, privsch_df)
+
+        return collect_school_codes(
+            [pub_codes], priv_codes, len(pubsch_df), count_persons(persons_path)
+        )
+
+
+# with the "stream" engine, the persons are never loaded as a whole, and the
+# outputs join the school codes onto the spilled persons one county at a time
+# (see `read_spilled_persons`)
+if DATAFRAME_ENGINE != "stream":
 
-        See: https://pytask-dev.readthedocs.io/en/stable/how_to_guides/provisional_nodes_and_task_generators.html
+    def task_join_school_output(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{STATE_FIPS}"]],
+        codes: Annotated[np.ndarray, DATA_CATALOG[f"school_codes_{STATE_FIPS}"]],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
+        ],
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_school_{STATE_FIPS}"]]:
+        """
+        Updates the school assignment fields in the complete state persons df
+        from the collected school codes. The persons are not aligned by label,
+        so the cost does not depend on the columns of the persons df.
         """
-        df.to_pickle(dir.joinpath(f"{county}.pkl"))
+        p_df["school_id"] = get_school_ids(pubsch_df, privsch_df)[codes]
 
+        return p_df
 
-@task(after="serialize_school_output_in_county")
-def task_collect_school_output(
-    pubsch_paths: Annotated[
-        list[Path], DirectoryNode(root_dir=SCHOOL_ROOT_DIR, pattern="*")
-    ],
-    privsch_df: Annotated[
-        pd.DataFrame, DATA_CATALOG[f"persons_w_private_school_{STATE_FIPS}"]
-    ],
-    p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{STATE_FIPS}"]],
-) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_school_{STATE_FIPS}"]]:
+
+def get_school_codes(p_df: pd.DataFrame, sch_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Collects all county public school output and merges it with private school
-    output, then updates school assignment fields in the complete state persons
-    df.
+    Reduces school assignment output to the position of each person in the
+    persons df (`p_idx`) and the position of their school in `sch_df`
+    (`school`, -1 if unassigned). Only the (small) schools index is searched.
     """
-    pubsch_df = pd.concat([pd.read_pickle(path) for path in pubsch_paths])
-    sch_df = pd.concat([pubsch_df, privsch_df])
+    return pd.DataFrame(
+        {
+            "p_idx": p_df["p_idx"].to_numpy(np.int32),
+            "school": sch_df.index.get_indexer(p_df["school_id"]).astype(np.int32),
+        }
+    )
+
+
+def collect_school_codes(
+    pub_codes: list[pd.DataFrame],
+    priv_codes: pd.DataFrame,
+    n_pubsch: int,
+    n_persons: int,
+) -> np.ndarray:
+    """
+    Scatters the public and private school codes (see `get_school_codes`) into
+    a state-wide int32 array, indexed by `p_idx`, of positions in the combined
+    school ids (see `get_school_ids`), -1 for persons without a school.
+    """
+    codes = np.full(n_persons, -1, dtype=np.int32)
+
+    for fragment in pub_codes:
+        codes[fragment["p_idx"].to_numpy()] = fragment["school"].to_numpy()
 
-    p_df["school_id"] = sch_df["school_id"]
+    priv_school = priv_codes["school"].to_numpy()
+    codes[priv_codes["p_idx"].to_numpy()] = np.where(
+        priv_school >= 0, priv_school + n_pubsch, -1
+    )
 
-    return p_df
+    return codes
+
+
+def get_school_ids(pubsch_df: pd.DataFrame, privsch_df: pd.DataFrame) -> np.ndarray:
+    """
+    Gets the combined public and private school ids indexed by the school
+    codes of `collect_school_codes`, where -1 (no school) takes the appended
+    None.
+    """
+    return np.concatenate(
+        [
+            pubsch_df.index.to_numpy(dtype=object),
+            privsch_df.index.to_numpy(dtype=object),
+            [None],
+        ]
+    )
+
+
+def count_persons(path: Path) -> int:
+    """
+    Counts the persons of the persons file from its metadata, as `p_idx` is
+    the position of each person in it.
+    """
+    return pq.ParquetFile(path).metadata.num_rows
@@ -3,28 +3,38 @@ from typing import Annotated
 import pandas as pd
 from pytask import task
 
-from fred_pop_gen.config import DATA_CATALOG, STATE_FIPS
-from fred_pop_gen.utils import filter_df_by_county, get_county_fips
+from fred_pop_gen.config import (
+    COUNTY_EXECUTION,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    STATE_FIPS,
+)
+from fred_pop_gen.utils import filter_df_by_counties, get_county_shards
 
-for _county in get_county_fips():
+if COUNTY_EXECUTION == "tasks":
+    for _shard, _counties in get_county_shards().items():
 
-    @task(id=_county)
-    def get_households_in_county(
-        county: Annotated[str, _county],
-        df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"households_{_county}"]]:
-        return filter_df_by_county(df, county)
+        @task(id=_shard)
+        def get_households_in_shard(
+            counties: Annotated[list[str], _counties],
+            df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"households_{_shard}"]]:
+            return filter_df_by_counties(df, counties)
 
-    @task(id=_county)
-    def get_persons_in_county(
-        county: Annotated[str, _county],
-        df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{_county}"]]:
-        return filter_df_by_county(df, county)
+        if DATAFRAME_ENGINE != "stream":
 
-    @task(id=_county)
-    def get_public_schools_in_county(
-        county: Annotated[str, _county],
-        df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
-    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{_county}"]]:
-        return filter_df_by_county(df, county)
+            @task(id=_shard)
+            def get_persons_in_shard(
+                counties: Annotated[list[str], _counties],
+                df: Annotated[
+                    pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]
+                ],
+            ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{_shard}"]]:
+                return filter_df_by_counties(df, counties)
+
+        @task(id=_shard)
+        def get_public_schools_in_shard(
+            counties: Annotated[list[str], _counties],
+            df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
+        ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{_shard}"]]:
+            return filter_df_by_counties(df, counties)
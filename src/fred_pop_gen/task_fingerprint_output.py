@@ -0,0 +1,88 @@
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+import pandas as pd
+from pytask import DirectoryNode, Product
+
+from fred_pop_gen.config import (
+    DATA,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    PERSONS_FILE,
+    STATE_FIPS,
+)
+from fred_pop_gen.fingerprint import fingerprint_df, write_manifest
+from fred_pop_gen.task_collect_output_by_county import get_school_ids
+from fred_pop_gen.task_stream_persons import (
+    PERSONS_SPILL_DIR,
+    get_spilled_counties,
+    read_persons_index,
+    read_spilled_persons,
+)
+
+FINGERPRINT_PATH = DATA / "output" / f"fingerprint_{STATE_FIPS}.json"
+
+if DATAFRAME_ENGINE == "stream":
+
+    def task_fingerprint_persons(
+        spill_paths: Annotated[
+            list[Path],
+            DirectoryNode(root_dir=PERSONS_SPILL_DIR, pattern="county=*/*.parquet"),
+        ],
+        codes: Annotated[np.ndarray, DATA_CATALOG[f"school_codes_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
+        ],
+        persons_path: Path = PERSONS_FILE,
+        path: Annotated[Path, Product] = FINGERPRINT_PATH,
+    ) -> None:
+        """
+        Writes the fingerprint of the persons of every run, as for the other
+        engines, from the spilled persons one county at a time (see
+        `read_spilled_persons`). Fingerprints are computed by county, so the
+        manifest is the same as that of `persons_w_school_{STATE_FIPS}`.
+        """
+        hh_counties = get_household_counties(hh_df)
+        index = read_persons_index(persons_path)
+        school_ids = get_school_ids(pubsch_df, privsch_df)
+
+        counties = {}
+        for county in get_spilled_counties(spill_paths):
+            p_df = read_spilled_persons(county, index, school_ids, codes, persons_path)
+            counties |= fingerprint_df(p_df, hh_counties)["counties"]
+
+        write_manifest(
+            {
+                "source": f"persons_w_school_{STATE_FIPS}",
+                "counties": dict(sorted(counties.items())),
+            },
+            path,
+        )
+
+else:
+
+    def task_fingerprint_persons(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_school_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        path: Annotated[Path, Product] = FINGERPRINT_PATH,
+    ) -> None:
+        """
+        Writes the fingerprint of the persons (see `fingerprint_df`) of every
+        run, which can be compared against a golden fingerprint with
+        `python -m fred_pop_gen.fingerprint compare`.
+        """
+        manifest = fingerprint_df(p_df, get_household_counties(hh_df))
+
+        write_manifest({"source": f"persons_w_school_{STATE_FIPS}"} | manifest, path)
+
+
+def get_household_counties(hh_df: pd.DataFrame) -> pd.Series:
+    """
+    Maps household ids to counties, which locate the persons.
+    """
+    return pd.Series(hh_df["county_fips"].to_numpy(), index=hh_df.index.astype(str))
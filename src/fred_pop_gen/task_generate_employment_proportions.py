@@ -3,14 +3,12 @@ from typing import Annotated, Dict
 
 from fred_pop_gen.constants import EmploymentAgeBucket
 import pandas as pd
-import pytask
-from pytask import Product
 
-from fred_pop_gen.config import DATA, DATA_CATALOG, STATE_FIPS
-from fred_pop_gen.utils import census_api_call
+from fred_pop_gen.config import CENSUS_STORE_MANIFEST, DATA_CATALOG, STATE_FIPS
+from fred_pop_gen.utils import read_census_table
 
 
-# below are the ACS variables needed from the census API
+# below are the ACS variables needed from the census store
 # reference: https://api.census.gov/data/2019/acs/acs5/variables.html
 
 MALE_TOTAL_COLS = [
@@ -138,28 +136,15 @@ API_VARS = (
 )
 
 
-@pytask.mark.persist
-def task_get_employment_census_data(
-    path: Annotated[Path, Product] = DATA / f"input/employment-data-{STATE_FIPS}.pkl",
-) -> None:
-    """
-    Saves the employment data from the Census API.
-    """
-    df = census_api_call(API_VARS)
-
-    df.to_pickle(path)
-
-
 def task_generate_employment_proportions(
-    path: Path = DATA / f"input/employment-data-{STATE_FIPS}.pkl",
+    manifest_path: Path = CENSUS_STORE_MANIFEST,
 ) -> Annotated[
     Dict[str, pd.DataFrame], DATA_CATALOG[f"employment_proportions_{STATE_FIPS}"]
 ]:
     """
     Generates the employment proportions. This is done by sex, age, and county.
     """
-    totals_df = pd.read_pickle(path)
-    assert isinstance(totals_df, pd.DataFrame)
+    totals_df = read_census_table("B23001", API_VARS)
 
     male_df = generate_proportions(MALE_EMPLOYED_COLS, MALE_TOTAL_COLS, totals_df)
     female_df = generate_proportions(FEMALE_EMPLOYED_COLS, FEMALE_TOTAL_COLS, totals_df)
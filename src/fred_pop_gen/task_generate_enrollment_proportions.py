@@ -1,15 +1,13 @@
 from pathlib import Path
 from typing import Annotated
 
-from fred_pop_gen.utils import census_api_call
+from fred_pop_gen.utils import read_census_table
 import pandas as pd
-import pytask
-from pytask import Product
 
-from fred_pop_gen.config import DATA, DATA_CATALOG, STATE_FIPS
+from fred_pop_gen.config import CENSUS_STORE_MANIFEST, DATA_CATALOG, STATE_FIPS
 
 
-# below are the ACS variables needed from the census API
+# below are the ACS variables needed from the census store
 # reference: https://api.census.gov/data/2019/acs/acs5/variables.html
 #
 # NOTE: PREK proportions are computed separately as they vary significantly from
@@ -69,27 +67,14 @@ API_VARS = (
 )
 
 
-@pytask.mark.persist
-def task_get_enrollment_census_data(
-    path: Annotated[Path, Product] = DATA / f"input/enrollment-data-{STATE_FIPS}.pkl",
-) -> None:
-    """
-    Saves the enrollment data from the Census API.
-    """
-
-    df = census_api_call(API_VARS)
-
-    df.to_pickle(path)
-
-
 def task_generate_enrollment_totals(
-    path: Path = DATA / f"input/enrollment-data-{STATE_FIPS}.pkl",
+    manifest_path: Path = CENSUS_STORE_MANIFEST,
 ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"enrollment_totals_{STATE_FIPS}"]]:
     """
     Generates totals for each enrollment status.
     """
 
-    totals_df = pd.read_pickle(path)
+    totals_df = read_census_table("B14003", API_VARS)
     df = pd.DataFrame()
 
     df["county_fips"] = totals_df["state"] + totals_df["county"]
@@ -0,0 +1,212 @@
+from pathlib import Path
+from typing import Annotated, Dict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pytask import Product
+
+from fred_pop_gen.arrow_engine import get_employment_probabilities, get_enrollment_cdf
+from fred_pop_gen.config import (
+    DATA,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    N_REPLICATES,
+    RNG,
+    STATE_FIPS,
+    STREAM_BATCH_SIZE,
+)
+from fred_pop_gen.constants import Enrollment
+from fred_pop_gen.task_assign_schools import assign_replicate_schools
+from fred_pop_gen.utils import GRADES, get_grade_codes
+
+REPLICATES_DIR = DATA / "output" / f"replicates_{STATE_FIPS}"
+
+if N_REPLICATES > 0 and DATAFRAME_ENGINE != "stream":
+
+    def task_generate_replicates(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
+        ],
+        enrollment_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"enrollment_proportions_{STATE_FIPS}"]
+        ],
+        employment: Annotated[
+            Dict[str, pd.DataFrame],
+            DATA_CATALOG[f"employment_proportions_{STATE_FIPS}"],
+        ],
+        persons_path: Annotated[Path, Product] = REPLICATES_DIR / "persons.parquet",
+        schools_path: Annotated[Path, Product] = REPLICATES_DIR / "schools.parquet",
+    ) -> None:
+        """
+        Generates `N_REPLICATES` replicates of the stochastic stages from a
+        single build of the deterministic ones (merged persons, proportions and
+        person-school distances). The enrollment and employment draws of every
+        replicate are vectorized across the replicate axis, and schools are
+        assigned with `assign_replicate_schools`, which computes the distances
+        of each county once for every replicate.
+
+        Each replicate is written as compact columns of the persons file, in
+        the order of the persons df: `enrollment_{r}` (`Enrollment` value, -1
+        if not school-aged), `employed_{r}` and `school_{r}` (position of the
+        school in the schools file, -1 if none).
+        """
+        enrollment, employed, school = generate_replicates(
+            p_df, hh_df, pubsch_df, privsch_df, enrollment_df, employment
+        )
+
+        columns = {}
+        for replicate in range(N_REPLICATES):
+            columns[f"enrollment_{replicate}"] = enrollment[replicate]
+            columns[f"employed_{replicate}"] = employed[replicate]
+            columns[f"school_{replicate}"] = school[replicate]
+
+        REPLICATES_DIR.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.table(columns), persons_path)
+
+        school_ids = np.concatenate(
+            [
+                pubsch_df.index.to_numpy(dtype=object),
+                privsch_df.index.to_numpy(dtype=object),
+            ]
+        )
+        pq.write_table(
+            pa.table({"sp_id": pa.array(school_ids.astype(str), pa.string())}),
+            schools_path,
+        )
+
+
+def generate_replicates(
+    p_df: pd.DataFrame,
+    hh_df: pd.DataFrame,
+    pubsch_df: pd.DataFrame,
+    privsch_df: pd.DataFrame,
+    enrollment_df: pd.DataFrame,
+    employment: Dict[str, pd.DataFrame],
+    n_replicates: int = N_REPLICATES,
+    rng: np.random.Generator = RNG,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Draws `n_replicates` replicates of enrollment, employment and school
+    assignment of the merged persons from `rng`, see
+    `task_generate_replicates`. Returns the (n_replicates, n_persons)
+    enrollment, employed and school arrays.
+    """
+    grade = get_grade_codes(p_df["agep"].to_numpy())
+    school_aged = np.flatnonzero(grade >= 0)
+    counties = p_df["county_fips"].to_numpy(dtype=object)
+
+    enrollment = np.full((n_replicates, len(p_df)), -1, dtype=np.int8)
+    enrollment[:, school_aged] = draw_replicate_enrollment(
+        grade[school_aged],
+        counties[school_aged],
+        enrollment_df,
+        n_replicates,
+        rng,
+    )
+
+    employed = draw_replicate_employment(
+        p_df["agep"].to_numpy(),
+        p_df["sex"].to_numpy() == 1,
+        counties,
+        employment,
+        n_replicates,
+        rng,
+    )
+
+    sa_df = pd.DataFrame(
+        {
+            "grade": GRADES[grade[school_aged]],
+            "hh_idx": p_df["hh_idx"].to_numpy()[school_aged],
+            "county_fips": counties[school_aged],
+        }
+    )
+    sa_enrollment = enrollment[:, school_aged]
+
+    school = np.full((n_replicates, len(p_df)), -1, dtype=np.int32)
+    school[:, school_aged] = assign_replicate_schools(
+        sa_df,
+        sa_enrollment == Enrollment.PUBLIC.value,
+        pubsch_df,
+        hh_df,
+        by_county=True,
+    )
+    priv_school = assign_replicate_schools(
+        sa_df,
+        sa_enrollment == Enrollment.PRIVATE.value,
+        privsch_df,
+        hh_df,
+        by_county=False,
+    )
+    school[:, school_aged] = np.where(
+        priv_school >= 0, priv_school + len(pubsch_df), school[:, school_aged]
+    )
+
+    return enrollment, employed, school
+
+
+def draw_replicate_enrollment(
+    grades: np.ndarray,
+    counties: np.ndarray,
+    enrollment_df: pd.DataFrame,
+    n_replicates: int = N_REPLICATES,
+    rng: np.random.Generator = RNG,
+) -> np.ndarray:
+    """
+    Draws the `Enrollment` value of each person in every replicate as in
+    `draw_enrollment`, returning an (n_replicates, n_persons) array. The draws
+    of all replicates are taken at once for blocks of persons, bounding the
+    memory of the uniform samples.
+    """
+    cdf = get_enrollment_cdf(grades, counties, enrollment_df)
+    enrollment = np.empty((n_replicates, len(grades)), dtype=np.int8)
+
+    for start, stop in get_blocks(len(grades), n_replicates):
+        samples = rng.random((n_replicates, stop - start))
+        block = enrollment[:, start:stop]
+        block[...] = 0
+        for outcome in range(cdf.shape[1]):
+            block += cdf[start:stop, outcome] <= samples
+
+    return enrollment
+
+
+def draw_replicate_employment(
+    age: np.ndarray,
+    is_male: np.ndarray,
+    counties: np.ndarray,
+    employment: Dict[str, pd.DataFrame],
+    n_replicates: int = N_REPLICATES,
+    rng: np.random.Generator = RNG,
+) -> np.ndarray:
+    """
+    Draws the employment of each person in every replicate as in
+    `assign_employment`, returning an (n_replicates, n_persons) mask. Persons
+    under 16 are never employed.
+    """
+    drawn, p = get_employment_probabilities(age, is_male, counties, employment)
+    drawn = np.flatnonzero(drawn)
+    employed = np.zeros((n_replicates, len(age)), dtype=bool)
+
+    for start, stop in get_blocks(len(drawn), n_replicates):
+        positions = drawn[start:stop]
+        samples = rng.random((n_replicates, len(positions)))
+        employed[:, positions] = samples < p[positions]
+
+    return employed
+
+
+def get_blocks(n: int, n_replicates: int = N_REPLICATES) -> list[tuple[int, int]]:
+    """
+    Splits `n` persons into blocks of at most `STREAM_BATCH_SIZE` samples
+    across all replicates.
+    """
+    size = max(STREAM_BATCH_SIZE // n_replicates, 1)
+
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
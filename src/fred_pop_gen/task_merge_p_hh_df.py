@@ -1,22 +1,42 @@
 from typing import Annotated
-from fred_pop_gen.config import DATA_CATALOG, STATE_FIPS
+from fred_pop_gen.config import DATA_CATALOG, DATAFRAME_ENGINE, STATE_FIPS
+from fred_pop_gen.utils import KEY_COLUMNS, MERGED_COLUMNS
+import numpy as np
 import pandas as pd
 
 
-def task_merge_p_hh_df(
-    p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{STATE_FIPS}"]],
-    hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
-) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]]:
+if DATAFRAME_ENGINE == "pandas":
+
+    def task_merge_p_hh_df(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"]]:
+        """
+        Associates persons with their household, see `merge_p_hh_df`.
+        """
+        return merge_p_hh_df(p_df, hh_df)
+
+
+def merge_p_hh_df(p_df: pd.DataFrame, hh_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Merges the persons df with the households df such that each person row also
-    contains its corresponding household's columns. This is useful to associate
-    persons with their household's latitude, longitude, and county.
+    Associates persons with their household. Rather than copying every
+    household column onto each person, each person gets the position of its
+    household in the households df (`hh_idx`), which later stages use to gather
+    only the household columns they need (see `gather_household_columns`). The
+    county is needed by nearly every stage, so it is gathered here as a
+    categorical. The position of each person in the persons df (`p_idx`) is
+    kept so that results can be scattered back without index alignment (see
+    `collect_school_codes`). Only these columns and the person columns
+    read by later stages (`MERGED_COLUMNS`) are returned, as the output
+    is built from the persons df.
     """
-    p_hh_df = p_df.merge(hh_df, on="hh_id", how="left")
+    hh_idx = hh_df.index.get_indexer(p_df["hh_id"])
+    assert (hh_idx >= 0).all(), "persons file contains unknown households"
 
-    # we must retain the orignal person index as they function as each person's
-    # unique id
-    assert len(p_df) == len(p_hh_df)
-    p_hh_df = p_hh_df.set_index(p_df.index)
+    p_df = p_df.assign(
+        p_idx=np.arange(len(p_df), dtype="int32"),
+        hh_idx=hh_idx.astype("int32"),
+        county_fips=pd.Categorical(hh_df["county_fips"].to_numpy()[hh_idx]),
+    )
 
-    return p_hh_df
+    return p_df[KEY_COLUMNS + MERGED_COLUMNS]
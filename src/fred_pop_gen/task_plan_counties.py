@@ -0,0 +1,74 @@
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+import pandas as pd
+from pytask import Product
+
+from fred_pop_gen.config import (
+    DATA,
+    DATA_CATALOG,
+    MEMORY_LIMIT,
+    PLAN_COUNTIES,
+    STATE_FIPS,
+)
+from fred_pop_gen.constants import Enrollment
+from fred_pop_gen.task_assign_schools import (
+    add_household_slices,
+    get_county_jobs,
+    get_job_counties,
+)
+
+
+PLAN_FILE = DATA / "interim" / f"county_plan_{STATE_FIPS}.csv"
+
+if PLAN_COUNTIES:
+
+    def task_plan_public_school_assignment(
+        p_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]
+        ],
+        sch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        hh_candidates: Annotated[
+            np.ndarray, DATA_CATALOG[f"school_households_{STATE_FIPS}"]
+        ],
+        path: Annotated[Path, Product] = PLAN_FILE,
+    ) -> None:
+        """
+        Writes a dry-run report of the public school assignment of every county
+        from row counts alone, without computing any distances: the school-aged
+        persons, public school students and schools of the county, its eligible
+        person-school pairs and predicted memory (see `get_county_jobs` and
+        `add_household_slices`), and its rank by pairs. Set `PLAN_COUNTIES` and
+        run it on its own with `pytask -k plan_public_school_assignment`.
+
+        NOTE: `order` is the order in which the process pool considers the
+        counties, by decreasing pairs, not the order in which it starts them:
+        a county that does not fit in `MEMORY_LIMIT` alongside the running
+        ones waits while smaller counties are started (see `run_in_pool`).
+        """
+        students_df = p_df.loc[p_df["enrollment"] == Enrollment.PUBLIC]
+        _, _, jobs, memory = get_county_jobs(students_df, sch_df)
+        counties = get_job_counties(students_df, sch_df)
+        _, jobs, memory = add_household_slices(
+            jobs, memory, counties, hh_candidates, hh_df
+        )
+
+        plan_df = pd.DataFrame(
+            {
+                "persons": p_df["county_fips"].value_counts(),
+                "students": students_df["county_fips"].value_counts(),
+                "schools": sch_df["county_fips"].value_counts(),
+            },
+            index=pd.Index(counties, name="county_fips"),
+        )
+        plan_df["pairs"] = [cost for cost, _ in jobs]
+        plan_df["memory_mb"] = np.array(memory) / 2**20
+
+        plan_df = plan_df.sort_values("pairs", ascending=False, kind="stable")
+        plan_df["order"] = np.arange(len(plan_df))
+        plan_df["share_of_limit"] = plan_df["memory_mb"] * 2**20 / MEMORY_LIMIT
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        plan_df.to_csv(path)
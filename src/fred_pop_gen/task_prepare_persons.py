@@ -0,0 +1,81 @@
+from typing import Annotated
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from fred_pop_gen.arrow_engine import (
+    assign_grades,
+    draw_enrollment,
+    get_persons_source,
+    join_households,
+    run_plan,
+    to_persons_df,
+)
+from fred_pop_gen.config import DATA_CATALOG, DATAFRAME_ENGINE, STATE_FIPS
+from fred_pop_gen.utils import KEY_COLUMNS, MERGED_COLUMNS, project_persons
+
+if DATAFRAME_ENGINE == "arrow":
+
+    def task_prepare_persons(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        enrollment_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"enrollment_proportions_{STATE_FIPS}"]
+        ],
+    ) -> Annotated[
+        tuple[pd.DataFrame, pd.DataFrame],
+        (
+            DATA_CATALOG[f"persons_w_geo_{STATE_FIPS}"],
+            DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"],
+        ),
+    ]:
+        """
+        Runs the household merge, grade and enrollment stages on the Arrow
+        engine, see `prepare_persons`.
+        """
+        return prepare_persons(p_df, hh_df, enrollment_df)
+
+
+def prepare_persons(
+    p_df: pd.DataFrame, hh_df: pd.DataFrame, enrollment_df: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Runs the household merge, grade and enrollment stages on the Arrow
+    engine. The merge is an Acero plan executed on Arrow's thread pool, the
+    grades are mapped on the merged table, and the tables are only converted
+    to DataFrames for the two products read by later stages. Only the person
+    columns read by later stages enter the plans.
+
+    The products are identical to those of `merge_p_hh_df`,
+    `assign_grade_to_persons` and `assign_enrollment_to_persons`.
+    """
+    columns = MERGED_COLUMNS + ["p_idx"]
+    geo_table = run_plan(
+        join_households(
+            get_persons_source(p_df[["hh_id"] + MERGED_COLUMNS]), columns, hh_df
+        )
+    )
+    assert geo_table.column("hh_idx").null_count == 0, (
+        "persons file contains unknown households"
+    )
+
+    grade_table = assign_grades(geo_table)
+    enrollment = draw_enrollment(
+        grade_table.column("grade").to_numpy(),
+        grade_table.column("county_fips").to_numpy(zero_copy_only=False),
+        enrollment_df,
+    )
+    grade_table = grade_table.append_column(
+        "enrollment", pa.array(enrollment, pa.int8())
+    )
+
+    counties = sorted(pc.unique(geo_table.column("county_fips")).to_pylist())
+
+    geo_df = to_persons_df(geo_table, p_df.index, counties)
+    enrollment_df = to_persons_df(grade_table, p_df.index, counties)
+
+    return (
+        geo_df[KEY_COLUMNS + MERGED_COLUMNS],
+        project_persons(enrollment_df, "school"),
+    )
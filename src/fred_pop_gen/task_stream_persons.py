@@ -0,0 +1,255 @@
+from pathlib import Path
+import shutil
+from typing import Annotated, Dict, Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pytask import DirectoryNode, Product
+
+from fred_pop_gen.arrow_engine import (
+    draw_enrollment,
+    get_employment_probabilities,
+    to_persons_df,
+)
+from fred_pop_gen.config import (
+    DATA,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    PERSONS_FILE,
+    RNG,
+    STATE_FIPS,
+    STREAM_BATCH_SIZE,
+)
+from fred_pop_gen.utils import KEY_COLUMNS, STAGE_COLUMNS, get_grade_codes
+
+PERSONS_SPILL_DIR = DATA / "interim" / f"persons_{STATE_FIPS}"
+
+if DATAFRAME_ENGINE == "stream":
+
+    def task_stream_persons(
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        enrollment_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"enrollment_proportions_{STATE_FIPS}"]
+        ],
+        employment: Annotated[
+            Dict[str, pd.DataFrame],
+            DATA_CATALOG[f"employment_proportions_{STATE_FIPS}"],
+        ],
+        dir: Annotated[
+            Path,
+            DirectoryNode(root_dir=PERSONS_SPILL_DIR, pattern="county=*/*.parquet"),
+            Product,
+        ],
+        path: Path = PERSONS_FILE,
+    ) -> Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_enrollment_{STATE_FIPS}"]]:
+        """
+        Streams the persons file through the household merge, grade,
+        enrollment and employment stages `STREAM_BATCH_SIZE` persons at a time,
+        spilling every person to a county-partitioned Parquet dataset in `dir`.
+        Only the school-aged persons are kept in memory, and they are returned
+        in the same form as `task_assign_enrollment_to_persons` for school
+        assignment.
+        """
+        shutil.rmtree(dir, ignore_errors=True)
+
+        batches = read_persons_batches(path)
+        batches = merge_households(batches, hh_df)
+        batches = assign_grades(batches)
+        batches = assign_enrollment(batches, enrollment_df)
+        batches = assign_employment(batches, employment)
+
+        school_aged = []
+        writers: dict[str, pq.ParquetWriter] = {}
+        try:
+            for batch in batches:
+                counties = batch.column("county_fips").to_numpy(zero_copy_only=False)
+                positions = pd.Series(counties).groupby(counties).indices
+
+                for county, county_positions in positions.items():
+                    if county not in writers:
+                        county_dir = dir / f"county={county}"
+                        county_dir.mkdir(parents=True)
+                        writers[county] = pq.ParquetWriter(
+                            county_dir / "part-0.parquet", batch.schema
+                        )
+                    writers[county].write_table(batch.take(county_positions))
+
+                school_aged.append(
+                    batch.filter(pc.greater_equal(batch.column("grade"), 0))
+                )
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        # only the columns read by school assignment are kept
+        table = pa.concat_tables(school_aged).select(
+            KEY_COLUMNS + STAGE_COLUMNS["school"][0]
+        )
+
+        return to_persons_df(table, read_persons_index(path), sorted(writers))
+
+
+def get_spilled_counties(paths: list[Path]) -> list[str]:
+    """
+    Gets the counties of the dataset spilled by `task_stream_persons` from the
+    paths of its files.
+    """
+    return sorted({path.parent.name.removeprefix("county=") for path in paths})
+
+
+def read_spilled_persons(
+    county: str,
+    index: pd.Index,
+    school_ids: np.ndarray,
+    codes: np.ndarray,
+    path: Path = PERSONS_FILE,
+) -> pd.DataFrame:
+    """
+    Reads the persons of a county back from the dataset spilled by
+    `task_stream_persons`, in the same form as its rows of
+    `persons_w_school_{STATE_FIPS}`: the columns of the persons file in file
+    order, indexed by `index` (see `read_persons_index`), with the school id
+    of their code (see `collect_school_codes`). Only the partition of the
+    county is read, so the outputs never hold every person of the state.
+    """
+    table = pq.read_table(
+        PERSONS_SPILL_DIR / f"county={county}",
+        columns=get_persons_columns(path) + ["p_idx"],
+        partitioning=None,
+    )
+    p_idx = table.column("p_idx").to_numpy()
+
+    df = table.drop_columns(["p_idx"]).to_pandas()
+    df.index = index[p_idx]
+    df["school_id"] = school_ids[codes[p_idx]]
+
+    return df
+
+
+def read_persons_batches(path: Path) -> Iterator[pa.Table]:
+    """
+    Reads the persons file in batches of `STREAM_BATCH_SIZE` persons. A `p_idx`
+    column holds the position of each person in the file, which is used to
+    rebuild the index of the persons (see `read_persons_index`).
+    """
+    file = pq.ParquetFile(path)
+    offset = 0
+
+    for batch in file.iter_batches(
+        STREAM_BATCH_SIZE, columns=get_persons_columns(path)
+    ):
+        p_idx = pa.array(np.arange(offset, offset + batch.num_rows))
+        offset += batch.num_rows
+
+        # the pandas metadata of the file does not describe a single batch
+        batch = batch.replace_schema_metadata(None)
+
+        yield pa.Table.from_batches([batch]).append_column("p_idx", p_idx)
+
+
+def merge_households(
+    batches: Iterator[pa.Table], hh_df: pd.DataFrame
+) -> Iterator[pa.Table]:
+    """
+    Adds the position of each person's household in the households df
+    (`hh_idx`) and their county to the batches, see `task_merge_p_hh_df`.
+    """
+    hh_counties = pa.array(hh_df["county_fips"], pa.string())
+
+    for batch in batches:
+        hh_idx = hh_df.index.get_indexer(batch.column("hh_id").to_numpy())
+        assert (hh_idx >= 0).all(), "persons file contains unknown households"
+
+        batch = batch.append_column("hh_idx", pa.array(hh_idx.astype(np.int32)))
+        yield batch.append_column("county_fips", hh_counties.take(hh_idx))
+
+
+def assign_grades(batches: Iterator[pa.Table]) -> Iterator[pa.Table]:
+    """
+    Adds the `Grade` value of each person to the batches, or -1 for
+    non-school-aged persons, see `get_grade_codes`.
+    """
+    for batch in batches:
+        grade = get_grade_codes(batch.column("agep").to_numpy())
+
+        yield batch.append_column("grade", pa.array(grade))
+
+
+def assign_enrollment(
+    batches: Iterator[pa.Table], enrollment_df: pd.DataFrame
+) -> Iterator[pa.Table]:
+    """
+    Adds a random `Enrollment` value to the school-aged persons of the batches,
+    or -1 for non-school-aged persons, see `draw_enrollment`.
+    """
+    for batch in batches:
+        grade = batch.column("grade").to_numpy()
+        school_aged = grade >= 0
+        counties = batch.column("county_fips").to_numpy(zero_copy_only=False)
+
+        enrollment = np.full(len(grade), -1, dtype=np.int8)
+        enrollment[school_aged] = draw_enrollment(
+            grade[school_aged], counties[school_aged], enrollment_df
+        )
+
+        yield batch.append_column("enrollment", pa.array(enrollment))
+
+
+def assign_employment(
+    batches: Iterator[pa.Table], employment: Dict[str, pd.DataFrame]
+) -> Iterator[pa.Table]:
+    """
+    Adds a random employment to the persons of the batches, the vectorized
+    counterpart of `assign_employment_to_persons`. Persons under 16 are never
+    employed and, as there, do not consume a draw.
+    """
+    for batch in batches:
+        drawn, p = get_employment_probabilities(
+            batch.column("agep").to_numpy(),
+            batch.column("sex").to_numpy() == 1,
+            batch.column("county_fips").to_numpy(zero_copy_only=False),
+            employment,
+        )
+
+        # one draw per person 16 or older, consumed in row order
+        employed = np.zeros(len(p), dtype=bool)
+        employed[drawn] = RNG.random(drawn.sum()) < p[drawn]
+
+        yield batch.append_column("employed", pa.array(employed))
+
+
+def get_persons_columns(path: Path) -> list[str]:
+    """
+    Gets the columns of the persons file, excluding any stored pandas index.
+    """
+    schema = pq.read_schema(path)
+    metadata = schema.pandas_metadata or {}
+    index_columns = [
+        col for col in metadata.get("index_columns", []) if isinstance(col, str)
+    ]
+
+    return [name for name in schema.names if name not in index_columns]
+
+
+def read_persons_index(path: Path) -> pd.Index:
+    """
+    Reads the index `pd.read_parquet` would give the persons file, which is
+    either a stored range or stored index columns.
+    """
+    file = pq.ParquetFile(path)
+    metadata = file.schema_arrow.pandas_metadata or {}
+    index_columns = metadata.get("index_columns", [])
+
+    if not index_columns:
+        return pd.RangeIndex(file.metadata.num_rows)
+
+    if isinstance(index_columns[0], dict):
+        index = index_columns[0]
+        return pd.RangeIndex(
+            index["start"], index["stop"], index["step"], name=index["name"]
+        )
+
+    return pd.read_parquet(path, columns=[]).index
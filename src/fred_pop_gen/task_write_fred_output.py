@@ -0,0 +1,251 @@
+import functools
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Annotated, Callable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from pytask import DirectoryNode, Product
+
+from fred_pop_gen.config import (
+    DATA,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    FRED_OUTPUT_COMPRESSION,
+    N_WORKERS,
+    PERSONS_FILE,
+    STATE_FIPS,
+)
+from fred_pop_gen.task_collect_output_by_county import get_school_ids
+from fred_pop_gen.task_stream_persons import (
+    PERSONS_SPILL_DIR,
+    get_spilled_counties,
+    read_persons_index,
+    read_spilled_persons,
+)
+
+OUTPUT_DIR = DATA / "output" / f"fred_{STATE_FIPS}"
+SUFFIX = ".txt.gz" if FRED_OUTPUT_COMPRESSION == "gzip" else ".txt"
+
+
+if DATAFRAME_ENGINE == "stream":
+
+    def task_write_fred_people_file(
+        spill_paths: Annotated[
+            list[Path],
+            DirectoryNode(root_dir=PERSONS_SPILL_DIR, pattern="county=*/*.parquet"),
+        ],
+        codes: Annotated[np.ndarray, DATA_CATALOG[f"school_codes_{STATE_FIPS}"]],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
+        ],
+        persons_path: Path = PERSONS_FILE,
+        people_path: Annotated[Path, Product] = OUTPUT_DIR / f"people{SUFFIX}",
+    ) -> None:
+        """
+        Writes the FRED people file from the spilled persons, reading each
+        county on the worker thread that renders it (see
+        `read_spilled_persons`).
+        """
+        index = read_persons_index(persons_path)
+        school_ids = get_school_ids(pubsch_df, privsch_df)
+
+        def get_chunk(county: str) -> pa.Table:
+            return get_fred_people_table(
+                read_spilled_persons(county, index, school_ids, codes, persons_path)
+            )
+
+        write_fred_chunks(
+            [
+                functools.partial(get_chunk, county)
+                for county in get_spilled_counties(spill_paths)
+            ],
+            people_path,
+        )
+
+else:
+
+    def task_write_fred_people_file(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_school_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        people_path: Annotated[Path, Product] = OUTPUT_DIR / f"people{SUFFIX}",
+    ) -> None:
+        """
+        Writes the FRED people file, partitioned by county so that the counties
+        can be rendered in parallel.
+
+        NOTE: workplaces are not assigned yet, so the `work_id` of every person
+        is left empty.
+        """
+        hh_idx = hh_df.index.get_indexer(p_df["hh_id"])
+        assert (hh_idx >= 0).all(), "persons file contains unknown households"
+        p_counties = hh_df["county_fips"].to_numpy()[hh_idx]
+        write_fred_file(get_fred_people_table(p_df), p_counties, people_path)
+
+
+def task_write_fred_population_files(
+    hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+    pubsch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]],
+    privsch_df: Annotated[pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]],
+    households_path: Annotated[Path, Product] = OUTPUT_DIR / f"households{SUFFIX}",
+    schools_path: Annotated[Path, Product] = OUTPUT_DIR / f"schools{SUFFIX}",
+    workplaces_path: Annotated[Path, Product] = OUTPUT_DIR / f"workplaces{SUFFIX}",
+) -> None:
+    """
+    Writes the other population files loaded by FRED (see
+    `task_write_fred_people_file` for the people file). Each file is
+    partitioned by county so that the counties can be rendered in parallel.
+
+    NOTE: workplaces are not assigned yet, so the workplaces file only contains
+    its header.
+    """
+    write_fred_file(
+        get_fred_households_table(hh_df),
+        hh_df["county_fips"].to_numpy(),
+        households_path,
+    )
+
+    sch_df = pd.concat([pubsch_df, privsch_df])
+    write_fred_file(
+        get_fred_schools_table(sch_df),
+        sch_df["county_fips"].to_numpy(),
+        schools_path,
+    )
+
+    workplaces = pa.table(
+        {
+            "sp_id": pa.array([], pa.string()),
+            "latitude": pa.array([], pa.float64()),
+            "longitude": pa.array([], pa.float64()),
+        }
+    )
+    write_fred_file(workplaces, np.array([], dtype=object), workplaces_path)
+
+
+def get_fred_people_table(p_df: pd.DataFrame) -> pa.Table:
+    """
+    Builds the FRED people table from the persons df.
+    """
+    return pa.table(
+        {
+            "sp_id": pa.array(p_df.index.astype("string")),
+            "sp_hh_id": pa.array(p_df["hh_id"].astype("string")),
+            "age": pa.array(p_df["agep"]),
+            "sex": pa.array(p_df["sex"]),
+            "race": pa.array(p_df["rac1p"]),
+            "relate": pa.array(p_df["relshipp"]),
+            "school_id": pa.array(p_df["school_id"].astype("string")),
+            "work_id": pa.nulls(len(p_df), pa.string()),
+        }
+    )
+
+
+def get_fred_households_table(hh_df: pd.DataFrame) -> pa.Table:
+    """
+    Builds the FRED households table from the households df.
+    """
+    return pa.table(
+        {
+            "sp_id": pa.array(hh_df.index.astype("string")),
+            "stcotrbg": pa.array(hh_df["blkgrp_fips"]),
+            "hh_race": pa.array(hh_df["hh_race"]),
+            "hh_income": pa.array(hh_df["hh_income"]),
+            "latitude": pa.array(hh_df["lat"]),
+            "longitude": pa.array(hh_df["lon"]),
+        }
+    )
+
+
+def get_fred_schools_table(sch_df: pd.DataFrame) -> pa.Table:
+    """
+    Builds the FRED schools table from the combined public and private schools
+    df.
+    """
+    return pa.table(
+        {
+            "sp_id": pa.array(sch_df.index.astype("string")),
+            "stco": pa.array(sch_df["county_fips"]),
+            "latitude": pa.array(sch_df["lat"]),
+            "longitude": pa.array(sch_df["lon"]),
+            "total": pa.array(sch_df["enrollment_total"]),
+        }
+    )
+
+
+def write_fred_file(table: pa.Table, counties: np.ndarray, path: Path) -> None:
+    """
+    Writes `table` as a FRED population file, with each county's rows in their
+    own chunk (see `write_fred_chunks`).
+    """
+    positions = pd.Series(counties).groupby(counties, sort=True, dropna=False).indices
+
+    write_fred_chunks(
+        [
+            functools.partial(table.take, county_positions)
+            for county_positions in positions.values()
+        ],
+        path,
+        table.column_names,
+    )
+
+
+def write_fred_chunks(
+    chunks: list[Callable[[], pa.Table]],
+    path: Path,
+    column_names: list[str] | None = None,
+) -> None:
+    """
+    Writes a FRED population file from its chunks, which are given as
+    functions returning their rows. Each chunk is loaded and rendered in
+    parallel on a worker thread with pyarrow's CSV writer, so at most
+    `N_WORKERS` chunks are in memory at once, and the rendered chunks are then
+    concatenated into `path` after a header of their column names (or of
+    `column_names` if there are no chunks).
+
+    When `FRED_OUTPUT_COMPRESSION` is set, every chunk is compressed on its own
+    worker thread. Concatenated gzip members form a valid gzip file, so no
+    recompression is needed when joining the chunks.
+    """
+
+    def write_header(chunk_path: Path, column_names: list[str]) -> None:
+        # pyarrow always quotes header names, which FRED does not expect
+        header = ",".join(column_names) + "\n"
+        with pa.output_stream(chunk_path, compression=FRED_OUTPUT_COMPRESSION) as sink:
+            sink.write(header.encode())
+
+    def write_chunk(chunk_path: Path, get_chunk: Callable[[], pa.Table]) -> list[str]:
+        chunk = get_chunk()
+        options = pacsv.WriteOptions(include_header=False, quoting_style="none")
+        with pa.output_stream(chunk_path, compression=FRED_OUTPUT_COMPRESSION) as sink:
+            pacsv.write_csv(chunk, sink, options)
+
+        return chunk.column_names
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=path.parent) as tmp_dir:
+        chunk_paths = [Path(tmp_dir, str(i)) for i in range(len(chunks) + 1)]
+
+        with ThreadPoolExecutor(max_workers=N_WORKERS) as executor:
+            futures = [
+                executor.submit(write_chunk, chunk_path, get_chunk)
+                for chunk_path, get_chunk in zip(chunk_paths[1:], chunks)
+            ]
+            chunk_column_names = [future.result() for future in futures]
+
+        if chunk_column_names:
+            column_names = chunk_column_names[0]
+        assert column_names is not None, "FRED file has neither chunks nor columns"
+        write_header(chunk_paths[0], column_names)
+
+        with open(path, "wb") as file:
+            for chunk_path in chunk_paths:
+                with open(chunk_path, "rb") as chunk_file:
+                    shutil.copyfileobj(chunk_file, file)
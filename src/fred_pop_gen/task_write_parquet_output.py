@@ -0,0 +1,240 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pytask import DirectoryNode, Product
+
+from fred_pop_gen.config import (
+    DATA,
+    DATA_CATALOG,
+    DATAFRAME_ENGINE,
+    N_WORKERS,
+    PERSONS_FILE,
+    STATE_FIPS,
+)
+from fred_pop_gen.task_collect_output_by_county import get_school_ids
+from fred_pop_gen.task_stream_persons import (
+    PERSONS_SPILL_DIR,
+    get_spilled_counties,
+    read_persons_index,
+    read_spilled_persons,
+)
+
+PARQUET_OUTPUT_DIR = DATA / "output" / "parquet"
+PEOPLE_DATASET_DIR = PARQUET_OUTPUT_DIR / "people"
+HOUSEHOLDS_DATASET_DIR = PARQUET_OUTPUT_DIR / "households"
+
+ROW_GROUP_SIZE = 128 * 1024
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("state", pa.string()), ("county", pa.string())]), flavor="hive"
+)
+
+
+if DATAFRAME_ENGINE == "stream":
+
+    def task_write_people_dataset(
+        spill_paths: Annotated[
+            list[Path],
+            DirectoryNode(root_dir=PERSONS_SPILL_DIR, pattern="county=*/*.parquet"),
+        ],
+        codes: Annotated[np.ndarray, DATA_CATALOG[f"school_codes_{STATE_FIPS}"]],
+        pubsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"public_schools_{STATE_FIPS}"]
+        ],
+        privsch_df: Annotated[
+            pd.DataFrame, DATA_CATALOG[f"private_schools_{STATE_FIPS}"]
+        ],
+        dir: Annotated[
+            Path,
+            DirectoryNode(
+                root_dir=PEOPLE_DATASET_DIR, pattern=f"state={STATE_FIPS}/**/*.parquet"
+            ),
+            Product,
+        ],
+        persons_path: Path = PERSONS_FILE,
+    ) -> None:
+        """
+        Writes the spilled persons as a Parquet dataset partitioned by state and
+        county, reading each county on the worker thread that writes its
+        partition (see `read_spilled_persons`).
+        """
+        index = read_persons_index(persons_path)
+        school_ids = get_school_ids(pubsch_df, privsch_df)
+
+        def write_county(county: str) -> None:
+            p_df = read_spilled_persons(county, index, school_ids, codes, persons_path)
+            table = get_people_table(p_df, np.full(len(p_df), county, dtype=object))
+            table = table.sort_by([("hh_id", "ascending")])
+
+            write_partition(table.drop_columns(["state", "county"]), county, dir)
+
+        counties = get_spilled_counties(spill_paths)
+        with ThreadPoolExecutor(max_workers=N_WORKERS) as executor:
+            futures = [executor.submit(write_county, county) for county in counties]
+            for future in futures:
+                future.result()
+
+        remove_stale_partitions(dir, counties)
+
+else:
+
+    def task_write_people_dataset(
+        p_df: Annotated[pd.DataFrame, DATA_CATALOG[f"persons_w_school_{STATE_FIPS}"]],
+        hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+        dir: Annotated[
+            Path,
+            DirectoryNode(
+                root_dir=PEOPLE_DATASET_DIR, pattern=f"state={STATE_FIPS}/**/*.parquet"
+            ),
+            Product,
+        ],
+    ) -> None:
+        """
+        Writes the persons as a Parquet dataset partitioned by state and county.
+        """
+        hh_idx = hh_df.index.get_indexer(p_df["hh_id"])
+        assert (hh_idx >= 0).all(), "persons file contains unknown households"
+        counties = hh_df["county_fips"].to_numpy()[hh_idx]
+
+        table = get_people_table(p_df, counties)
+        table = table.sort_by([("county", "ascending"), ("hh_id", "ascending")])
+
+        write_partitioned_dataset(table, dir)
+
+
+def task_write_households_dataset(
+    hh_df: Annotated[pd.DataFrame, DATA_CATALOG[f"households_{STATE_FIPS}"]],
+    dir: Annotated[
+        Path,
+        DirectoryNode(
+            root_dir=HOUSEHOLDS_DATASET_DIR, pattern=f"state={STATE_FIPS}/**/*.parquet"
+        ),
+        Product,
+    ],
+) -> None:
+    """
+    Writes the households as a Parquet dataset partitioned by state and county.
+    """
+    table = pa.table(
+        {
+            "state": pa.array([STATE_FIPS] * len(hh_df), pa.string()),
+            "county": pa.array(hh_df["county_fips"], pa.string()),
+            "hh_id": pa.array(hh_df.index.astype("string")),
+            "hh_age": pa.array(hh_df["hh_age"], pa.uint8()),
+            "hh_income": pa.array(hh_df["hh_income"], pa.int32()),
+            "hh_race": pa.array(hh_df["hh_race"], pa.uint8()),
+            "size": pa.array(hh_df["size"], pa.uint8()),
+            "blkgrp_fips": pa.array(hh_df["blkgrp_fips"], pa.string()),
+            "lat": pa.array(hh_df["lat"], pa.float64()),
+            "lon": pa.array(hh_df["lon"], pa.float64()),
+        }
+    )
+    table = table.sort_by([("county", "ascending"), ("hh_id", "ascending")])
+
+    write_partitioned_dataset(table, dir)
+
+
+def get_people_table(p_df: pd.DataFrame, counties: np.ndarray) -> pa.Table:
+    """
+    Builds the table of the people dataset from the persons df and the county
+    of each person.
+    """
+    return pa.table(
+        {
+            "state": pa.array([STATE_FIPS] * len(p_df), pa.string()),
+            "county": pa.array(counties, pa.string()),
+            "sp_id": pa.array(p_df.index.astype("string")),
+            "hh_id": pa.array(p_df["hh_id"].astype("string")),
+            "sporder": pa.array(p_df["sporder"], pa.uint8()),
+            "age": pa.array(p_df["agep"], pa.uint8()),
+            "sex": pa.array(p_df["sex"], pa.uint8()),
+            "race": pa.array(p_df["rac1p"], pa.uint8()),
+            "relate": pa.array(p_df["relshipp"], pa.uint8()),
+            "school_id": pa.array(
+                p_df["school_id"].astype("string")
+            ).dictionary_encode(),
+        }
+    )
+
+
+def write_partitioned_dataset(table: pa.Table, dir: Path) -> None:
+    """
+    Writes `table`, which must be sorted by county and household, to a Hive
+    partitioned (state/county) Parquet dataset rooted at `dir`. The partitions
+    are written in parallel, one file each, with the row order preserved so the
+    row group statistics on `hh_id` stay narrow and readers can skip row groups
+    as well as partitions. The partitions of counties that are not in `table`
+    are removed (see `remove_stale_partitions`).
+    """
+    counties = table.column("county").to_numpy(zero_copy_only=False)
+    positions = pd.Series(counties).groupby(counties, sort=True).indices
+
+    def write_county(county: str, county_positions: np.ndarray) -> None:
+        partition = table.take(county_positions).drop_columns(["state", "county"])
+        write_partition(partition, county, dir)
+
+    with ThreadPoolExecutor(max_workers=N_WORKERS) as executor:
+        futures = [
+            executor.submit(write_county, county, county_positions)
+            for county, county_positions in positions.items()
+        ]
+        for future in futures:
+            future.result()
+
+    remove_stale_partitions(dir, list(positions))
+
+
+def remove_stale_partitions(dir: Path, counties: list[str]) -> None:
+    """
+    Removes the county partitions of the state from a dataset rooted at `dir`
+    that are not in `counties`, e.g. left over from a run over other counties,
+    so that they are not read back with the current ones.
+    """
+    partitions = {
+        dir / f"state={STATE_FIPS}" / f"county={county}" for county in counties
+    }
+    for partition_dir in (dir / f"state={STATE_FIPS}").glob("county=*"):
+        if partition_dir not in partitions:
+            shutil.rmtree(partition_dir, ignore_errors=True)
+
+
+def write_partition(partition: pa.Table, county: str, dir: Path) -> None:
+    """
+    Writes the rows of a county, without the partition columns, as the single
+    file of its partition of a dataset rooted at `dir`.
+    """
+    partition_dir = dir / f"state={STATE_FIPS}" / f"county={county}"
+    shutil.rmtree(partition_dir, ignore_errors=True)
+    partition_dir.mkdir(parents=True)
+
+    pq.write_table(
+        partition,
+        partition_dir / "part-0.parquet",
+        row_group_size=ROW_GROUP_SIZE,
+        compression="zstd",
+        write_statistics=True,
+    )
+
+
+def read_county_dataset(
+    dir: Path, counties: list[str], columns: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    Reads the rows of `counties` from a dataset written by
+    `write_partitioned_dataset`, only opening the matching partitions.
+    """
+    table = pq.read_table(
+        dir,
+        columns=columns,
+        filters=[("county", "in", counties)],
+        partitioning=PARTITIONING,
+    )
+
+    return table.to_pandas()
@@ -1,63 +1,270 @@
-from functools import reduce
+import hashlib
+import re
+from functools import cache
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import requests
 
-from fred_pop_gen.config import CENSUS_YEAR, STATE_FIPS, DATA
+from fred_pop_gen.config import (
+    CENSUS_STORE_DIR,
+    CENSUS_YEAR,
+    DATA,
+    HOUSEHOLDS_FILE,
+    SHARD_HOUSEHOLDS,
+    SHARD_SIZE,
+    STATE_FIPS,
+)
+from fred_pop_gen.constants import Grade
 
 COUNTIES_FILE = DATA / f"input/counties-{STATE_FIPS}.txt"
 
 
-def _download_county_fips() -> None:
+def _read_county_fips() -> list[str]:
     """
-    Downloads county FIPS codes from the census API and writes them to
-    `COUNTIES_FILE`.
+    Reads the distinct county FIPS codes from the households file. Only the
+    `county_fips` column is read, dictionary-encoded, so the distinct values can
+    be taken from the (small) dictionary rather than every row.
     """
-    # NOTE: we are using a DUMMY variable (B01001_001E) in the API call
-    # all we really need is the state and county values
-    url = f"https://api.census.gov/data/{CENSUS_YEAR}/acs/acs5?get=B01001_001E&for=county:*&in=state:{STATE_FIPS}"
-    res = requests.get(url)
-    res.raise_for_status()
+    table = pq.read_table(
+        HOUSEHOLDS_FILE, columns=["county_fips"], read_dictionary=["county_fips"]
+    )
+    column = table.column("county_fips").unify_dictionaries()
+    counties = set()
+    for chunk in column.chunks:
+        dictionary = pc.cast(chunk.dictionary, pa.string())
+        counties.update(dictionary.to_pylist())
 
-    data = res.json()
+    return sorted(county for county in counties if county)
 
-    df = pd.DataFrame(data[1:], columns=data[0])
 
-    df["county_fips"] = df["state"] + df["county"]
+@cache
+def get_county_fips() -> tuple[str, ...]:
+    """
+    Gets all county FIPS codes in the state for generating per-county tasks.
+
+    This runs at import time in several task modules, so it is memoized per
+    process (as a tuple, which the callers cannot modify) and never touches
+    the network. The counties are derived from the households file and cached
+    in `COUNTIES_FILE`, whose first line records the size and modification
+    time of the households file they were read from. The cache is only reused
+    while they match, so a counties file of another households file (or one
+    written by an older version of the project) is regenerated. If the
+    households file does not exist yet, no county tasks are generated.
+    """
+    if not HOUSEHOLDS_FILE.exists():
+        return ()
 
-    counties = list(df["county_fips"])
-    counties.sort()
+    stat = HOUSEHOLDS_FILE.stat()
+    source = f"# {HOUSEHOLDS_FILE.name} {stat.st_size} {stat.st_mtime_ns}"
 
-    with open(COUNTIES_FILE, "w") as file:
-        file.write("\n".join(counties))
+    if COUNTIES_FILE.exists():
+        lines = COUNTIES_FILE.read_text().splitlines()
+        if lines and lines[0] == source:
+            return tuple(lines[1:])
 
+    counties = tuple(_read_county_fips())
 
-def get_county_fips() -> list[str]:
+    COUNTIES_FILE.write_text("\n".join([source, *counties]))
+
+    return counties
+
+
+@cache
+def get_county_household_counts() -> pd.Series:
     """
-    Gets all county FIPS codes in the state for generating per-county tasks.
-    This is memoized to avoid unnecessary API calls.
+    Counts the households of each county in the households file, sorted from
+    the largest county, which is the size estimate available when tasks are
+    generated at import time.
     """
+    if not HOUSEHOLDS_FILE.exists():
+        return pd.Series(dtype="int64")
 
-    if not COUNTIES_FILE.exists():
-        _download_county_fips()
+    table = pq.read_table(HOUSEHOLDS_FILE, columns=["county_fips"])
+    counts = table.column("county_fips").value_counts().to_pylist()
 
-    counties = []
-    with open(COUNTIES_FILE, "r") as file:
-        for line in file.readlines():
-            counties.append(line.strip())
+    return pd.Series(
+        {str(count["values"]): count["counts"] for count in counts}
+    ).sort_values(ascending=False)
 
-    return counties
+
+@cache
+def get_county_shards() -> dict[str, list[str]]:
+    """
+    Groups the county FIPS codes of the state into shards of consecutive
+    counties, which are the units of the per-county tasks. A shard holds
+    `SHARD_SIZE` counties, or if `SHARD_HOUSEHOLDS` is set, as many counties
+    as it takes to reach that many households. Shards of a single county are
+    keyed by its FIPS code, and larger shards by their first and last county.
+    """
+    counties = get_county_fips()
+    shards = []
+
+    if SHARD_HOUSEHOLDS is None:
+        for i in range(0, len(counties), SHARD_SIZE):
+            shards.append(list(counties[i : i + SHARD_SIZE]))
+    else:
+        counts = get_county_household_counts()
+        shard, n_households = [], 0
+        for county in counties:
+            shard.append(county)
+            n_households += counts.get(county, 0)
+            if n_households >= SHARD_HOUSEHOLDS:
+                shards.append(shard)
+                shard, n_households = [], 0
+        if shard:
+            shards.append(shard)
+
+    return {
+        shard[0] if len(shard) == 1 else f"{shard[0]}-{shard[-1]}": shard
+        for shard in shards
+    }
 
 
-def filter_df_by_county(df: pd.DataFrame, county_fips: str) -> pd.DataFrame:
-    return df.loc[df["county_fips"] == county_fips]
+# columns that locate each person in the persons df (`p_idx`) and the
+# households df (`hh_idx`), and their county, see `task_merge_p_hh_df`
+KEY_COLUMNS = ["p_idx", "hh_idx", "county_fips"]
+
+# columns of the persons carried past the household merge, the ones read by
+# the stages that take the merged persons (grade, employment and replicates)
+MERGED_COLUMNS = ["agep", "sex"]
+
+# columns of the persons read and written by each stage after the household
+# merge, besides the key columns, see `project_persons`
+STAGE_COLUMNS = {
+    "grade": (["agep"], ["grade"]),
+    "enrollment": (["grade"], ["enrollment"]),
+    "employment": (["agep", "sex"], ["employed"]),
+    "school": (["grade", "enrollment"], ["school_id"]),
+}
+
+
+def project_persons(p_df: pd.DataFrame, stage: str) -> pd.DataFrame:
+    """
+    Projects the persons onto the key columns and the columns read by `stage`
+    (see `STAGE_COLUMNS`). With copy-on-write, the projection shares its
+    columns with `p_df`, so no stage copies columns it does not read, and
+    persons filtered from the projection only copy the narrow columns.
+    """
+    reads, _ = STAGE_COLUMNS[stage]
+
+    return p_df[KEY_COLUMNS + reads]
+
+
+def join_columns(
+    p_df: pd.DataFrame, stage: str, columns: dict[str, np.ndarray | pd.Series]
+) -> pd.DataFrame:
+    """
+    Joins the columns written by `stage` (see `STAGE_COLUMNS`), which are
+    aligned with the persons by position, onto the projection of the persons
+    the stage received. The other columns are shared rather than copied.
+    """
+    _, writes = STAGE_COLUMNS[stage]
+    assert sorted(columns) == sorted(writes), f"{stage} stage writes {writes}"
+
+    return p_df.assign(
+        **{
+            column: values.to_numpy() if isinstance(values, pd.Series) else values
+            for column, values in columns.items()
+        }
+    )
+
+
+def filter_df_by_counties(df: pd.DataFrame, counties: list[str]) -> pd.DataFrame:
+    return df.loc[df["county_fips"].isin(counties)]
+
+
+def gather_household_columns(
+    p_df: pd.DataFrame, hh_df: pd.DataFrame, columns: list[str]
+) -> pd.DataFrame:
+    """
+    Gathers `columns` of each person's household by position, using the
+    household index (`hh_idx`) set in `task_merge_p_hh_df`. The result is
+    aligned with `p_df`.
+    """
+    hh_idx = p_df["hh_idx"].to_numpy()
+
+    return pd.DataFrame(
+        {column: np.take(hh_df[column].to_numpy(), hh_idx) for column in columns},
+        index=p_df.index,
+    )
+
+
+# lookup from `Grade` values to `Grade` members
+GRADES = np.array(list(Grade), dtype=object)
+
+# ages of school-aged persons, see `map_age_to_grade`
+MIN_SCHOOL_AGE = 3
+MAX_SCHOOL_AGE = 17
+
+
+def get_grade_codes(age: np.ndarray) -> np.ndarray:
+    """
+    Gets the `Grade` value of each person from their age, or -1 for
+    non-school-aged persons, the vectorized counterpart of `map_age_to_grade`
+    used by every engine but pandas.
+    """
+    age = np.asarray(age)
+
+    return np.where(
+        (age >= MIN_SCHOOL_AGE) & (age <= MAX_SCHOOL_AGE),
+        np.maximum(age - (MIN_SCHOOL_AGE + 1), 0),
+        -1,
+    ).astype(np.int8)
+
+
+def get_grade_mask(lowest: np.ndarray, highest: np.ndarray) -> np.ndarray:
+    """
+    Encodes the grade spans `lowest`..`highest` (inclusive, as `Grade` values)
+    as bitmasks where bit i is set if `Grade(i)` is offered. Inverted spans
+    (`lowest` > `highest`) offer no grades.
+    """
+    lowest = np.asarray(lowest, dtype=np.int32)
+    highest = np.asarray(highest, dtype=np.int32)
+
+    mask = ((1 << (highest + 1)) - 1) ^ ((1 << lowest) - 1)
+    mask = np.where(lowest <= highest, mask, 0)
+
+    return mask.astype(np.uint16)
+
+
+def get_grade_range(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes bitmasks created by `get_grade_mask` into the lowest and highest
+    offered `Grade` values, which are both -1 for masks without any grade.
+    """
+    mask = np.asarray(mask, dtype=np.int32)
+    offered = mask > 0
+
+    lowest = np.full(mask.shape, -1, dtype=np.int8)
+    highest = np.full(mask.shape, -1, dtype=np.int8)
+    lowest[offered] = np.log2(mask[offered] & -mask[offered]).astype(np.int8)
+    highest[offered] = np.log2(mask[offered]).astype(np.int8)
+
+    return lowest, highest
+
+
+def hash_file(path: Path) -> str:
+    """
+    Computes the SHA-256 hash of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+
+    return digest.hexdigest()
 
 
 def haversine(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray):
     """
     Computes haversize distance between numpy arrays of latitude and longitude
-    coordinates.
+    coordinates. This is the reference that the unit-vector kernels of
+    `distance.py` are tested against.
     """
     R = 3956  # Radius of Earth in miles
 
@@ -73,30 +280,48 @@ def haversine(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.nda
     return distance
 
 
-def census_api_call(api_vars: list[str]) -> pd.DataFrame:
+def census_api_table_call(table: str) -> pd.DataFrame:
     """
-    Executes a Census API call. The Census API limits API calls to a maximum of
-    50 API variables per call, so the `api_vars` inputted are split into chunks
-    of 50, and the data for each call is merged together.
+    Executes a Census API call for every estimate of an ACS table (e.g.
+    `B14003_001E`) in the counties of the state. The margins of error and
+    annotations returned with the table group are dropped.
     """
-    CHUNK_SIZE = 50
-    dfs = []
+    url = f"https://api.census.gov/data/{CENSUS_YEAR}/acs/acs5?get=group({table})&for=county:*&in=state:{STATE_FIPS}"
+
+    res = requests.get(url)
+    res.raise_for_status()
 
-    for i in range(0, len(api_vars), CHUNK_SIZE):
-        chunk_api_vars = api_vars[i : i + CHUNK_SIZE]
+    data = res.json()
+    df = pd.DataFrame(data[1:], columns=data[0])
 
-        url = f"https://api.census.gov/data/{CENSUS_YEAR}/acs/acs5?get={','.join(chunk_api_vars)}&for=county:*&in=state:{STATE_FIPS}"
+    api_vars = [col for col in df.columns if re.fullmatch(rf"{table}_\d{{3}}E", col)]
+    df = df[["state", "county"] + api_vars]
+    df[api_vars] = df[api_vars].astype("int32")
+    return df
 
-        res = requests.get(url)
-        res.raise_for_status()
 
-        data = res.json()
-        df = pd.DataFrame(data[1:], columns=data[0])
-        dfs.append(df)
+def get_census_store_path(table: str) -> Path:
+    """
+    Gets the path of an ACS table of `CENSUS_YEAR` in the census store.
+    """
+    return (
+        CENSUS_STORE_DIR / f"year={CENSUS_YEAR}" / f"table={table}" / "part-0.parquet"
+    )
+
 
-    def merge_df(l_df, r_df):
-        return pd.merge(l_df, r_df, on=["state", "county"])
+def read_census_table(table: str, api_vars: list[str]) -> pd.DataFrame:
+    """
+    Reads `api_vars` of an ACS table for the counties of the state from the
+    census store (see `task_build_census_store`), in the same form as the
+    Census API: `state` and `county` FIPS columns followed by int32 estimates.
+    """
+    df = pq.read_table(
+        get_census_store_path(table),
+        columns=["state", "county"] + api_vars,
+        filters=[("state", "==", STATE_FIPS)],
+        partitioning=None,
+    ).to_pandas()
+    assert len(df) > 0, f"census store has no {table} data for state {STATE_FIPS}"
 
-    merged_df = reduce(merge_df, dfs)
-    merged_df[api_vars] = merged_df[api_vars].astype("int32")
-    return merged_df
+    df[api_vars] = df[api_vars].astype("int32")
+    return df
@@ -0,0 +1,439 @@
+"""
+A work queue backed by a SQLite file, used to run the county shards of a
+stage on several nodes (see `COUNTY_EXECUTION = "queue"`). The queue and the
+inputs and outputs of its items only need storage shared by every node.
+
+Each item names an importable function, its (JSON) keyword arguments and the
+Parquet file its resulting DataFrame is written to. Workers claim items by
+leasing them, renew their lease with heartbeats while they run, and write
+their output atomically before marking the item as done. Items whose lease
+expires are claimed again, so a node that dies only delays its items.
+
+Usage:
+
+    python -m fred_pop_gen.work_queue worker [--queue PATH] [--wait]
+    python -m fred_pop_gen.work_queue status [--queue PATH]
+
+Any number of workers can be started, on one or more nodes, and a worker
+exits once every item is done or failed unless `--wait` is given.
+"""
+
+import argparse
+import functools
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import pandas as pd
+
+from fred_pop_gen.config import (
+    QUEUE_FILE,
+    QUEUE_HEARTBEAT_SECONDS,
+    QUEUE_LEASE_SECONDS,
+    QUEUE_MAX_ATTEMPTS,
+    QUEUE_POLL_SECONDS,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    fn TEXT NOT NULL,
+    args TEXT NOT NULL,
+    output TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+)
+"""
+
+
+def connect(path: Path = QUEUE_FILE) -> sqlite3.Connection:
+    """
+    Opens the queue, creating it if needed. Transactions are explicit (see
+    `transaction`), and the default rollback journal is kept as SQLite's
+    write-ahead log does not work over network filesystems.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(SCHEMA)
+
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    Runs a block in an immediate transaction, which takes the write lock of
+    the queue up front so that two workers never claim the same item.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def write_input(obj: Any, dir: Path, name: str) -> Path:
+    """
+    Pickles an input of queue items to `dir`, named by `name` and the hash of
+    its contents, so that the arguments of an item (see `enqueue_items`)
+    change whenever its inputs do. Existing inputs are not rewritten.
+    """
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    path = dir / f"{name}-{hashlib.blake2b(data, digest_size=10).hexdigest()}.pkl"
+
+    if not path.exists():
+        dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    return path
+
+
+def remove_stale_items(conn: sqlite3.Connection, prefix: str, keys: list[str]) -> None:
+    """
+    Removes the items whose key starts with `prefix` but is not one of `keys`,
+    e.g. the shards of an earlier shard size, along with their outputs. Items
+    running under an unexpired lease are kept.
+    """
+    keys = set(keys)
+
+    with transaction(conn):
+        rows = conn.execute(
+            "SELECT key, output FROM items WHERE substr(key, 1, ?) = ? "
+            "AND NOT (status = 'running' AND lease_expires >= ?)",
+            (len(prefix), prefix, time.time()),
+        ).fetchall()
+
+        stale = [row for row in rows if row["key"] not in keys]
+        conn.executemany(
+            "DELETE FROM items WHERE key = ?", [(row["key"],) for row in stale]
+        )
+
+    for row in stale:
+        Path(row["output"]).unlink(missing_ok=True)
+
+
+def remove_unused_inputs(conn: sqlite3.Connection, dir: Path) -> None:
+    """
+    Removes the inputs in `dir` (see `write_input`) that no item of the queue
+    refers to any more, e.g. those of shards whose inputs changed since.
+    """
+    used = set()
+    for row in conn.execute("SELECT args FROM items"):
+        used.update(
+            value
+            for value in json.loads(row["args"]).values()
+            if isinstance(value, str)
+        )
+
+    for path in dir.glob("*.pkl"):
+        if str(path) not in used:
+            path.unlink(missing_ok=True)
+
+
+@functools.lru_cache(maxsize=4)
+def read_input(path: str) -> Any:
+    """
+    Unpickles an input written by `write_input`. Inputs are content-addressed,
+    so the last few are kept in memory for the next items of a worker (e.g.
+    the households shared by every shard of a state).
+    """
+    return pd.read_pickle(path)
+
+
+def enqueue_items(conn: sqlite3.Connection, items: list[dict[str, Any]]) -> None:
+    """
+    Adds items, given by their `key`, `fn` (`module:function`), `args`,
+    `output` and `cost`, to the queue. Items with the same function and
+    arguments that are already done and whose output exists, or that are
+    running under an unexpired lease, are kept, so a stage that is rerun only
+    redoes its changed items and does not restart the items of another run
+    in progress; any other item is reset to pending.
+    """
+    now = time.time()
+
+    with transaction(conn):
+        for item in items:
+            args = json.dumps(item["args"], sort_keys=True)
+            row = conn.execute(
+                "SELECT fn, args, output, status, lease_expires FROM items "
+                "WHERE key = ?",
+                (item["key"],),
+            ).fetchone()
+
+            unchanged = row is not None and (
+                (row["fn"], row["args"], row["output"])
+                == (item["fn"], args, str(item["output"]))
+            )
+            if unchanged and row["status"] == "done" and Path(row["output"]).exists():
+                continue
+            if unchanged and row["status"] == "running" and row["lease_expires"] >= now:
+                continue
+
+            conn.execute(
+                "INSERT OR REPLACE INTO items (key, fn, args, output, cost) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (item["key"], item["fn"], args, str(item["output"]), item["cost"]),
+            )
+
+
+def claim_item(
+    conn: sqlite3.Connection,
+    worker: str,
+    lease: float = QUEUE_LEASE_SECONDS,
+    max_attempts: int = QUEUE_MAX_ATTEMPTS,
+) -> sqlite3.Row | None:
+    """
+    Leases the costliest item that is pending or whose lease has expired to
+    `worker` for `lease` seconds, or returns None if there is none. Expired
+    items that already had `max_attempts` attempts are marked as failed.
+    """
+    now = time.time()
+
+    with transaction(conn):
+        conn.execute(
+            "UPDATE items SET status = 'failed', error = 'lease expired' "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+            (now, max_attempts),
+        )
+        row = conn.execute(
+            "SELECT * FROM items "
+            "WHERE status = 'pending' OR (status = 'running' AND lease_expires < ?) "
+            "ORDER BY cost DESC, key LIMIT 1",
+            (now,),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        conn.execute(
+            "UPDATE items SET status = 'running', worker = ?, lease_expires = ?, "
+            "attempts = attempts + 1, error = NULL WHERE key = ?",
+            (worker, now + lease, row["key"]),
+        )
+
+    return row
+
+
+def renew_lease(
+    conn: sqlite3.Connection,
+    key: str,
+    worker: str,
+    lease: float = QUEUE_LEASE_SECONDS,
+) -> bool:
+    """
+    Extends the lease of an item held by `worker`. Returns False if the item
+    is no longer held by it, e.g. its lease expired and it was claimed again.
+    """
+    with transaction(conn):
+        cursor = conn.execute(
+            "UPDATE items SET lease_expires = ? "
+            "WHERE key = ? AND worker = ? AND status = 'running'",
+            (time.time() + lease, key, worker),
+        )
+
+    return cursor.rowcount == 1
+
+
+def finish_item(
+    conn: sqlite3.Connection,
+    key: str,
+    worker: str,
+    error: str | None = None,
+    max_attempts: int = QUEUE_MAX_ATTEMPTS,
+) -> None:
+    """
+    Marks an item held by `worker` as done, or if an `error` is given, as
+    pending again for another attempt, or as failed after `max_attempts`.
+    """
+    with transaction(conn):
+        if error is None:
+            conn.execute(
+                "UPDATE items SET status = 'done', lease_expires = NULL "
+                "WHERE key = ? AND worker = ? AND status = 'running'",
+                (key, worker),
+            )
+        else:
+            conn.execute(
+                "UPDATE items SET "
+                "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_expires = NULL, error = ? "
+                "WHERE key = ? AND worker = ? AND status = 'running'",
+                (max_attempts, error, key, worker),
+            )
+
+
+def count_items(conn: sqlite3.Connection) -> dict[str, int]:
+    """
+    Counts the items of the queue by status.
+    """
+    rows = conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status")
+
+    return {status: count for status, count in rows}
+
+
+def run_worker(
+    path: Path = QUEUE_FILE,
+    wait: bool = False,
+    poll: float = QUEUE_POLL_SECONDS,
+    lease: float = QUEUE_LEASE_SECONDS,
+    heartbeat: float = QUEUE_HEARTBEAT_SECONDS,
+) -> int:
+    """
+    Claims and runs items (see `run_item`) until every item of the queue is
+    done or failed, or forever if `wait` is True. Items are leased for `lease`
+    seconds and renewed every `heartbeat` seconds. Returns the number of items
+    run by this worker.
+    """
+    conn = connect(path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    n_items = 0
+
+    while True:
+        row = claim_item(conn, worker, lease)
+        if row is not None:
+            run_item(conn, path, row, worker, lease, heartbeat)
+            n_items += 1
+            continue
+
+        counts = count_items(conn)
+        if not wait and not counts.get("pending") and not counts.get("running"):
+            return n_items
+
+        # items running on other workers may still fail or expire
+        time.sleep(poll)
+
+
+def run_item(
+    conn: sqlite3.Connection,
+    path: Path,
+    row: sqlite3.Row,
+    worker: str,
+    lease: float = QUEUE_LEASE_SECONDS,
+    heartbeat: float = QUEUE_HEARTBEAT_SECONDS,
+) -> None:
+    """
+    Runs a claimed item, renewing its lease from a heartbeat thread (with its
+    own connection to the queue at `path`), and
+    writes the DataFrame returned by its function to its output through a
+    temporary file. If the lease is lost while it runs, the output is still
+    written (items are deterministic, so a concurrent attempt writes the same
+    output) but the item is left to the worker now holding it.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def renew() -> None:
+        conn = connect(path)
+        while not stop.wait(heartbeat):
+            if not renew_lease(conn, row["key"], worker, lease):
+                lost.set()
+                break
+        conn.close()
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+
+    error = None
+    try:
+        module, name = row["fn"].split(":")
+        fn = getattr(importlib.import_module(module), name)
+        df = fn(**json.loads(row["args"]))
+
+        output = Path(row["output"])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp_output = output.with_suffix(f".{worker.replace(':', '-')}.tmp")
+        df.to_parquet(tmp_output)
+        tmp_output.replace(output)
+    # any error of the item's function is recorded, and the item is retried
+    except Exception:  # noqa: BLE001
+        error = traceback.format_exc()
+    finally:
+        stop.set()
+        thread.join()
+
+    if not lost.is_set():
+        finish_item(conn, row["key"], worker, error)
+
+
+def run_items(items: list[dict[str, Any]], path: Path = QUEUE_FILE) -> list[Path]:
+    """
+    Enqueues items (see `enqueue_items`) and serves the queue as a worker
+    until every item is done or failed, alongside any other workers. Returns
+    the outputs of the items, or raises a RuntimeError with the errors of the
+    failed ones.
+    """
+    conn = connect(path)
+    enqueue_items(conn, items)
+    run_worker(path)
+
+    keys = [item["key"] for item in items]
+    rows = conn.execute(
+        f"SELECT key, status, error FROM items WHERE key IN ({','.join('?' * len(keys))})",
+        keys,
+    ).fetchall()
+    failed = [row for row in rows if row["status"] != "done"]
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} queue items failed:\n"
+            + "\n".join(f"{row['key']}: {row['error']}" for row in failed)
+        )
+
+    return [Path(item["output"]) for item in items]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m fred_pop_gen.work_queue",
+        description="Runs or inspects the work queue of the county shards.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="claim and run items")
+    worker.add_argument(
+        "--wait",
+        action="store_true",
+        help="keep polling for new items once the queue is drained",
+    )
+
+    status = commands.add_parser("status", help="count the items by status")
+
+    for command in (worker, status):
+        command.add_argument("--queue", type=Path, default=QUEUE_FILE)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        print(f"ran {run_worker(args.queue, args.wait)} items")
+        return 0
+
+    conn = connect(args.queue)
+    for status, count in sorted(count_items(conn).items()):
+        print(f"{status}: {count}")
+    for row in conn.execute("SELECT key, error FROM items WHERE status = 'failed'"):
+        print(f"  {row['key']}: {row['error'].strip().splitlines()[-1]}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Checks that the Arrow engine (`prepare_persons`) produces the same persons as
+the pandas engine on a small synthetic state.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fred_pop_gen.config import RNG
+from fred_pop_gen.constants import EmploymentAgeBucket
+from fred_pop_gen.task_assign_enrollment import (
+    assign_enrollment_to_persons,
+    assign_grade_to_persons,
+    map_age_to_grade,
+)
+from fred_pop_gen.task_assign_workplaces import assign_employment_to_persons
+from fred_pop_gen.task_merge_p_hh_df import merge_p_hh_df
+from fred_pop_gen.task_prepare_persons import prepare_persons
+from fred_pop_gen.utils import get_grade_codes
+
+SEED = 2024
+
+COUNTIES = ["56001", "56003", "56005"]
+
+
+def seed_rng() -> None:
+    """
+    Resets the shared `RNG`, which both engines draw from, to `SEED`.
+    """
+    RNG.bit_generator.state = np.random.default_rng(SEED).bit_generator.state
+
+
+@pytest.fixture(scope="module")
+def state() -> dict:
+    rng = np.random.default_rng(0)
+    n_households, n_persons = 300, 1000
+
+    hh_df = pd.DataFrame(
+        {"county_fips": pd.array(rng.choice(COUNTIES, n_households), "string")},
+        index=pd.Index([f"hh{i}" for i in range(n_households)], name="hh_id"),
+    )
+    p_df = pd.DataFrame(
+        {
+            "hh_id": rng.choice(hh_df.index.to_numpy(), n_persons),
+            "agep": rng.integers(0, 100, n_persons),
+            "sex": rng.integers(1, 3, n_persons),
+        }
+    )
+
+    enrollment_df = pd.DataFrame(
+        np.hstack([rng.dirichlet(np.ones(3), len(COUNTIES)) for _ in range(2)]),
+        index=COUNTIES,
+        columns=[
+            "public",
+            "private",
+            "not_enrolled",
+            "public_prek",
+            "private_prek",
+            "not_enrolled_prek",
+        ],
+    )
+    buckets = list(EmploymentAgeBucket)[1:]
+    employment = {
+        sex: pd.DataFrame(
+            rng.random((len(COUNTIES), len(buckets))), index=COUNTIES, columns=buckets
+        )
+        for sex in ["male", "female"]
+    }
+
+    return {
+        "p_df": p_df,
+        "hh_df": hh_df,
+        "enrollment_df": enrollment_df,
+        "employment": employment,
+    }
+
+
+@pytest.fixture(scope="module")
+def pandas_persons(state: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    geo_df = merge_p_hh_df(state["p_df"], state["hh_df"])
+    seed_rng()
+    enrollment_df = assign_enrollment_to_persons(
+        assign_grade_to_persons(geo_df), state["enrollment_df"]
+    )
+
+    return geo_df, enrollment_df
+
+
+@pytest.fixture(scope="module")
+def arrow_persons(state: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    seed_rng()
+
+    return prepare_persons(state["p_df"], state["hh_df"], state["enrollment_df"])
+
+
+def test_merged_persons_are_equal(pandas_persons, arrow_persons):
+    pd.testing.assert_frame_equal(arrow_persons[0], pandas_persons[0])
+
+
+@pytest.mark.parametrize("column", ["grade", "enrollment"])
+def test_school_aged_persons_are_equal(pandas_persons, arrow_persons, column):
+    pd.testing.assert_series_equal(arrow_persons[1][column], pandas_persons[1][column])
+
+
+def test_employment_is_equal(state, pandas_persons, arrow_persons):
+    employed = []
+    for geo_df, _ in [pandas_persons, arrow_persons]:
+        seed_rng()
+        employed.append(
+            assign_employment_to_persons(geo_df, state["employment"])["employed"]
+        )
+
+    pd.testing.assert_series_equal(employed[1], employed[0])
+
+
+def test_grade_codes_match_pandas_engine():
+    ages = np.arange(120)
+    grades = [map_age_to_grade(age) for age in ages]
+    expected = [-1 if grade is None else grade.value for grade in grades]
+
+    np.testing.assert_array_equal(get_grade_codes(ages), expected)
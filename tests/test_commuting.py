@@ -0,0 +1,51 @@
+"""
+Checks the CSR commuting models (`to_csr_model`) and the destinations drawn
+from them (`sample_destinations`) on a tiny model.
+"""
+
+import numpy as np
+import pytest
+
+from fred_pop_gen.commuting import sample_destinations, to_csr_model
+
+# origin "a" has three destinations, "b" a single one and "c" none
+ORIGINS = np.array(["a", "b", "c"], dtype=object)
+DESTINATIONS = np.array(["x", "y", "z"], dtype=object)
+ORIGIN_CODES = np.array([0, 1, 0, 0])
+DESTINATION_CODES = np.array([2, 1, 0, 1])
+WEIGHTS = np.array([1.0, 5.0, 6.0, 3.0])
+
+N_DRAWS = 100_000
+
+
+@pytest.fixture(scope="module")
+def model() -> dict[str, np.ndarray]:
+    """
+    The model of the unsorted pairs above.
+    """
+    return to_csr_model(ORIGINS, DESTINATIONS, ORIGIN_CODES, DESTINATION_CODES, WEIGHTS)
+
+
+def test_csr_model_layout(model):
+    np.testing.assert_array_equal(model["indptr"], [0, 3, 4, 4])
+    np.testing.assert_array_equal(model["indices"], [0, 1, 2, 1])
+    # row i holds i plus the cumulative shares of its destinations, sorted
+    np.testing.assert_allclose(model["cdf"], [0.6, 0.9, 1.0, 2.0])
+
+
+def test_sampled_destinations_follow_weights(model):
+    rng = np.random.default_rng(0)
+
+    sampled = sample_destinations(model, np.full(N_DRAWS, "a", dtype=object), rng)
+
+    shares = np.bincount(sampled, minlength=len(DESTINATIONS)) / N_DRAWS
+    np.testing.assert_allclose(shares, [0.6, 0.3, 0.1], atol=0.01)
+
+
+def test_sampled_destinations_of_other_origins(model):
+    rng = np.random.default_rng(0)
+    origins = np.array(["b", "c", "unknown", "b"], dtype=object)
+
+    sampled = sample_destinations(model, origins, rng)
+
+    np.testing.assert_array_equal(sampled, [1, -1, -1, 1])
@@ -0,0 +1,81 @@
+"""
+Checks the unit-vector distance kernels (`get_distance_matrix` and
+`get_paired_distances`) against `haversine`, including the error bound of
+float32 vectors claimed by `get_distance_matrix`.
+"""
+
+import numpy as np
+import pytest
+
+from fred_pop_gen.distance import (
+    get_distance_matrix,
+    get_paired_distances,
+    get_unit_vectors,
+)
+from fred_pop_gen.utils import haversine
+
+# error bound of each distance with float32 vectors, in miles
+FLOAT32_TOLERANCE = 1e-3
+
+TOLERANCES = {"float64": 1e-9, "float32": FLOAT32_TOLERANCE}
+
+
+@pytest.fixture(scope="module")
+def points() -> dict[str, np.ndarray]:
+    """
+    Points spread over the contiguous US, and points within about a mile of
+    the first ones.
+    """
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(25, 49, 500), rng.uniform(-125, -67, 500)
+
+    return {
+        "lat": lat,
+        "lon": lon,
+        "other_lat": rng.uniform(25, 49, 300),
+        "other_lon": rng.uniform(-125, -67, 300),
+        "near_lat": lat + rng.uniform(-0.01, 0.01, len(lat)),
+        "near_lon": lon + rng.uniform(-0.01, 0.01, len(lon)),
+    }
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+@pytest.mark.parametrize("n_threads", [1, 4])
+def test_distance_matrix_matches_haversine(points, dtype, n_threads):
+    expected = haversine(
+        points["lat"][:, None],
+        points["lon"][:, None],
+        points["other_lat"][None, :],
+        points["other_lon"][None, :],
+    )
+
+    matrix = get_distance_matrix(
+        get_unit_vectors(points["lat"], points["lon"], dtype),
+        get_unit_vectors(points["other_lat"], points["other_lon"], dtype),
+        n_threads=n_threads,
+    )
+
+    assert matrix.dtype == dtype
+    np.testing.assert_allclose(matrix, expected, rtol=0, atol=TOLERANCES[dtype])
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_paired_distances_match_haversine(points, dtype):
+    expected = haversine(
+        points["lat"], points["lon"], points["near_lat"], points["near_lon"]
+    )
+
+    distances = get_paired_distances(
+        get_unit_vectors(points["lat"], points["lon"], dtype),
+        get_unit_vectors(points["near_lat"], points["near_lon"], dtype),
+    )
+
+    np.testing.assert_allclose(distances, expected, rtol=0, atol=TOLERANCES[dtype])
+
+
+def test_distance_matrix_of_identical_points_is_zero(points):
+    vectors = get_unit_vectors(points["lat"], points["lon"])
+
+    np.testing.assert_allclose(
+        np.diag(get_distance_matrix(vectors, vectors)), 0, rtol=0, atol=1e-9
+    )
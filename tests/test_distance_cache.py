@@ -0,0 +1,116 @@
+"""
+Checks the distance cache (`get_cached_distance_matrix`): its content keys,
+hits, atomic writes and the eviction of the least recently used matrices.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from fred_pop_gen.distance import get_distance_matrix, get_unit_vectors
+from fred_pop_gen.distance_cache import (
+    evict_least_recently_used,
+    get_cache_key,
+    get_cached_distance_matrix,
+)
+
+
+@pytest.fixture(scope="module")
+def vectors() -> list[np.ndarray]:
+    """
+    Unit vectors of households and of the schools of three counties.
+    """
+    rng = np.random.default_rng(0)
+
+    return [
+        get_unit_vectors(rng.uniform(41, 45, n), rng.uniform(-111, -104, n))
+        for n in (50, 7, 8, 9)
+    ]
+
+
+def get_entries(dir) -> list[str]:
+    return sorted(path.name for path in dir.iterdir())
+
+
+def test_cache_keys(vectors):
+    households, schools = vectors[:2]
+    key = get_cache_key(households, schools)
+
+    assert get_cache_key(households.copy(), schools.copy()) == key
+    assert get_cache_key(schools, households) != key
+    assert get_cache_key(households[1:], schools) != key
+    assert get_cache_key(households.astype(np.float32), schools) != key
+
+    moved = households.copy()
+    moved[0, 0] = np.nextafter(moved[0, 0], 1)
+    assert get_cache_key(moved, schools) != key
+
+
+def test_cache_miss_and_hit(tmp_path, vectors):
+    households, schools = vectors[:2]
+    expected = get_distance_matrix(households, schools)
+
+    matrix = get_cached_distance_matrix(households, schools, dir=tmp_path)
+    np.testing.assert_array_equal(matrix, expected)
+    # the matrix is moved into place once written, so no temporary file is left
+    assert get_entries(tmp_path) == [f"{get_cache_key(households, schools)}.npy"]
+
+    hit = get_cached_distance_matrix(households, schools, dir=tmp_path)
+    assert isinstance(hit, np.memmap)
+    np.testing.assert_array_equal(hit, expected)
+
+
+def test_partial_entry_is_recomputed(tmp_path, vectors):
+    households, schools = vectors[:2]
+    path = tmp_path / f"{get_cache_key(households, schools)}.npy"
+    path.write_bytes(b"\x93NUMPY")
+
+    matrix = get_cached_distance_matrix(households, schools, dir=tmp_path)
+
+    np.testing.assert_array_equal(matrix, get_distance_matrix(households, schools))
+    np.testing.assert_array_equal(np.load(path), matrix)
+
+
+def test_matrix_larger_than_cache_is_not_cached(tmp_path, vectors):
+    households, schools = vectors[:2]
+    size = len(households) * len(schools) * households.itemsize
+
+    matrix = get_cached_distance_matrix(
+        households, schools, dir=tmp_path, max_size=size - 1
+    )
+
+    assert matrix is None
+    assert get_entries(tmp_path) == []
+
+
+def test_least_recently_used_matrices_are_evicted(tmp_path, vectors):
+    households, *counties = vectors
+    paths = []
+    for i, schools in enumerate(counties):
+        get_cached_distance_matrix(households, schools, dir=tmp_path)
+        path = tmp_path / f"{get_cache_key(households, schools)}.npy"
+        os.utime(path, (i, i))
+        paths.append(path)
+
+    # a hit makes the oldest matrix the most recently used
+    get_cached_distance_matrix(households, counties[0], dir=tmp_path)
+
+    sizes = [path.stat().st_size for path in paths]
+    evict_least_recently_used(tmp_path, sizes[0] + sizes[2])
+
+    assert [path.exists() for path in paths] == [True, False, True]
+
+
+def test_new_matrix_evicts_beyond_cache_size(tmp_path, vectors):
+    households, *counties = vectors
+    get_cached_distance_matrix(households, counties[0], dir=tmp_path)
+    first = tmp_path / f"{get_cache_key(households, counties[0])}.npy"
+    os.utime(first, (0, 0))
+
+    get_cached_distance_matrix(
+        households, counties[1], dir=tmp_path, max_size=first.stat().st_size + 1000
+    )
+
+    assert not first.exists()
+    assert get_entries(tmp_path) == [f"{get_cache_key(households, counties[1])}.npy"]
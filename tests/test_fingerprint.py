@@ -0,0 +1,134 @@
+"""
+Checks the fingerprints of populations (`fingerprint_df`) and their
+comparison, exactly and with a statistical tolerance (`compare_manifests` and
+the `compare` command).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fred_pop_gen.fingerprint import (
+    compare_manifests,
+    fingerprint_df,
+    main,
+    write_manifest,
+)
+
+COUNTIES = ["56001", "56003", "56005"]
+
+N_PERSONS = 3000
+
+# maximum z-score of the statistics of a reseeded population
+TOLERANCE = 4
+
+
+def get_population(seed: int) -> pd.DataFrame:
+    """
+    Draws the age, enrollment and school of the persons of every county, where
+    only enrolled persons have a school.
+    """
+    rng = np.random.default_rng(seed)
+    n = N_PERSONS * len(COUNTIES)
+
+    enrolled = rng.random(n) < 0.3
+    schools = rng.choice(["A001", "A002", "A003"], n).astype(object)
+    schools[~enrolled] = None
+
+    return pd.DataFrame(
+        {
+            "county_fips": np.repeat(COUNTIES, N_PERSONS),
+            "age": rng.integers(0, 90, n),
+            "enrolled": enrolled,
+            "school_id": schools,
+        },
+        index=pd.Index([f"p{i}" for i in range(n)], name="sp_id"),
+    )
+
+
+@pytest.fixture(scope="module")
+def population() -> pd.DataFrame:
+    """
+    The reference population, see `get_population`.
+    """
+    return get_population(0)
+
+
+def test_fingerprint_ignores_row_order_and_int_width(population):
+    shuffled = population.sample(frac=1, random_state=1)
+    shuffled["age"] = shuffled["age"].astype(np.int16)
+
+    assert fingerprint_df(shuffled) == fingerprint_df(population)
+
+
+def test_fingerprint_changes_with_values(population):
+    changed = population.copy()
+    changed.loc["p0", "age"] += 1
+
+    expected, actual = fingerprint_df(population), fingerprint_df(changed)
+
+    assert expected["counties"]["56001"]["age"] != actual["counties"]["56001"]["age"]
+    assert expected["counties"]["56003"] == actual["counties"]["56003"]
+
+
+def test_compare_reports_first_differing_county_and_column(population):
+    changed = population.copy()
+    changed.loc[changed["county_fips"] == "56005", "age"] += 1
+    changed.loc[changed["county_fips"] == "56003", "school_id"] = "A001"
+
+    differences = compare_manifests(fingerprint_df(population), fingerprint_df(changed))
+
+    assert differences == [
+        ("56003", "school_id", "values differ"),
+        ("56005", "age", "values differ"),
+    ]
+
+
+def test_compare_reports_missing_counties_and_columns(population):
+    changed = population.loc[population["county_fips"] != "56001"]
+    changed = changed.drop(columns="enrolled")
+
+    differences = compare_manifests(fingerprint_df(population), fingerprint_df(changed))
+
+    assert differences[0] == ("56001", "", "county is missing")
+    assert differences[1:] == [
+        (county, "enrolled", "column is missing") for county in COUNTIES[1:]
+    ]
+
+
+@pytest.fixture
+def manifests(tmp_path, population) -> dict[str, str]:
+    """
+    Writes the manifests of the population, of a reseeded population and of
+    a population whose ages are shifted by five years.
+    """
+    shifted = population.copy()
+    shifted["age"] += 5
+
+    paths = {}
+    for name, df in [
+        ("expected", population),
+        ("reseeded", get_population(1)),
+        ("shifted", shifted),
+    ]:
+        paths[name] = str(tmp_path / f"{name}.json")
+        write_manifest(fingerprint_df(df), tmp_path / f"{name}.json")
+
+    return paths
+
+
+def test_tolerance_accepts_reseeded_population(manifests, capsys):
+    compare = ["compare", manifests["expected"], manifests["reseeded"]]
+
+    assert main(compare) == 1
+    assert main(compare + ["--tolerance", str(TOLERANCE)]) == 0
+    assert capsys.readouterr().out.endswith("fingerprints match\n")
+
+
+def test_tolerance_rejects_shifted_mean(manifests, capsys):
+    compare = ["compare", manifests["expected"], manifests["shifted"]]
+
+    assert main(compare + ["--tolerance", str(TOLERANCE)]) == 1
+    assert capsys.readouterr().out.startswith(
+        "first difference: county 56001, column age: mean differs"
+    )
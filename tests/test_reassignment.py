@@ -0,0 +1,117 @@
+"""
+Checks that the incremental reassignment (`reassign_schools`) gives the same
+schools as a full `assign_schools_to_persons` with the edited schools, for
+school closures and capacity cuts and raises, with person and household
+assignment units.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fred_pop_gen import task_assign_schools
+from fred_pop_gen.constants import Grade
+from fred_pop_gen.reassignment import get_reassignment_index, reassign_schools
+from fred_pop_gen.task_assign_schools import (
+    assign_schools_to_persons,
+    get_school_distances,
+)
+from fred_pop_gen.utils import get_grade_mask
+
+N_HOUSEHOLDS = 300
+
+# grade spans of the schools, as `Grade` values
+GRADE_SPANS = [(0, 6)] * 5 + [(7, 9)] * 3 + [(10, 13)] * 3 + [(0, 13)]
+
+# edits of the schools, as positions of the schools to close and capacities
+# to scale by position
+EDITS = {
+    "close": ([0], {}),
+    "cut": ([], {7: 0.7}),
+    "raise": ([], {8: 1.5}),
+    "close and resize": ([2, 9], {0: 0.5, 6: 2.0, 11: 0.8}),
+    "close a level": ([8, 9, 10, 11], {}),
+}
+
+
+@pytest.fixture(scope="module")
+def population() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Households of one to four school-aged persons and schools whose total
+    capacity falls short of their students, so that capacities bind.
+    """
+    rng = np.random.default_rng(0)
+
+    hh_df = pd.DataFrame(
+        {
+            "lat": rng.uniform(41, 42, N_HOUSEHOLDS),
+            "lon": rng.uniform(-105, -104, N_HOUSEHOLDS),
+        }
+    )
+
+    hh_idx = np.repeat(np.arange(N_HOUSEHOLDS), rng.integers(1, 5, N_HOUSEHOLDS))
+    p_df = pd.DataFrame(
+        {
+            "hh_idx": hh_idx,
+            "grade": [Grade(value) for value in rng.integers(0, 14, len(hh_idx))],
+        },
+        index=pd.Index([f"p{i}" for i in range(len(hh_idx))], name="sp_id"),
+    )
+
+    lowest, highest = np.array(GRADE_SPANS).T
+    sch_df = pd.DataFrame(
+        {
+            "lat": rng.uniform(41, 42, len(GRADE_SPANS)),
+            "lon": rng.uniform(-105, -104, len(GRADE_SPANS)),
+            "grades": get_grade_mask(lowest, highest),
+            "enrollment_total": rng.integers(20, 80, len(GRADE_SPANS)),
+        },
+        index=pd.Index([f"s{i:02}" for i in range(len(GRADE_SPANS))], name="sch_id"),
+    )
+
+    return p_df, sch_df, hh_df
+
+
+def assign_schools(
+    p_df: pd.DataFrame, sch_df: pd.DataFrame, hh_df: pd.DataFrame
+) -> pd.Series:
+    dist_df = get_school_distances(p_df, sch_df, hh_df)
+
+    return assign_schools_to_persons(p_df, sch_df, dist_df)["school_id"]
+
+
+@pytest.mark.parametrize("unit", ["person", "household"])
+@pytest.mark.parametrize("edit", EDITS)
+def test_reassignment_matches_full_assignment(population, monkeypatch, unit, edit):
+    monkeypatch.setattr(task_assign_schools, "SCHOOL_ASSIGNMENT_UNIT", unit)
+    p_df, sch_df, hh_df = population
+
+    index = get_reassignment_index(
+        p_df, sch_df, get_school_distances(p_df, sch_df, hh_df)
+    )
+
+    closed, scales = EDITS[edit]
+    edited_df = sch_df.copy()
+    for position, scale in scales.items():
+        edited_df.iloc[position, edited_df.columns.get_loc("enrollment_total")] = int(
+            scale * sch_df["enrollment_total"].iloc[position]
+        )
+    edited_df = edited_df.drop(sch_df.index[closed])
+
+    previous = assign_schools(p_df, sch_df, hh_df)
+    expected = assign_schools(p_df, edited_df, hh_df)
+    changed = previous.ne(expected) & (previous.notna() | expected.notna())
+    assert changed.any()
+
+    delta = reassign_schools(index, edited_df)
+
+    pd.testing.assert_frame_equal(
+        delta.sort_index(),
+        pd.DataFrame(
+            {
+                "previous_school_id": previous[changed].to_numpy(),
+                "school_id": expected[changed].to_numpy(),
+            },
+            index=pd.Index(p_df.index[changed], name="p_id"),
+        ).sort_index(),
+    )
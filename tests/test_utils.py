@@ -0,0 +1,36 @@
+"""
+Checks the grade masks of the schools (`get_grade_mask` and
+`get_grade_range`).
+"""
+
+import warnings
+
+import numpy as np
+
+from fred_pop_gen.constants import Grade
+from fred_pop_gen.utils import get_grade_mask, get_grade_range
+
+
+def test_grade_mask_round_trips():
+    n_grades = len(Grade)
+    lowest, highest = np.triu_indices(n_grades)
+
+    mask = get_grade_mask(lowest, highest)
+    for grade in range(n_grades):
+        offered = (mask >> grade) & 1 == 1
+        np.testing.assert_array_equal(offered, (lowest <= grade) & (grade <= highest))
+
+    np.testing.assert_array_equal(get_grade_range(mask), (lowest, highest))
+
+
+def test_inverted_grade_spans_offer_nothing():
+    lowest, highest = np.array([5, 4, 13]), np.array([3, 3, 0])
+
+    mask = get_grade_mask(lowest, highest)
+    np.testing.assert_array_equal(mask, 0)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        decoded = get_grade_range(mask)
+
+    np.testing.assert_array_equal(decoded, ([-1, -1, -1], [-1, -1, -1]))
@@ -0,0 +1,233 @@
+"""
+Checks the work queue (`work_queue`): leases, retries and the reuse of items
+when a stage is rerun, and worker processes serving a queue together while
+one of them dies.
+"""
+
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from fred_pop_gen.config import QUEUE_MAX_ATTEMPTS
+from fred_pop_gen.work_queue import (
+    claim_item,
+    connect,
+    enqueue_items,
+    finish_item,
+    remove_stale_items,
+    remove_unused_inputs,
+    renew_lease,
+    run_worker,
+    write_input,
+)
+
+N_WORKERS = 3
+
+# short leases, so that the items of a dead worker are claimed again quickly
+LEASE_SECONDS = 1.0
+HEARTBEAT_SECONDS = 0.2
+
+
+def square(x: int) -> pd.DataFrame:
+    return pd.DataFrame({"x": [x], "square": [x * x]})
+
+
+def sleep(seconds: float) -> pd.DataFrame:
+    """
+    Runs longer than a lease, so its worker has to renew it.
+    """
+    time.sleep(seconds)
+    return square(0)
+
+
+def fail_once(marker: str) -> pd.DataFrame:
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        raise ValueError("first attempt")
+    return square(1)
+
+
+def die_once(marker: str) -> pd.DataFrame:
+    """
+    Kills its worker on the first attempt, without finishing the item.
+    """
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return square(2)
+
+
+def fail() -> pd.DataFrame:
+    raise ValueError("always")
+
+
+def get_item(tmp_path, key: str, fn: str = "square", cost: float = 0, **args):
+    return {
+        "key": key,
+        "fn": f"{__name__}:{fn}",
+        "args": args,
+        "output": str(tmp_path / "outputs" / f"{key}.parquet"),
+        "cost": cost,
+    }
+
+
+def get_rows(conn) -> dict[str, dict]:
+    return {row["key"]: dict(row) for row in conn.execute("SELECT * FROM items")}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect(tmp_path / "queue.sqlite")
+    yield conn
+    conn.close()
+
+
+def test_claim_item_leases_costliest_pending_item(tmp_path, conn):
+    enqueue_items(
+        conn,
+        [get_item(tmp_path, key, cost=cost, x=1) for key, cost in [("a", 1), ("b", 3)]],
+    )
+
+    assert claim_item(conn, "w1")["key"] == "b"
+    assert claim_item(conn, "w2")["key"] == "a"
+    assert claim_item(conn, "w3") is None
+
+    rows = get_rows(conn)
+    assert (rows["b"]["status"], rows["b"]["worker"]) == ("running", "w1")
+    assert rows["b"]["attempts"] == 1
+
+
+def test_expired_lease_is_claimed_again(tmp_path, conn):
+    enqueue_items(conn, [get_item(tmp_path, "a", x=1)])
+
+    claim_item(conn, "w1", lease=-1)
+    assert claim_item(conn, "w2", lease=-1, max_attempts=2)["key"] == "a"
+
+    # the first worker lost the item, and its result is ignored
+    assert not renew_lease(conn, "a", "w1")
+    finish_item(conn, "a", "w1")
+    assert get_rows(conn)["a"]["worker"] == "w2"
+
+    # an item that expires `max_attempts` times fails
+    assert claim_item(conn, "w3", max_attempts=2) is None
+    assert get_rows(conn)["a"]["status"] == "failed"
+
+
+def test_renewed_lease_is_not_claimed(tmp_path, conn):
+    enqueue_items(conn, [get_item(tmp_path, "a", x=1)])
+
+    claim_item(conn, "w1", lease=-1)
+    assert renew_lease(conn, "a", "w1")
+    assert claim_item(conn, "w2") is None
+
+
+def test_finish_item_retries_until_max_attempts(tmp_path, conn):
+    enqueue_items(conn, [get_item(tmp_path, "a", x=1)])
+
+    for attempt in range(1, 3):
+        claim_item(conn, "w1")
+        finish_item(conn, "a", "w1", error="error", max_attempts=2)
+        row = get_rows(conn)["a"]
+        assert (row["attempts"], row["error"]) == (attempt, "error")
+
+    assert row["status"] == "failed"
+    assert claim_item(conn, "w1") is None
+
+
+def test_enqueue_items_reuses_done_and_running_items(tmp_path, conn):
+    items = [get_item(tmp_path, key, x=1) for key in ["done", "lost", "running"]]
+    enqueue_items(conn, items)
+
+    for key in ["done", "lost"]:
+        assert claim_item(conn, "w1")["key"] == key
+        finish_item(conn, key, "w1")
+    claim_item(conn, "w1")
+    (tmp_path / "outputs").mkdir()
+    square(1).to_parquet(items[0]["output"])
+
+    enqueue_items(conn, items)
+    # the output of "lost" is missing, so it is rerun
+    assert {key: row["status"] for key, row in get_rows(conn).items()} == {
+        "done": "done",
+        "lost": "pending",
+        "running": "running",
+    }
+
+    enqueue_items(conn, [get_item(tmp_path, "done", x=2)])
+    assert get_rows(conn)["done"]["status"] == "pending"
+
+
+def test_remove_stale_items(tmp_path, conn):
+    items = [get_item(tmp_path, key, x=1) for key in ["s/a", "s/b", "s/c", "t/a"]]
+    enqueue_items(conn, items)
+    claim_item(conn, "w1")
+    (tmp_path / "outputs" / "s").mkdir(parents=True)
+    square(1).to_parquet(items[1]["output"])
+
+    remove_stale_items(conn, "s/", ["s/c"])
+
+    # "s/a" is still running under its lease
+    assert sorted(get_rows(conn)) == ["s/a", "s/c", "t/a"]
+    assert not os.path.exists(items[1]["output"])
+
+
+def test_remove_unused_inputs(tmp_path, conn):
+    dir = tmp_path / "inputs"
+    old = write_input(pd.DataFrame({"x": [1]}), dir, "shard")
+    new = write_input(pd.DataFrame({"x": [2]}), dir, "shard")
+    assert write_input(pd.DataFrame({"x": [2]}), dir, "shard") == new
+
+    enqueue_items(conn, [get_item(tmp_path, "a", "square", inputs=str(new))])
+    remove_unused_inputs(conn, dir)
+
+    assert not old.exists()
+    assert new.exists()
+
+
+def test_workers_run_every_item(tmp_path, conn):
+    items = [get_item(tmp_path, f"square-{x}", x=x) for x in range(8)]
+    items += [
+        get_item(tmp_path, "sleep", "sleep", cost=3, seconds=3 * LEASE_SECONDS),
+        get_item(tmp_path, "fail_once", "fail_once", marker=str(tmp_path / "f")),
+        get_item(tmp_path, "die_once", "die_once", cost=2, marker=str(tmp_path / "d")),
+        get_item(tmp_path, "fail", "fail", cost=1),
+    ]
+    enqueue_items(conn, items)
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(tmp_path / "queue.sqlite",),
+            kwargs={
+                "poll": 0.1,
+                "lease": LEASE_SECONDS,
+                "heartbeat": HEARTBEAT_SECONDS,
+            },
+        )
+        for _ in range(N_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+
+    assert sorted(worker.exitcode for worker in workers) == [0] * (N_WORKERS - 1) + [1]
+
+    rows = get_rows(conn)
+    statuses = {key: row["status"] for key, row in rows.items()}
+    assert statuses == {item["key"]: "done" for item in items} | {"fail": "failed"}
+
+    assert rows["sleep"]["attempts"] == 1
+    assert rows["fail_once"]["attempts"] == 2
+    assert rows["die_once"]["attempts"] == 2
+    assert rows["fail"]["attempts"] == QUEUE_MAX_ATTEMPTS
+    assert "always" in rows["fail"]["error"]
+
+    for x in range(8):
+        df = pd.read_parquet(items[x]["output"])
+        assert df.to_dict("list") == {"x": [x], "square": [x * x]}
+    assert not list((tmp_path / "outputs").glob("*.tmp"))